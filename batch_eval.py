@@ -0,0 +1,91 @@
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from search import PIECE_SQUARE, evaluate
+from xiangqi import FILES, RANKS, SQUARES, start_position
+
+# Đánh giá hàng loạt thế cờ bằng NumPy, dùng cho việc xử lý ngoại tuyến (xếp hạng nước đi, chấm điểm kho ván cờ,
+# đặt trọng số sách khai cuộc). Bàn cờ là mảng int8 (N, 10, 9): hàng y, cột x, giá trị là mã quân như trong xiangqi.py,
+# cùng hướng với mảng state của realtime_chinese_chess_tracker.py (hàng 0 là hàng cuối của quân đỏ)
+BATCH_CHUNK = 65536  # Số thế cờ mỗi lần tra bảng, giới hạn bộ nhớ của mảng chỉ số tạm
+CHECK_POSITIONS = 2000
+BENCHMARK_POSITIONS = 1000000
+
+# Bảng điểm phẳng: PIECE_SQUARE_FLAT[mã quân * 90 + ô], quân đen mang dấu âm
+PIECE_SQUARE_FLAT = np.array(PIECE_SQUARE, dtype=np.int32).reshape(-1)
+SQUARE_OFFSETS = np.arange(SQUARES, dtype=np.intp)
+
+
+def boards_from_positions(positions):
+    # Gom các Position thành mảng (N, 10, 9) int8
+    data = b"".join(bytes(position.board) for position in positions)
+    return np.frombuffer(data, dtype=np.int8).reshape(-1, RANKS, FILES)
+
+
+def evaluate_batch(boards):
+    # Điểm giá trị quân + vị trí của từng thế cờ theo góc nhìn quân đỏ, giống search.evaluate()
+    boards = np.asarray(boards, dtype=np.int8).reshape(-1, SQUARES)
+    scores = np.empty(len(boards), dtype=np.int32)
+    for start in range(0, len(boards), BATCH_CHUNK):
+        chunk = boards[start:start + BATCH_CHUNK]
+        indices = chunk.astype(np.intp) * SQUARES + SQUARE_OFFSETS
+        scores[start:start + len(chunk)] = PIECE_SQUARE_FLAT.take(indices).sum(axis=1)
+    return scores
+
+
+def random_positions(count, max_plies=80, rng=random):
+    # Các thế cờ lấy từ những ván đi ngẫu nhiên từ thế xuất phát
+    positions = []
+    while len(positions) < count:
+        position = start_position()
+        for _ in range(rng.randrange(max_plies)):
+            moves = position.legal_moves()
+            if not moves:
+                break
+            position.make_move(rng.choice(moves))
+            positions.append(position.copy())
+            if len(positions) == count:
+                break
+    return positions
+
+
+def check(count=CHECK_POSITIONS):
+    # So sánh với đánh giá từng thế cờ của search.evaluate()
+    positions = random_positions(count)
+    scores = evaluate_batch(boards_from_positions(positions))
+    mismatches = [i for i, position in enumerate(positions) if scores[i] != evaluate(position)]
+    for i in mismatches[:10]:
+        print(f"Sai khác: {positions[i].fen()} batch={scores[i]} scalar={evaluate(positions[i])}")
+    print(f"Kiểm tra {count} thế cờ: {len(mismatches)} sai khác")
+    return not mismatches
+
+
+def benchmark(count=BENCHMARK_POSITIONS):
+    # Lặp lại một mẫu thế cờ ngẫu nhiên cho đủ count rồi đo tốc độ
+    sample = boards_from_positions(random_positions(min(count, 10000)))
+    boards = np.resize(sample, (count, RANKS, FILES))
+    start = time.perf_counter()
+    evaluate_batch(boards)
+    elapsed = time.perf_counter() - start
+    print(f"Đánh giá {count} thế cờ trong {elapsed:.3f}s ({count / elapsed * 60:,.0f} thế cờ/phút)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đánh giá hàng loạt thế cờ bằng NumPy")
+    parser.add_argument("--check", action="store_true", help="So sánh với đánh giá từng thế cờ trên các thế cờ ngẫu nhiên")
+    parser.add_argument("--benchmark", type=int, nargs="?", const=BENCHMARK_POSITIONS, help="Đo tốc độ với số thế cờ cho trước")
+    parser.add_argument("--seed", type=int, default=1, help="Hạt giống cho các ván ngẫu nhiên")
+    args = parser.parse_args()
+    
+    random.seed(args.seed)
+    if not args.check and args.benchmark is None:
+        parser.print_help()
+        sys.exit(1)
+    if args.check and not check():
+        sys.exit(1)
+    if args.benchmark is not None:
+        benchmark(args.benchmark)
@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from xiangqi import (REPETITION_NONE, START_FEN, Position, move_dst, move_src, perft, square_x, square_y,
+                     start_position)
+
+# Bộ đo hiệu năng chạy không cần màn hình: perft kèm kiểm tra số nút, băm Zobrist, FEN và Board.move_piece
+# Kết quả có thể ghi ra JSON để so sánh giữa các phiên bản: python benchmark.py --json bench.json
+# Với --json - chỉ JSON được in ra stdout, các dòng tiến trình chuyển sang stderr
+
+# (tên, FEN, số nút perft đã biết ở độ sâu 1, 2, ...)
+# Thế cờ xuất phát và "midgame" là các giá trị đã công bố; các thế cờ còn lại được đối chiếu với một bộ sinh nước đi độc lập
+PERFT_POSITIONS = (
+    ("start", START_FEN, (44, 1920, 79666, 3290240, 133312995)),
+    ("midgame", "r1ba1a3/4kn3/2n1b4/pNp1p1p1p/4c4/6P2/P1P2R2P/1CcC5/9/2BAKAB2 w - - 0 1", (38, 1128, 43929, 1339047)),
+    ("cannon_screens", "1rbakab2/9/1cn1c1n2/p1p1p1p1p/9/2P3P2/P3P3P/2N1C1NC1/9/1RBAKAB1R w - - 0 1",
+     (43, 1153, 48852, 1416574)),
+    ("horse_legs", "2bakab2/9/4n4/2n1p1N2/3N5/2P1P4/9/4B4/4A4/2BAK4 w - - 0 1", (25, 391, 8463, 127220)),
+    ("flying_general", "4k4/4a4/9/9/9/9/9/4R4/4A4/4K4 b - - 0 1", (2, 38, 174, 3494)),
+    ("in_check", "3k5/4a4/2n1c4/9/9/9/9/4C4/5R3/4K4 w - - 0 1", (11, 234, 6729, 144703)),
+)
+PERFT_DEPTH = 3  # Độ sâu mặc định, đủ nhanh để chạy thường xuyên; --depth 5 để chạy đầy đủ
+SAMPLE_GAMES = 20  # Số ván ngẫu nhiên dùng cho các phép đo băm, FEN và move_piece
+SAMPLE_PLIES = 60
+
+
+def random_games(count, plies, rng):
+    # Các ván đi ngẫu nhiên từ thế xuất phát, dừng sớm khi hết nước hoặc lặp thế cờ
+    games = []
+    for _ in range(count):
+        position = start_position()
+        moves = []
+        for _ in range(plies):
+            legal = position.legal_moves()
+            if not legal or position.repetition() != REPETITION_NONE:
+                break
+            move = rng.choice(legal)
+            position.make_move(move)
+            moves.append(move)
+        games.append(moves)
+    return games
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def rate(count, seconds):
+    return round(count / seconds) if seconds > 0 else 0
+
+
+def benchmark_perft(depth):
+    results = []
+    for name, fen, expected in PERFT_POSITIONS:
+        position = Position.from_fen(fen)
+        for current_depth in range(1, min(depth, len(expected)) + 1):
+            nodes, seconds = timed(perft, position, current_depth)
+            ok = nodes == expected[current_depth - 1]
+            results.append({
+                'position': name,
+                'depth': current_depth,
+                'nodes': nodes,
+                'expected': expected[current_depth - 1],
+                'ok': ok,
+                'seconds': round(seconds, 4),
+                'nps': rate(nodes, seconds),
+            })
+            print(f"perft {name} độ sâu {current_depth}: {nodes} nút {'OK' if ok else 'SAI (cần ' + str(expected[current_depth - 1]) + ')'}"
+                  f", {seconds:.3f}s, {rate(nodes, seconds)} nút/s")
+    return results
+
+
+def benchmark_hashing(games):
+    # Băm toàn bộ bàn cờ (compute_key) so với cập nhật dần trong make_move / unmake_move
+    positions = []
+    for moves in games:
+        position = start_position()
+        for move in moves:
+            position.make_move(move)
+            positions.append(position.copy())
+    
+    def full_hashes():
+        for position in positions:
+            position.compute_key()
+    
+    def incremental_hashes():
+        count = 0
+        for moves in games:
+            position = start_position()
+            for move in moves:
+                position.make_move(move)
+            for _ in moves:
+                position.unmake_move()
+                count += 2
+        return count
+    
+    _, full_seconds = timed(full_hashes)
+    updates, incremental_seconds = timed(incremental_hashes)
+    ok = all(position.key == position.compute_key() for position in positions)
+    print(f"Băm Zobrist: {rate(len(positions), full_seconds)} thế cờ/s toàn bộ, "
+          f"{rate(updates, incremental_seconds)} make/unmake/s cập nhật dần, khóa {'khớp' if ok else 'SAI'}")
+    return {
+        'positions': len(positions),
+        'full_per_second': rate(len(positions), full_seconds),
+        'incremental_updates': updates,
+        'incremental_per_second': rate(updates, incremental_seconds),
+        'ok': ok,
+    }
+
+
+def benchmark_fen(games):
+    # FEN -> Position -> FEN phải cho lại đúng chuỗi và đúng khóa Zobrist
+    fens = []
+    keys = []
+    for moves in games:
+        position = start_position()
+        for move in moves:
+            position.make_move(move)
+            fens.append(position.fen())
+            keys.append(position.key)
+    
+    positions, parse_seconds = timed(lambda: [Position.from_fen(fen) for fen in fens])
+    round_trip, format_seconds = timed(lambda: [position.fen() for position in positions])
+    ok = round_trip == fens and [position.key for position in positions] == keys
+    print(f"FEN: đọc {rate(len(fens), parse_seconds)}/s, ghi {rate(len(fens), format_seconds)}/s, "
+          f"khứ hồi {'khớp' if ok else 'SAI'}")
+    return {
+        'positions': len(fens),
+        'parse_per_second': rate(len(fens), parse_seconds),
+        'format_per_second': rate(len(fens), format_seconds),
+        'ok': ok,
+    }
+
+
+def benchmark_move_piece(games):
+    # Đo Board.move_piece (kiểm tra hợp lệ, cập nhật quân cờ, thông báo chiếu / lặp) không kèm engine
+    try:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        from chess import Board
+    except ImportError as e:
+        print(f"Bỏ qua Board.move_piece: {e}")
+        return None
+    from engine_async import EngineLoop
+    from engine_pool import EnginePool
+    
+    # Pool không có phiên nào và không dùng phiên dự phòng: Board không bao giờ hỏi engine
+    pool = EnginePool(0, fallback="")
+    loop = EngineLoop()
+    board = Board(pool, loop)
+    
+    def play():
+        count = 0
+        fens = []
+        for moves in games:
+            board.initialize_board()
+            for move in moves:
+                src, dst = move_src(move), move_dst(move)
+                board.move_piece(board.get_piece_at(square_x(src), square_y(src)), square_x(dst), square_y(dst))
+                count += 1
+            fens.append(board.fen())
+        return count, fens
+    
+    try:
+        (moves, fens), seconds = timed(play)
+    finally:
+        pool.close()
+        loop.close()
+    
+    # Sau mỗi ván, bàn cờ phải trùng với thế cờ khi đi cùng các nước bằng Position
+    expected = []
+    for game in games:
+        position = start_position()
+        for move in game:
+            position.make_move(move)
+        expected.append(position.fen())
+    ok = fens == expected
+    print(f"Board.move_piece: {moves} nước trong {seconds:.3f}s ({rate(moves, seconds)} nước/s), "
+          f"thế cờ cuối {'khớp' if ok else 'SAI'}")
+    return {
+        'moves': moves,
+        'seconds': round(seconds, 4),
+        'moves_per_second': rate(moves, seconds),
+        'ok': ok,
+    }
+
+
+def run(depth=PERFT_DEPTH, seed=1):
+    games = random_games(SAMPLE_GAMES, SAMPLE_PLIES, random.Random(seed))
+    results = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'perft_depth': depth,
+        'perft': benchmark_perft(depth),
+        'hashing': benchmark_hashing(games),
+        'fen': benchmark_fen(games),
+        'move_piece': benchmark_move_piece(games),
+    }
+    # Tất cả các phép kiểm tra: số nút perft, khóa Zobrist, FEN khứ hồi và thế cờ sau Board.move_piece (nếu chạy được)
+    results['ok'] = (all(entry['ok'] for entry in results['perft'])
+                     and results['hashing']['ok'] and results['fen']['ok']
+                     and (results['move_piece'] is None or results['move_piece']['ok']))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo hiệu năng sinh nước đi, băm Zobrist, FEN và Board.move_piece")
+    parser.add_argument("--depth", type=int, default=PERFT_DEPTH, help="Độ sâu perft tối đa")
+    parser.add_argument("--json", help="Ghi kết quả ra tệp JSON (\"-\" để in ra màn hình)")
+    parser.add_argument("--seed", type=int, default=1, help="Hạt giống cho các ván ngẫu nhiên")
+    args = parser.parse_args()
+    
+    # Khi in JSON ra stdout, mọi dòng khác (kể cả từ pygame và EnginePool) chuyển sang stderr
+    output = contextlib.redirect_stdout(sys.stderr) if args.json == "-" else contextlib.nullcontext()
+    with output:
+        results = run(args.depth, args.seed)
+    if args.json == "-":
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi kết quả vào {args.json}")
+    
+    if not results['ok']:
+        print("Có kết quả không khớp giá trị đã biết", file=sys.stderr)
+        sys.exit(1)
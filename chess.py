@@ -1,17 +1,26 @@
 import pygame
+import collections
 import os
 import sys
 import threading
 import time
-import paramiko
-import socket
-import re
+
+import metrics
+from elephanteye import POSITION_MOVES_LIMIT, SEARCH_DEPTH, SEARCH_TIMEOUT, AnalysisState, SearchResult, interpret_score, position_from_moves
+from engine_async import EngineLoop, search_with_pool
+from engine_cache import EngineCache
+from engine_pool import EnginePool
+from opening_book import load_book
+from xiangqi import (ADVISOR, BISHOP, CANNON, EMPTY, KING, KNIGHT, PAWN, ROOK, SQUARES, START_FEN,
+                     REPETITION_DRAW, REPETITION_LOSS, REPETITION_NONE,
+                     Position, make_move, move_to_ucci, piece_is_red, piece_type, square, square_x, square_y,
+                     ucci_to_move)
 
 # Kích thước bàn cờ
 CELL_SIZE = 60
 BOARD_WIDTH = 9 * CELL_SIZE
 BOARD_HEIGHT = 10 * CELL_SIZE
-INFO_PANEL_HEIGHT = 150
+INFO_PANEL_HEIGHT = 190
 WINDOW_WIDTH = BOARD_WIDTH
 WINDOW_HEIGHT = BOARD_HEIGHT + INFO_PANEL_HEIGHT
 
@@ -26,13 +35,25 @@ LIGHT_BROWN = (222, 184, 135)
 HIGHLIGHT_COLOR = (0, 255, 0, 128)  # Màu xanh lá cây với độ trong suốt
 LAST_MOVE_COLOR = (255, 255, 0)  # Màu vàng cho nước đi gần nhất
 
-# Thông tin kết nối Raspberry Pi
-PI_HOST = "192.168.100.88"
-PI_PORT = 22
-PI_USERNAME = "nsd"
-PI_PASSWORD = "1"
-ELEPHANTEYE_DIR = "/home/nsd/eleeye/eleeye"
-ELEPHANTEYE_EXEC = "eleeye"
+PV_MOVES_SHOWN = 6  # Số nước của biến chính hiển thị trên panel
+REPETITION_LIMIT = 2  # Xử lý lặp khi thế cờ xuất hiện lần thứ ba
+FPS = 60  # Tốc độ khung hình khi đang có thay đổi (ElephantEye đang tìm kiếm, vừa có nước đi...)
+IDLE_WAIT_MS = 250  # Khi không có gì thay đổi, chờ sự kiện tối đa chừng này mili giây
+
+FRAME_SECONDS = metrics.histogram("ui_frame_seconds", "Thời gian cập nhật và vẽ một khung hình có thay đổi")
+FRAMES_SKIPPED = metrics.counter("ui_frames_idle_total", "Số vòng lặp không có gì cần vẽ lại")
+
+# Mã quân cờ trong xiangqi.py tương ứng với tên quân
+PIECE_CODES = {
+    "Vua": KING,
+    "Si": ADVISOR,
+    "Tuong": BISHOP,
+    "Ma": KNIGHT,
+    "Xe": ROOK,
+    "Phao": CANNON,
+    "Tot": PAWN,
+}
+PIECE_NAMES = {code: name for name, code in PIECE_CODES.items()}
 
 # Danh sách font hỗ trợ Unicode
 UNICODE_FONTS = [
@@ -45,8 +66,20 @@ UNICODE_FONTS = [
     None  # Fallback to default
 ]
 
-# Hàm khởi tạo font hỗ trợ Unicode
+# Font đã tìm được theo (cỡ chữ, đậm) và bộ nhớ đệm LRU các dòng chữ đã vẽ theo (chữ, cỡ, đậm, màu)
+FONT_CACHE = {}
+TEXT_CACHE = collections.OrderedDict()
+TEXT_CACHE_SIZE = 256
+
+# Hàm lấy font hỗ trợ Unicode, mỗi (cỡ chữ, đậm) chỉ tìm một lần
 def get_unicode_font(size, bold=False):
+    key = (size, bold)
+    font = FONT_CACHE.get(key)
+    if font is None:
+        font = FONT_CACHE[key] = find_unicode_font(size, bold)
+    return font
+
+def find_unicode_font(size, bold=False):
     # Thử từng font trong danh sách cho đến khi tìm được font khả dụng
     for font_name in UNICODE_FONTS:
         try:
@@ -61,7 +94,96 @@ def get_unicode_font(size, bold=False):
     # Nếu không tìm được font nào, sử dụng font mặc định
     return pygame.font.Font(pygame.font.get_default_font(), size)
 
+# Vẽ một dòng chữ, dùng lại Surface đã vẽ nếu chữ, font và màu không đổi
+def render_text(text, size, color, bold=True):
+    key = (text, size, bold, color)
+    surface = TEXT_CACHE.get(key)
+    if surface is not None:
+        TEXT_CACHE.move_to_end(key)
+        return surface
+    
+    surface = get_unicode_font(size, bold).render(text, True, color)
+    TEXT_CACHE[key] = surface
+    if len(TEXT_CACHE) > TEXT_CACHE_SIZE:
+        TEXT_CACHE.popitem(last=False)
+    return surface
+
+# Thư mục ảnh quân cờ và chữ cái trong tên tệp ảnh ({r|b}{chữ cái}.png) của từng loại quân
+PIECE_IMAGE_DIR = os.environ.get("CHESS_IMAGE_DIR", "C:/Users/duong.ns/Desktop/chess/images")
+PIECE_IMAGE_LETTERS = {
+    "Vua": "k",  # Tướng/Vua
+    "Si": "a",  # Sĩ
+    "Tuong": "e",  # Tượng
+    "Xe": "r",  # Xe
+    "Ma": "h",  # Mã
+    "Phao": "c",  # Pháo
+    "Tot": "p",  # Tốt/Binh
+}
+
+class PieceAtlas:
+    # Ảnh của 14 loại quân được tải một lần vào một Surface chung, mọi Piece dùng chung các vùng con
+    def __init__(self):
+        self.cell_size = None
+        self.sheet = None
+        self.sprites = {}
+    
+    def get(self, kind, is_red):
+        # Tạo lại bảng ảnh khi kích thước ô cờ thay đổi
+        if self.cell_size != CELL_SIZE:
+            self.build()
+        return self.sprites[(kind, is_red)]
+    
+    def build(self):
+        self.cell_size = CELL_SIZE
+        image_size = int(CELL_SIZE * 0.8)  # 80% kích thước ô cờ
+        fallback_size = CELL_SIZE - 10
+        slot = max(image_size, fallback_size)
+        
+        keys = [(kind, is_red) for is_red in (True, False) for kind in PIECE_IMAGE_LETTERS]
+        self.sheet = pygame.Surface((slot * len(keys), slot), pygame.SRCALPHA)
+        self.sprites = {}
+        
+        for index, (kind, is_red) in enumerate(keys):
+            image = self.load_image(kind, is_red, image_size)
+            if image is None:
+                image = self.render_fallback(kind, is_red, fallback_size)
+            
+            rect = image.get_rect(topleft=(index * slot, 0))
+            self.sheet.blit(image, rect)
+            self.sprites[(kind, is_red)] = rect
+        
+        # convert_alpha cần cửa sổ pygame đã được tạo
+        if pygame.display.get_surface() is not None:
+            self.sheet = self.sheet.convert_alpha()
+        self.sprites = {key: self.sheet.subsurface(rect) for key, rect in self.sprites.items()}
+    
+    def load_image(self, kind, is_red, size):
+        color = "r" if is_red else "b"
+        image_path = os.path.join(PIECE_IMAGE_DIR, f"{color}{PIECE_IMAGE_LETTERS[kind]}.png")
+        if not os.path.exists(image_path):
+            return None
+        
+        # Tải hình ảnh và điều chỉnh kích thước để vừa với ô cờ
+        original_image = pygame.image.load(image_path)
+        return pygame.transform.smoothscale(original_image, (size, size))
+    
+    def render_fallback(self, kind, is_red, size):
+        # Tạo hình ảnh mặc định nếu không tìm thấy file
+        surface = pygame.Surface((size, size), pygame.SRCALPHA)
+        pygame.draw.circle(surface, RED if is_red else BLACK,
+                        (surface.get_width() // 2, surface.get_height() // 2),
+                        surface.get_width() // 2)
+        text = render_text(kind, 20, WHITE)
+        text_rect = text.get_rect(center=(surface.get_width() // 2, surface.get_height() // 2))
+        surface.blit(text, text_rect)
+        return surface
+
+PIECE_ATLAS = PieceAtlas()
+
 class Piece:
+    # Lớp hiển thị của một quân cờ: trạng thái ván cờ nằm trong xiangqi.Position, ảnh nằm trong PIECE_ATLAS
+    __slots__ = ("piece_type", "is_red", "x", "y", "selected", "last_moved")
+    
     def __init__(self, piece_type, is_red, x, y):
         self.piece_type = piece_type
         self.is_red = is_red
@@ -69,43 +191,11 @@ class Piece:
         self.y = y
         self.selected = False
         self.last_moved = False  # Đánh dấu nước đi gần nhất
-        
-        # Tải hình ảnh quân cờ
-        self.image = self.load_image()
-    
-    def load_image(self):
-        color = "r" if self.is_red else "b"
-        piece_images = {
-            "vua": f"C:/Users/duong.ns/Desktop/chess/images/{color}k.png",  # Tướng/Vua
-            "si": f"C:/Users/duong.ns/Desktop/chess/images/{color}a.png",  # Sĩ
-            "tuong": f"C:/Users/duong.ns/Desktop/chess/images/{color}e.png",  # Tượng
-            "xe": f"C:/Users/duong.ns/Desktop/chess/images/{color}r.png",  # Xe
-            "ma": f"C:/Users/duong.ns/Desktop/chess/images/{color}h.png",  # Mã
-            "phao": f"C:/Users/duong.ns/Desktop/chess/images/{color}c.png",  # Pháo
-            "tot": f"C:/Users/duong.ns/Desktop/chess/images/{color}p.png",  # Tốt/Binh
-        }
-        
-        image_path = piece_images.get(self.piece_type.lower())
-        if image_path and os.path.exists(image_path):
-            # Tải hình ảnh
-            original_image = pygame.image.load(image_path)
-            
-            # Điều chỉnh kích thước hình ảnh để vừa với ô cờ
-            target_size = int(CELL_SIZE * 0.8)  # 80% kích thước ô cờ
-            scaled_image = pygame.transform.smoothscale(original_image, (target_size, target_size))
-            
-            return scaled_image
-        else:
-            # Tạo hình ảnh mặc định nếu không tìm thấy file
-            surface = pygame.Surface((CELL_SIZE - 10, CELL_SIZE - 10), pygame.SRCALPHA)
-            pygame.draw.circle(surface, RED if self.is_red else BLACK, 
-                            (surface.get_width() // 2, surface.get_height() // 2), 
-                            surface.get_width() // 2)
-            font = get_unicode_font(20, True)
-            text = font.render(self.piece_type, True, WHITE)
-            text_rect = text.get_rect(center=(surface.get_width() // 2, surface.get_height() // 2))
-            surface.blit(text, text_rect)
-            return surface
+    
+    @property
+    def image(self):
+        # Ảnh quân cờ lấy từ bảng ảnh dùng chung, không tải lại cho từng quân
+        return PIECE_ATLAS.get(self.piece_type, self.is_red)
     
     def draw(self, surface):
         # Tính toán vị trí trên màn hình
@@ -120,250 +210,43 @@ class Piece:
         if self.selected:
             pygame.draw.circle(surface, GREEN, (screen_x, screen_y), CELL_SIZE // 2 - 2)
         
-        # Vẽ quân cờ
-        if self.image:
-            image_rect = self.image.get_rect(center=(screen_x, screen_y))
-            surface.blit(self.image, image_rect)
-        else:
-            # Vẽ hình tròn nếu không có hình ảnh
-            color = RED if self.is_red else BLACK
-            pygame.draw.circle(surface, color, (screen_x, screen_y), CELL_SIZE // 2 - 5)
-            
-            # Vẽ chữ
-            font = get_unicode_font(20, True)
-            text = font.render(self.piece_type, True, WHITE)
-            text_rect = text.get_rect(center=(screen_x, screen_y))
-            surface.blit(text, text_rect)
+        # Vẽ quân cờ (bảng ảnh đã có ảnh dự phòng cho quân thiếu tệp ảnh)
+        image = self.image
+        surface.blit(image, image.get_rect(center=(screen_x, screen_y)))
         
         # Vẽ viền cho nước đi gần nhất
         if self.last_moved:
             pygame.draw.circle(surface, LAST_MOVE_COLOR, (screen_x, screen_y), CELL_SIZE // 2, 3)
 
-class ElephantEyeEngine:
-    def __init__(self):
-        self.ssh = None
-        self.sftp = None
-        self.connected = False
-        self.last_evaluation = 0
-        self.last_depth = 0
-        self.last_nodes = 0
-        self.last_time = 0
-        self.player_is_red = True
-    
-    def start(self):
-        try:
-            # Khởi tạo kết nối SSH
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.ssh.connect(PI_HOST, PI_PORT, PI_USERNAME, PI_PASSWORD)
-            
-            # Tạo SFTP
-            self.sftp = self.ssh.open_sftp()
-            
-            # Kiểm tra phiên bản ElephantEye
-            stdin, stdout, stderr = self.ssh.exec_command(
-                f"cd {ELEPHANTEYE_DIR} && (echo 'ucci'; sleep 1; echo 'quit') | ./{ELEPHANTEYE_EXEC}"
-            )
-            
-            try:
-                stdout.channel.settimeout(5)
-                ucci_response = stdout.read().decode('utf-8')
-                for line in ucci_response.split('\n'):
-                    if line.startswith("id version"):
-                        print(f"ElephantEye {line.split()[2]}")
-                        break
-            except socket.timeout:
-                print("Timeout khi đọc phản hồi từ lệnh ucci")
-            
-            self.connected = True
-            return True
-        
-        except Exception as e:
-            print(f"Lỗi khi kết nối với Raspberry Pi: {e}")
-            return False
-    
-    def get_best_move(self, moves, callback):
-        if not self.connected:
-            callback(None, 0, 0, 0, 0)
-            return
-        
-        def worker():
-            try:
-                # Chuẩn bị FEN chuỗi ban đầu
-                fen_start = "rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1"
-                
-                # Chuẩn bị chuỗi nước đi
-                moves_str = ' '.join(moves) if moves else ""
-                
-                # Tạo script để tương tác với ElephantEye
-                depth = 8  # Độ sâu tìm kiếm
-                wait_time = 2  # Thời gian đợi (giây)
-                
-                script_content = f"""#!/bin/bash
-cd {ELEPHANTEYE_DIR}
-(
-echo "ucci"
-sleep 0.5
-echo "setoption name Hash value 256"
-echo "setoption name Pruning value true"
-echo "setoption name Knowledge value 3"
-echo "setoption name Ponder value true"
-echo "position fen {fen_start}{' moves ' + moves_str if moves_str else ''}"
-sleep 0.5
-echo "go depth {depth}"
-sleep {wait_time}
-echo "quit"
-) | ./{ELEPHANTEYE_EXEC} > /tmp/chess_output.txt 2>/tmp/chess_error.txt
-"""
-                
-                # Lưu script vào file trên Raspberry Pi
-                with self.sftp.file('/tmp/chess_script.sh', 'w') as f:
-                    f.write(script_content)
-                
-                # Đặt quyền thực thi cho script
-                self.ssh.exec_command("chmod +x /tmp/chess_script.sh")
-                
-                # Chạy script
-                stdin, stdout, stderr = self.ssh.exec_command("/tmp/chess_script.sh")
-                
-                # Đợi script hoàn thành
-                exit_status = stdout.channel.recv_exit_status()
-                
-                # Đọc kết quả
-                stdin, stdout, stderr = self.ssh.exec_command("cat /tmp/chess_output.txt")
-                response = stdout.read().decode('utf-8')
-                
-                # Phân tích kết quả
-                analysis = self.analyze_response(response)
-                
-                # Lưu thông tin đánh giá
-                self.last_evaluation = analysis['score'] if analysis['score'] is not None else 0
-                self.last_depth = analysis['depth'] if analysis['depth'] is not None else 0
-                self.last_nodes = analysis['nodes'] if analysis['nodes'] is not None else 0
-                self.last_time = analysis['time'] if analysis['time'] is not None else 0
-                
-                # Gọi callback với kết quả
-                callback(analysis['bestmove'], self.last_evaluation, self.last_depth, self.last_nodes, self.last_time)
-                
-                # Dọn dẹp file tạm
-                self.ssh.exec_command("rm -f /tmp/chess_script.sh /tmp/chess_output.txt /tmp/chess_error.txt")
-            
-            except Exception as e:
-                print(f"Lỗi khi lấy nước đi tốt nhất: {e}")
-                callback(None, 0, 0, 0, 0)
-        
-        # Chạy trong một luồng riêng biệt
-        thread = threading.Thread(target=worker)
-        thread.daemon = True
-        thread.start()
-    
-    def analyze_response(self, response):
-        max_depth = 0
-        final_score = None
-        final_nodes = None
-        final_time = None
-        best_move = None
-        
-        # Tìm thông tin về độ sâu, điểm số và số nút
-        depth_pattern = re.compile(r'info depth (\d+) score (-?\d+)')
-        nodes_time_pattern = re.compile(r'info time (\d+) nodes (\d+)')
-        bestmove_pattern = re.compile(r'bestmove ([a-i]\d[a-i]\d)')
-        
-        for line in response.split('\n'):
-            depth_match = depth_pattern.match(line)
-            if depth_match:
-                depth = int(depth_match.group(1))
-                score = int(depth_match.group(2))
-                if depth > max_depth:
-                    max_depth = depth
-                    final_score = score
-            
-            nodes_time_match = nodes_time_pattern.match(line)
-            if nodes_time_match:
-                time_ms = int(nodes_time_match.group(1))
-                nodes = int(nodes_time_match.group(2))
-                final_time = time_ms / 1000  # Chuyển đổi sang giây
-                final_nodes = nodes
-            
-            bestmove_match = bestmove_pattern.match(line)
-            if bestmove_match:
-                best_move = bestmove_match.group(1)
-        
-        return {
-            'depth': max_depth,
-            'score': final_score,
-            'nodes': final_nodes,
-            'time': final_time,
-            'bestmove': best_move
-        }
-    
-    def interpret_score(self, score):
-        if score is None:
-            return "Không có đánh giá"
-        
-        abs_score = abs(score)
-        
-        # Xác định bên nào đang có lợi thế
-        if self.player_is_red:
-            # Người chơi là quân đỏ
-            if score < 0:
-                side = "Bạn"
-            else:
-                side = "Đối thủ"
-        else:
-            # Người chơi là quân đen
-            if score > 0:
-                side = "Bạn"
-            else:
-                side = "Đối thủ"
-        
-        if abs_score == 0:
-            return "Cân bằng (0)"
-        elif abs_score < 30:
-            return f"{side} có lợi thế rất nhỏ ({abs_score})"
-        elif abs_score < 100:
-            return f"{side} có lợi thế nhỏ ({abs_score})"
-        elif abs_score < 200:
-            return f"{side} có lợi thế quân tốt ({abs_score})"
-        elif abs_score < 500:
-            return f"{side} có lợi thế đáng kể ({abs_score})"
-        elif abs_score < 900:
-            return f"{side} có lợi thế lớn ({abs_score})"
-        elif abs_score < 10000:
-            return f"{side} có lợi thế thắng cuộc ({abs_score})"
-        else:
-            return f"{side} chiếu bí ({abs_score})"
-    
-    def set_player_color(self, is_red):
-        self.player_is_red = is_red
-    
-    def stop(self):
-        if self.sftp:
-            self.sftp.close()
-        
-        if self.ssh:
-            self.ssh.close()
-        
-        self.connected = False
-
 class Board:
-    def __init__(self):
+    def __init__(self, engine_pool=None, engine_loop=None, engine_cache=None, opening_book=None, fen=START_FEN):
         self.pieces = []
         self.selected_piece = None
-        self.moves = []
         self.current_player_is_red = True  # Quân đỏ luôn đi trước
         self.evaluation = "Cân bằng (0)"
         self.depth = 0
         self.nodes = 0
         self.time = 0
         self.player_is_red = True  # Mặc định người chơi điều khiển quân đỏ
-        self.engine = ElephantEyeEngine()
+        self.engine_pool = engine_pool or EnginePool(1)  # Pool ElephantEye, có thể dùng chung giữa nhiều bàn
+        self.engine_loop = engine_loop or EngineLoop()  # Event loop chạy các lần tìm kiếm
+        self.engine_cache = engine_cache  # Bộ nhớ đệm kết quả theo khóa thế cờ (None: luôn hỏi ElephantEye)
+        self.opening_book = opening_book  # Sách khai cuộc, tra trước khi hỏi ElephantEye
+        self.engine_future = None  # Lần tìm kiếm đang chạy
+        self.analysis_state = AnalysisState()  # Thông tin tìm kiếm cập nhật trực tiếp từ ElephantEye
+        self.analysis_mode = False  # Phân tích vô hạn thế cờ trong lượt của người chơi
+        self.analysis_future = None  # Lần phân tích đang chạy
         self.engine_connected = False
+        self.engine_move_pending = False  # Đến lượt máy khi chưa kết nối xong, update() sẽ hỏi lại ElephantEye
         self.waiting_for_engine = False
         self.status_message = "Khởi động..."
+        self.connection_message = "Khởi động..."  # Trạng thái kết nối, hiển thị lại khi bắt đầu ván mới
         self.last_moved_piece = None  # Quân cờ di chuyển gần nhất
         self.last_move_from = None  # Vị trí xuất phát của nước đi gần nhất
         self.last_move_to = None  # Vị trí đích của nước đi gần nhất
+        self.background = None  # Surface chứa phần tĩnh của bàn cờ, tạo ở lần vẽ đầu tiên
+        self.invalidate()
+        self.start_fen = fen  # Thế cờ xuất phát của ván
         
         # Khởi tạo bàn cờ
         self.initialize_board()
@@ -371,89 +254,83 @@ class Board:
         # Kết nối với ElephantEye
         self.connect_to_engine()
         
-        # Nếu người chơi điều khiển quân đen, ElephantEye (quân đỏ) sẽ đi trước
-        if not self.player_is_red:
+        # Nếu thế cờ xuất phát đến lượt máy, ElephantEye sẽ đi trước
+        if not self.is_player_turn():
             self.get_engine_move()
     
     def connect_to_engine(self):
         def worker():
-            success = self.engine.start()
+            success = self.engine_pool.start()
             self.engine_connected = success
-            self.status_message = "Đã kết nối với ElephantEye" if success else "Không thể kết nối với ElephantEye"
+            if not success:
+                self.connection_message = "Không thể kết nối với ElephantEye"
+            elif self.engine_pool.fallback_active:
+                self.connection_message = "Không có ElephantEye, dùng bộ tìm kiếm tích hợp"
+            else:
+                self.connection_message = "Đã kết nối với ElephantEye"
+            self.status_message = self.connection_message
         
         thread = threading.Thread(target=worker)
         thread.daemon = True
         thread.start()
     
     def initialize_board(self):
-        # Xóa tất cả quân cờ
-        self.pieces = []
+        # Dựng thế cờ từ FEN xuất phát (mặc định là thế cờ ban đầu), kèm khóa Zobrist
+        self.position = Position.from_fen(self.start_fen)
         
-        # Khởi tạo quân đỏ (phía dưới)
-        # Xe
-        self.pieces.append(Piece("Xe", True, 0, 0))
-        self.pieces.append(Piece("Xe", True, 8, 0))
-        # Mã
-        self.pieces.append(Piece("Ma", True, 1, 0))
-        self.pieces.append(Piece("Ma", True, 7, 0))
-        # Tượng
-        self.pieces.append(Piece("Tuong", True, 2, 0))
-        self.pieces.append(Piece("Tuong", True, 6, 0))
-        # Sĩ
-        self.pieces.append(Piece("Si", True, 3, 0))
-        self.pieces.append(Piece("Si", True, 5, 0))
-        # Tướng
-        self.pieces.append(Piece("Vua", True, 4, 0))
-        # Pháo
-        self.pieces.append(Piece("Phao", True, 1, 2))
-        self.pieces.append(Piece("Phao", True, 7, 2))
-        # Tốt
-        self.pieces.append(Piece("Tot", True, 0, 3))
-        self.pieces.append(Piece("Tot", True, 2, 3))
-        self.pieces.append(Piece("Tot", True, 4, 3))
-        self.pieces.append(Piece("Tot", True, 6, 3))
-        self.pieces.append(Piece("Tot", True, 8, 3))
-        
-        # Khởi tạo quân đen (phía trên)
-        # Xe
-        self.pieces.append(Piece("Xe", False, 0, 9))
-        self.pieces.append(Piece("Xe", False, 8, 9))
-        # Mã
-        self.pieces.append(Piece("Ma", False, 1, 9))
-        self.pieces.append(Piece("Ma", False, 7, 9))
-        # Tượng
-        self.pieces.append(Piece("Tuong", False, 2, 9))
-        self.pieces.append(Piece("Tuong", False, 6, 9))
-        # Sĩ
-        self.pieces.append(Piece("Si", False, 3, 9))
-        self.pieces.append(Piece("Si", False, 5, 9))
-        # Tướng
-        self.pieces.append(Piece("Vua", False, 4, 9))
-        # Pháo
-        self.pieces.append(Piece("Phao", False, 1, 7))
-        self.pieces.append(Piece("Phao", False, 7, 7))
-        # Tốt
-        self.pieces.append(Piece("Tot", False, 0, 6))
-        self.pieces.append(Piece("Tot", False, 2, 6))
-        self.pieces.append(Piece("Tot", False, 4, 6))
-        self.pieces.append(Piece("Tot", False, 6, 6))
-        self.pieces.append(Piece("Tot", False, 8, 6))
+        # Tạo quân cờ để vẽ và bảng tra quân cờ theo ô
+        self.pieces = []
+        self.squares = [None] * SQUARES
+        for sq, code in enumerate(self.position.board):
+            if code != EMPTY:
+                piece = Piece(PIECE_NAMES[piece_type(code)], piece_is_red(code), square_x(sq), square_y(sq))
+                self.pieces.append(piece)
+                self.squares[sq] = piece
         
         # Đặt lại lượt đi
-        self.current_player_is_red = True
-        self.moves = []
+        self.current_player_is_red = self.position.red_to_move
         self.last_moved_piece = None
         self.last_move_from = None
         self.last_move_to = None
+        self.game_over = False
     
-    def draw(self, surface):
+    @property
+    def moves(self):
+        # Các nước đã đi từ thế xuất phát, dạng số 16 bit (array('H')) lưu ngay trong Position
+        return self.position.moves
+    
+    def fen(self):
+        return self.position.fen()
+    
+    def load_fen(self, fen):
+        # Bắt đầu ván mới từ một thế cờ bất kỳ, ví dụ thế cờ nhận dạng được từ ảnh chụp bàn cờ
+        try:
+            Position.from_fen(fen)
+        except ValueError as e:
+            self.status_message = f"FEN không hợp lệ: {e}"
+            return False
+        
+        self.start_fen = fen
+        self.reset_game()
+        return True
+    
+    def engine_position(self):
+        # Ván dài: gửi FEN của thế cờ hiện tại thay vì thế xuất phát kèm toàn bộ nước đi
+        if len(self.moves) > POSITION_MOVES_LIMIT:
+            return position_from_moves([], self.position.fen())
+        return position_from_moves([move_to_ucci(move) for move in self.moves], self.start_fen)
+    
+    def render_background(self):
+        # Phần tĩnh của bàn cờ (lưới, cung điện, sông) chỉ vẽ một lần vào Surface riêng
+        surface = pygame.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        
         # Vẽ nền bàn cờ
         surface.fill(LIGHT_BROWN)
         
         # Vẽ lưới
         for i in range(10):
             # Vẽ đường ngang
-            pygame.draw.line(surface, BLACK, 
+            pygame.draw.line(surface, BLACK,
                             (CELL_SIZE // 2, i * CELL_SIZE + CELL_SIZE // 2),
                             (BOARD_WIDTH - CELL_SIZE // 2, i * CELL_SIZE + CELL_SIZE // 2))
             
@@ -465,28 +342,94 @@ class Board:
         
         # Vẽ cung điện
         # Cung điện dưới
-        pygame.draw.line(surface, BLACK, 
+        pygame.draw.line(surface, BLACK,
                         (3 * CELL_SIZE + CELL_SIZE // 2, 0 * CELL_SIZE + CELL_SIZE // 2),
                         (5 * CELL_SIZE + CELL_SIZE // 2, 2 * CELL_SIZE + CELL_SIZE // 2))
-        pygame.draw.line(surface, BLACK, 
+        pygame.draw.line(surface, BLACK,
                         (5 * CELL_SIZE + CELL_SIZE // 2, 0 * CELL_SIZE + CELL_SIZE // 2),
                         (3 * CELL_SIZE + CELL_SIZE // 2, 2 * CELL_SIZE + CELL_SIZE // 2))
         
         # Cung điện trên
-        pygame.draw.line(surface, BLACK, 
+        pygame.draw.line(surface, BLACK,
                         (3 * CELL_SIZE + CELL_SIZE // 2, 9 * CELL_SIZE + CELL_SIZE // 2),
                         (5 * CELL_SIZE + CELL_SIZE // 2, 7 * CELL_SIZE + CELL_SIZE // 2))
-        pygame.draw.line(surface, BLACK, 
+        pygame.draw.line(surface, BLACK,
                         (5 * CELL_SIZE + CELL_SIZE // 2, 9 * CELL_SIZE + CELL_SIZE // 2),
                         (3 * CELL_SIZE + CELL_SIZE // 2, 7 * CELL_SIZE + CELL_SIZE // 2))
         
         # Vẽ sông
-        font = get_unicode_font(24, True)
-        text1 = font.render("Sông", True, BLUE)
-        text2 = font.render("Hà", True, BLUE)
+        text1 = render_text("Sông", 24, BLUE)
+        text2 = render_text("Hà", 24, BLUE)
         surface.blit(text1, (BOARD_WIDTH // 2 - text1.get_width() // 2, 4 * CELL_SIZE + 5))
         surface.blit(text2, (BOARD_WIDTH // 2 - text2.get_width() // 2, 5 * CELL_SIZE + 5))
         
+        return surface
+    
+    def square_rect(self, x, y):
+        return pygame.Rect(x * CELL_SIZE, (9 - y) * CELL_SIZE, CELL_SIZE, CELL_SIZE)
+    
+    def last_move_rect(self, last_move):
+        # Vùng bao quanh đường nối nước đi gần nhất (kể cả điểm đánh dấu)
+        if last_move is None:
+            return None
+        (from_x, from_y), (to_x, to_y) = last_move
+        return self.square_rect(from_x, from_y).union(self.square_rect(to_x, to_y))
+    
+    def board_signature(self):
+        # Những gì hiển thị trên từng ô; so với lần vẽ trước để biết ô nào cần vẽ lại
+        signature = [None] * SQUARES
+        for piece in self.pieces:
+            piece.selected = (piece == self.selected_piece)
+            piece.last_moved = (piece == self.last_moved_piece)
+            signature[square(piece.x, piece.y)] = (piece.piece_type, piece.is_red, piece.selected, piece.last_moved)
+        return signature
+    
+    def invalidate(self):
+        # Buộc vẽ lại toàn bộ ở khung hình tiếp theo (lần đầu, hoặc khi cửa sổ bị che rồi hiện lại)
+        self.drawn_squares = None
+        self.drawn_last_move = None
+        self.drawn_panel = None
+    
+    def draw(self, surface):
+        # Chỉ vẽ lại các ô và panel đã thay đổi, trả về danh sách Rect cho pygame.display.update
+        if self.background is None:
+            self.background = self.render_background()
+        
+        dirty = []
+        squares = self.board_signature()
+        last_move = (self.last_move_from, self.last_move_to) if self.last_move_from and self.last_move_to else None
+        
+        if self.drawn_squares is None:
+            dirty.append(pygame.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT))
+        else:
+            for sq in range(SQUARES):
+                if squares[sq] != self.drawn_squares[sq]:
+                    dirty.append(self.square_rect(square_x(sq), square_y(sq)))
+            if last_move != self.drawn_last_move:
+                for rect in (self.last_move_rect(self.drawn_last_move), self.last_move_rect(last_move)):
+                    if rect:
+                        dirty.append(rect)
+        
+        for rect in dirty:
+            self.draw_board_region(surface, rect)
+        self.drawn_squares = squares
+        self.drawn_last_move = last_move
+        
+        # Panel thông tin (kể cả màu nút phân tích) chỉ vẽ lại khi nội dung thay đổi
+        lines = self.info_panel_lines()
+        panel = (lines, self.analysis_mode)
+        if panel != self.drawn_panel:
+            self.draw_info_panel(surface, lines)
+            self.drawn_panel = panel
+            dirty.append(pygame.Rect(0, BOARD_HEIGHT, BOARD_WIDTH, INFO_PANEL_HEIGHT))
+        
+        return dirty
+    
+    def draw_board_region(self, surface, rect):
+        # Vẽ lại một vùng của bàn cờ: nền tĩnh, dấu nước đi gần nhất và các quân cờ nằm trong vùng
+        surface.set_clip(rect)
+        surface.blit(self.background, rect, rect)
+        
         # Vẽ điểm đánh dấu nước đi gần nhất
         if self.last_move_from and self.last_move_to:
             # Vẽ điểm xuất phát
@@ -503,55 +446,71 @@ class Board:
         
         # Vẽ các quân cờ
         for piece in self.pieces:
-            piece.selected = (piece == self.selected_piece)
-            piece.last_moved = (piece == self.last_moved_piece)
-            piece.draw(surface)
+            if self.square_rect(piece.x, piece.y).colliderect(rect):
+                piece.draw(surface)
         
-        # Vẽ panel thông tin
-        self.draw_info_panel(surface)
+        surface.set_clip(None)
     
-    def draw_info_panel(self, surface):
-        # Vẽ nền cho panel thông tin
-        pygame.draw.rect(surface, LIGHT_BROWN, (0, BOARD_HEIGHT, BOARD_WIDTH, INFO_PANEL_HEIGHT))
-        pygame.draw.rect(surface, BLACK, (0, BOARD_HEIGHT, BOARD_WIDTH, INFO_PANEL_HEIGHT), 2)
+    def info_panel_lines(self):
+        # Nội dung panel thông tin: danh sách (chuỗi, màu, vị trí)
+        lines = []
         
         # Hiển thị lượt đi
-        font = get_unicode_font(20, True)
         current_player = "Bạn" if (self.current_player_is_red and self.player_is_red) or (not self.current_player_is_red and not self.player_is_red) else "ElephantEye"
-        turn_text = font.render(f"Lượt đi: {current_player} ({('Đỏ' if self.current_player_is_red else 'Đen')})", True, RED if self.current_player_is_red else BLACK)
-        surface.blit(turn_text, (20, BOARD_HEIGHT + 15))
+        lines.append((f"Lượt đi: {current_player} ({('Đỏ' if self.current_player_is_red else 'Đen')})", RED if self.current_player_is_red else BLACK, (20, BOARD_HEIGHT + 15)))
+        
+        # Trong lúc ElephantEye tìm kiếm, hiển thị thông tin mới nhất thay vì kết quả nước trước
+        info = self.analysis_state.snapshot()
+        if info['active']:
+            # Điểm số tính theo bên đang đi; interpret_score giả định ElephantEye là bên đang đi
+            score = info['score']
+            if score is not None and self.is_player_turn():
+                score = -score
+            evaluation = interpret_score(score, self.player_is_red) if score is not None else "Đang tính..."
+            depth, nodes, time_spent = info['depth'], info['nodes'], info['time']
+        else:
+            evaluation, depth, nodes, time_spent = self.evaluation, self.depth, self.nodes, self.time
         
         # Hiển thị đánh giá
-        eval_text = font.render(f"Đánh giá: {self.evaluation}", True, BLACK)
-        surface.blit(eval_text, (20, BOARD_HEIGHT + 45))
+        lines.append((f"Đánh giá: {evaluation}", BLACK, (20, BOARD_HEIGHT + 45)))
         
         # Hiển thị độ sâu và số nút
-        depth_str = str(self.depth) if self.depth is not None else "0"
-        nodes_str = f"{self.nodes:,}" if self.nodes is not None else "0"
-        time_str = f"{self.time:.1f}" if self.time is not None else "0.0"
-        depth_nodes_text = font.render(f"Độ sâu: {depth_str} - Số nút: {nodes_str} - Thời gian: {time_str}s", True, BLACK)
-        surface.blit(depth_nodes_text, (20, BOARD_HEIGHT + 75))
+        depth_str = str(depth) if depth is not None else "0"
+        nodes_str = f"{nodes:,}" if nodes is not None else "0"
+        time_str = f"{time_spent:.1f}" if time_spent is not None else "0.0"
+        lines.append((f"Độ sâu: {depth_str} - Số nút: {nodes_str} - Thời gian: {time_str}s", BLACK, (20, BOARD_HEIGHT + 75)))
         
         # Hiển thị trạng thái
-        status_text = font.render(f"Trạng thái: {self.status_message}", True, BLUE)
-        surface.blit(status_text, (20, BOARD_HEIGHT + 105))
+        lines.append((f"Trạng thái: {self.status_message}", BLUE, (20, BOARD_HEIGHT + 105)))
         
         # Hiển thị nước đi gần nhất
         if self.last_move_from and self.last_move_to:
             from_str = f"{chr(97 + self.last_move_from[0])}{self.last_move_from[1]}"
             to_str = f"{chr(97 + self.last_move_to[0])}{self.last_move_to[1]}"
-            last_move_text = font.render(f"Nước đi gần nhất: {from_str}{to_str}", True, LAST_MOVE_COLOR)
-            surface.blit(last_move_text, (BOARD_WIDTH - 220, BOARD_HEIGHT + 105))
+            lines.append((f"Nước đi gần nhất: {from_str}{to_str}", LAST_MOVE_COLOR, (BOARD_WIDTH - 220, BOARD_HEIGHT + 105)))
+        
+        # Hiển thị tốc độ tìm kiếm và biến chính
+        pv_str = ' '.join(info['pv'][:PV_MOVES_SHOWN]) if info['pv'] else "-"
+        lines.append((f"NPS: {info['nps']:,} - Biến chính: {pv_str}", BLACK, (20, BOARD_HEIGHT + 135)))
+        return lines
+    
+    def draw_info_panel(self, surface, lines):
+        # Vẽ nền cho panel thông tin
+        pygame.draw.rect(surface, LIGHT_BROWN, (0, BOARD_HEIGHT, BOARD_WIDTH, INFO_PANEL_HEIGHT))
+        pygame.draw.rect(surface, BLACK, (0, BOARD_HEIGHT, BOARD_WIDTH, INFO_PANEL_HEIGHT), 2)
+        
+        for text, color, position in lines:
+            surface.blit(render_text(text, 20, color), position)
+    
+    def is_player_turn(self):
+        return self.current_player_is_red == self.player_is_red
     
     def get_piece_at(self, x, y):
-        for piece in self.pieces:
-            if piece.x == x and piece.y == y:
-                return piece
-        return None
+        return self.squares[square(x, y)]
     
     def select_piece(self, x, y):
         # Kiểm tra xem có đang đợi động cơ không
-        if self.waiting_for_engine:
+        if self.waiting_for_engine or self.game_over:
             return
         
         # Kiểm tra xem có phải lượt của người chơi không
@@ -589,19 +548,40 @@ class Board:
                 self.status_message = "Đó không phải là quân của bạn"
     
     def move_piece(self, piece, to_x, to_y):
+        # Kiểm tra nước đi hợp lệ trước khi gửi cho ElephantEye
+        move = make_move(square(piece.x, piece.y), square(to_x, to_y))
+        if not self.position.is_legal(move):
+            self.status_message = "Nước đi không hợp lệ"
+            return False
+        
+        self.apply_move(piece, to_x, to_y)
+        
+        # Thế cờ đã thay đổi, dừng phân tích thế cũ
+        self.stop_analysis()
+        
+        # Thông báo chiếu tướng / hết nước đi / lặp thế cờ mà không cần hỏi ElephantEye
+        check_message = self.check_message()
+        if check_message:
+            self.status_message = check_message
+            if self.game_over:
+                return True
+        
+        # Nếu là lượt của máy, lấy nước đi từ ElephantEye
+        is_engine_turn = (self.current_player_is_red and not self.player_is_red) or (not self.current_player_is_red and self.player_is_red)
+        if is_engine_turn:
+            self.get_engine_move()
+        
+        return True
+    
+    def apply_move(self, piece, to_x, to_y):
         # Lưu vị trí cũ
         from_x, from_y = piece.x, piece.y
         
-        # Kiểm tra quân ở vị trí đích
+        # Ăn quân ở vị trí đích
         target_piece = self.get_piece_at(to_x, to_y)
         if target_piece:
-            # Không thể ăn quân cùng màu
-            if target_piece.is_red == piece.is_red:
-                return False
-            # Ăn quân
             self.pieces.remove(target_piece)
         
-        # Đánh dấu nước đi gần nhất
         # Đặt lại trạng thái đánh dấu cho tất cả quân cờ
         if self.last_moved_piece:
             self.last_moved_piece.last_moved = False
@@ -612,81 +592,168 @@ class Board:
         self.last_move_to = (to_x, to_y)
         
         # Di chuyển quân cờ
+        self.squares[square(from_x, from_y)] = None
+        self.squares[square(to_x, to_y)] = piece
         piece.x, piece.y = to_x, to_y
         
-        # Chuyển đổi sang định dạng UCCI
-        move = chr(97 + from_x) + str(from_y) + chr(97 + to_x) + str(to_y)
-        
-        # Thêm nước đi vào lịch sử
-        self.moves.append(move)
+        # Cập nhật thế cờ (khóa Zobrist được cập nhật dần), nước đi được lưu trong lịch sử của Position
+        move = make_move(square(from_x, from_y), square(to_x, to_y))
+        self.position.make_move(move)
         
         # Đổi lượt
         self.current_player_is_red = not self.current_player_is_red
-        
-        # Nếu là lượt của máy, lấy nước đi từ ElephantEye
-        is_engine_turn = (self.current_player_is_red and not self.player_is_red) or (not self.current_player_is_red and self.player_is_red)
-        if is_engine_turn and self.engine_connected:
-            self.get_engine_move()
-        
-        return True
+    
+    def check_message(self):
+        # Thông báo cho bên vừa đến lượt: bị chiếu, bị chiếu bí, hết nước đi hoặc lặp thế cờ
+        in_check = self.position.in_check()
+        if self.position.is_checkmate():
+            self.game_over = True
+            return "Chiếu bí!" if in_check else "Hết nước đi!"
+        
+        repetition = self.position.repetition(REPETITION_LIMIT)
+        if repetition != REPETITION_NONE:
+            self.game_over = True
+            if repetition == REPETITION_DRAW:
+                return "Lặp lại thế cờ - Hòa!"
+            # Bên chiếu mãi / đuổi mãi bị xử thua
+            loser_is_red = self.current_player_is_red == (repetition == REPETITION_LOSS)
+            return f"{'Đỏ' if loser_is_red else 'Đen'} chiếu mãi / đuổi mãi - Xử thua!"
+        
+        if in_check:
+            return "Chiếu tướng!"
+        return None
     
     def get_engine_move(self):
+        # Thế cờ có trong sách khai cuộc thì đi ngay, không cần ElephantEye
+        book_move = self.opening_book.choose(self.position) if self.opening_book else None
+        if book_move:
+            self.stop_analysis()
+            self.on_move_received(SearchResult(book_move), "Sách khai cuộc")
+            return
+        
         if not self.engine_connected:
+            # Luồng kết nối chưa xong (hoặc thất bại): update() gọi lại khi engine_connected chuyển sang True
+            self.engine_move_pending = True
             return
         
+        self.engine_move_pending = False
+        self.stop_analysis()
         self.waiting_for_engine = True
         self.status_message = "ElephantEye đang suy nghĩ..."
         
-        # Lấy nước đi tốt nhất từ ElephantEye
-        def on_move_received(move, evaluation, depth, nodes, time):
-            if move:
-                # Chuyển đổi từ định dạng UCCI sang tọa độ
-                from_x = ord(move[0]) - 97
-                from_y = int(move[1])
-                to_x = ord(move[2]) - 97
-                to_y = int(move[3])
+        # Tìm nước đi trong event loop chung; kết quả được áp dụng ở update() trên luồng pygame
+        # Các dòng info được đẩy vào analysis_state để panel cập nhật trong lúc chờ
+        # Thế cờ đã gặp trước đó được lấy ngay từ bộ nhớ đệm theo khóa Zobrist
+        self.analysis_state.reset(active=True)
+        position = self.engine_position()
+        self.engine_future = self.engine_loop.submit(
+            search_with_pool(self.engine_pool, position, depth=SEARCH_DEPTH, timeout=SEARCH_TIMEOUT,
+                             on_info=self.analysis_state.update, cache=self.engine_cache, key=self.position.key)
+        )
+    
+    def start_analysis(self):
+        # Phân tích vô hạn thế cờ hiện tại cho đến khi stop_analysis() được gọi
+        if not self.engine_connected or self.waiting_for_engine:
+            return
+        
+        self.stop_analysis()
+        self.analysis_state.reset(active=True)
+        self.status_message = "Đang phân tích..."
+        position = self.engine_position()
+        self.analysis_future = self.engine_loop.submit(
+            search_with_pool(self.engine_pool, position, on_info=self.analysis_state.update)
+        )
+    
+    def stop_analysis(self):
+        # Hủy coroutine phân tích: ElephantEye nhận "stop" và phiên được trả về pool
+        if self.analysis_future:
+            self.analysis_future.cancel()
+            self.analysis_future = None
+            self.analysis_state.finish()
+    
+    def toggle_analysis(self):
+        self.analysis_mode = not self.analysis_mode
+        if self.analysis_mode and self.is_player_turn():
+            self.start_analysis()
+        elif not self.analysis_mode:
+            self.stop_analysis()
+            self.status_message = "Đã dừng phân tích"
+    
+    def update(self):
+        # Nước đi của máy bị hoãn vì lúc đó chưa kết nối xong với ElephantEye
+        if self.engine_move_pending and self.engine_connected:
+            self.get_engine_move()
+        
+        # Phân tích chỉ kết thúc khi bị hủy hoặc mất kết nối
+        if self.analysis_future and self.analysis_future.done():
+            self.analysis_future = None
+            self.analysis_state.finish()
+        
+        # Gọi mỗi khung hình: nhận kết quả tìm kiếm nếu ElephantEye đã trả lời
+        future = self.engine_future
+        if future is None or not future.done():
+            return
+        
+        self.engine_future = None
+        if future.cancelled():
+            return
+        
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Lỗi khi lấy nước đi tốt nhất: {e}")
+            result = None
+        
+        self.on_move_received(result)
+    
+    def on_move_received(self, result, source="ElephantEye"):
+        self.analysis_state.finish()
+        move = result.bestmove if result else None
+        if move:
+            # Chuyển đổi từ định dạng UCCI sang tọa độ
+            from_x = ord(move[0]) - 97
+            from_y = int(move[1])
+            to_x = ord(move[2]) - 97
+            to_y = int(move[3])
+            
+            # Tìm quân cờ tại vị trí xuất phát
+            piece = self.get_piece_at(from_x, from_y)
+            if piece and self.position.is_legal(ucci_to_move(move)):
+                self.apply_move(piece, to_x, to_y)
                 
-                # Tìm quân cờ tại vị trí xuất phát
-                piece = self.get_piece_at(from_x, from_y)
-                if piece:
-                    # Đặt lại trạng thái đánh dấu cho tất cả quân cờ
-                    if self.last_moved_piece:
-                        self.last_moved_piece.last_moved = False
-                    
-                    # Lưu thông tin nước đi gần nhất
-                    self.last_moved_piece = piece
-                    self.last_move_from = (from_x, from_y)
-                    self.last_move_to = (to_x, to_y)
-                    
-                    # Di chuyển quân cờ
-                    target_piece = self.get_piece_at(to_x, to_y)
-                    if target_piece:
-                        self.pieces.remove(target_piece)
-                    
-                    piece.x, piece.y = to_x, to_y
-                    
-                    # Thêm nước đi vào lịch sử
-                    self.moves.append(move)
-                    
-                    # Cập nhật thông tin đánh giá
-                    self.evaluation = self.engine.interpret_score(evaluation)
-                    self.depth = depth
-                    self.nodes = nodes
-                    self.time = time
-                    
-                    # Đổi lượt
-                    self.current_player_is_red = not self.current_player_is_red
-                    
-                    self.status_message = f"ElephantEye đã đi: {move}"
-                else:
-                    self.status_message = f"Lỗi: Không tìm thấy quân cờ tại {move[0]}{move[1]}"
+                # Cập nhật thông tin đánh giá
+                self.evaluation = interpret_score(result.score if result.score is not None else 0, self.player_is_red)
+                self.depth = result.depth
+                self.nodes = result.nodes
+                self.time = result.time
+                
+                self.status_message = f"{source} đã đi: {move}"
+                check_message = self.check_message()
+                if check_message:
+                    self.status_message += f" - {check_message}"
+            elif piece:
+                self.status_message = f"Lỗi: Nước đi không hợp lệ từ ElephantEye: {move}"
             else:
-                self.status_message = "ElephantEye không thể tìm được nước đi"
-            
-            self.waiting_for_engine = False
+                self.status_message = f"Lỗi: Không tìm thấy quân cờ tại {move[0]}{move[1]}"
+        else:
+            self.status_message = "ElephantEye không thể tìm được nước đi"
         
-        # Gọi ElephantEye để lấy nước đi tốt nhất
-        self.engine.get_best_move(self.moves, on_move_received)
+        self.waiting_for_engine = False
+        
+        # Tiếp tục phân tích thế cờ mới trong lượt của người chơi
+        if self.analysis_mode and self.is_player_turn():
+            self.start_analysis()
+    
+    def release_engine(self):
+        # Hủy lần tìm kiếm đang chạy: coroutine gửi "stop" và trả phiên ElephantEye về pool
+        if self.engine_future:
+            self.engine_future.cancel()
+            self.engine_future = None
+            # Xóa thông tin của lần tìm kiếm bị hủy để panel không hiển thị độ sâu, điểm số của thế cờ cũ
+            self.analysis_state.reset()
+        self.waiting_for_engine = False
+        self.engine_move_pending = False
+        self.stop_analysis()
     
     def handle_click(self, pos):
         # Chuyển đổi từ tọa độ chuột sang tọa độ bàn cờ
@@ -698,89 +765,138 @@ class Board:
             self.select_piece(x, y)
     
     def reset_game(self):
-        # Đóng kết nối với ElephantEye
-        if self.engine_connected:
-            self.engine.stop()
+        # Trả lại phiên ElephantEye đang mượn, không cần kết nối lại
+        self.release_engine()
         
         # Khởi tạo lại bàn cờ
         self.initialize_board()
+        self.status_message = self.connection_message
         
-        # Kết nối lại với ElephantEye
-        self.connect_to_engine()
-        
-        # Nếu người chơi điều khiển quân đen, ElephantEye (quân đỏ) sẽ đi trước
-        if not self.player_is_red and self.engine_connected:
+        # Nếu thế cờ xuất phát đến lượt máy, ElephantEye sẽ đi trước
+        if not self.is_player_turn():
             self.get_engine_move()
+        elif self.analysis_mode:
+            self.start_analysis()
     
     def set_player_color(self, is_red):
         self.player_is_red = is_red
-        if self.engine_connected:
-            self.engine.set_player_color(is_red)
+        self.release_engine()
         
         # Đặt lại bàn cờ
         self.initialize_board()
+        self.status_message = self.connection_message
         
-        # Nếu đổi sang quân đen và đang ở lượt đỏ, ElephantEye sẽ đi trước
-        if not is_red and self.current_player_is_red and self.engine_connected:
+        # Nếu sau khi đổi bên đến lượt máy, ElephantEye sẽ đi trước
+        if not self.is_player_turn():
             self.get_engine_move()
+        elif self.analysis_mode:
+            self.start_analysis()
 
 class ChessGame:
-    def __init__(self):
+    def __init__(self, fen=START_FEN):
         pygame.init()
         self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
         pygame.display.set_caption("Cờ Tướng với ElephantEye")
         
         self.clock = pygame.time.Clock()
-        self.board = Board()
+        self.engine_pool = EnginePool()
+        self.engine_loop = EngineLoop()
+        self.engine_cache = EngineCache()
+        self.opening_book = load_book()
+        self.board = Board(self.engine_pool, self.engine_loop, self.engine_cache, self.opening_book, fen)
         self.running = True
         
         # Tạo nút
         self.reset_button = pygame.Rect(WINDOW_WIDTH - 150, BOARD_HEIGHT + 20, 130, 40)
         self.switch_color_button = pygame.Rect(WINDOW_WIDTH - 150, BOARD_HEIGHT + 70, 130, 40)
+        self.analysis_button = pygame.Rect(WINDOW_WIDTH - 150, BOARD_HEIGHT + 135, 130, 40)
+    
+    def is_idle(self):
+        # Không chờ ElephantEye và không phân tích: màn hình chỉ thay đổi khi có sự kiện
+        return self.board.engine_future is None and self.board.analysis_future is None
+    
+    def draw_buttons(self, dirty):
+        # Các nút nằm trên panel thông tin, chỉ vẽ lại khi vùng chứa chúng vừa được vẽ lại
+        buttons = (
+            (self.reset_button, GREEN, "Chơi lại"),
+            (self.switch_color_button, BLUE, "Đổi bên"),
+            (self.analysis_button, LAST_MOVE_COLOR if self.board.analysis_mode else WHITE, "Phân tích"),
+        )
+        for rect, color, label in buttons:
+            if rect.collidelist(dirty) == -1:
+                continue
+            pygame.draw.rect(self.screen, color, rect)
+            text = render_text(label, 20, BLACK)
+            self.screen.blit(text, (rect.x + (rect.width - text.get_width()) // 2,
+                                    rect.y + (rect.height - text.get_height()) // 2))
     
     def run(self):
+        dirty = []
         while self.running:
-            for event in pygame.event.get():
+            # Khi không có gì thay đổi, ngủ chờ sự kiện thay vì vẽ lại 60 lần mỗi giây
+            if not dirty and self.is_idle():
+                events = [pygame.event.wait(IDLE_WAIT_MS)] + pygame.event.get()
+            else:
+                self.clock.tick(FPS)
+                events = pygame.event.get()
+            
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.running = False
+                elif event.type == pygame.VIDEOEXPOSE:
+                    # Cửa sổ bị che rồi hiện lại: vẽ lại toàn bộ
+                    self.board.invalidate()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+                    # Phím F: in FEN của thế cờ hiện tại để dùng lại (python chess.py "<FEN>")
+                    print(f"FEN: {self.board.fen()}")
+                    self.board.status_message = "Đã in FEN của thế cờ hiện tại"
                 elif event.type == pygame.MOUSEBUTTONDOWN:
-                    pos = pygame.mouse.get_pos()
+                    pos = event.pos
                     
                     # Kiểm tra xem có nhấn vào nút nào không
                     if self.reset_button.collidepoint(pos):
                         self.board.reset_game()
                     elif self.switch_color_button.collidepoint(pos):
                         self.board.set_player_color(not self.board.player_is_red)
+                    elif self.analysis_button.collidepoint(pos):
+                        self.board.toggle_analysis()
                     # Nếu không, xử lý click trên bàn cờ
                     elif pos[1] < BOARD_HEIGHT:
                         self.board.handle_click(pos)
             
-            # Vẽ bàn cờ
-            self.board.draw(self.screen)
+            # Nhận nước đi của ElephantEye nếu đã có kết quả
+            frame_start = time.perf_counter()
+            self.board.update()
             
-            # Vẽ các nút
-            pygame.draw.rect(self.screen, GREEN, self.reset_button)
-            pygame.draw.rect(self.screen, BLUE, self.switch_color_button)
-            
-            font = get_unicode_font(20, True)
-            reset_text = font.render("Chơi lại", True, BLACK)
-            switch_text = font.render("Đổi bên", True, BLACK)
-            
-            self.screen.blit(reset_text, (self.reset_button.x + (self.reset_button.width - reset_text.get_width()) // 2, 
-                                         self.reset_button.y + (self.reset_button.height - reset_text.get_height()) // 2))
-            self.screen.blit(switch_text, (self.switch_color_button.x + (self.switch_color_button.width - switch_text.get_width()) // 2, 
-                                          self.switch_color_button.y + (self.switch_color_button.height - switch_text.get_height()) // 2))
-            
-            pygame.display.flip()
-            self.clock.tick(60)
+            # Vẽ lại các vùng thay đổi và chỉ cập nhật những vùng đó lên màn hình
+            dirty = self.board.draw(self.screen)
+            if dirty:
+                self.draw_buttons(dirty)
+                pygame.display.update(dirty)
+                FRAME_SECONDS.observe(time.perf_counter() - frame_start)
+            else:
+                FRAMES_SKIPPED.inc()
         
-        # Đóng kết nối với ElephantEye khi thoát
-        if self.board.engine_connected:
-            self.board.engine.stop()
+        # Đóng các phiên ElephantEye khi thoát
+        self.board.release_engine()
+        self.engine_loop.close()
+        self.engine_pool.close()
+        self.engine_cache.close()
+        if self.opening_book:
+            self.opening_book.close()
         
         pygame.quit()
         sys.exit()
 
 if __name__ == "__main__":
-    game = ChessGame()
+    # Có thể bắt đầu từ thế cờ bất kỳ: python chess.py "<FEN>"
+    fen = " ".join(sys.argv[1:]) or START_FEN
+    try:
+        Position.from_fen(fen)
+    except ValueError as e:
+        print(f"FEN không hợp lệ: {e}")
+        sys.exit(1)
+    
+    metrics.setup()
+    game = ChessGame(fen)
     game.run()
@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 import os
 
+import metrics
+from grid_detector import GridDetector
+
 def detect_chess_pieces(image_path, output_dir=None, reference_points=None):
     """
     Phát hiện quân cờ (hình tròn) trong ảnh bàn cờ và lưu kết quả
@@ -139,13 +142,12 @@ def detect_chess_pieces(image_path, output_dir=None, reference_points=None):
     # Tính kích thước ô trung bình
     avg_cell_size = np.mean(cell_sizes) if cell_sizes else 50
     
-    # Ước tính kích thước quân cờ
-    min_radius = int(avg_cell_size * 0.3)  # Bán kính tối thiểu
-    max_radius = int(avg_cell_size * 0.5)  # Bán kính tối đa
+    # Ước tính bán kính quân cờ
+    piece_radius = int(avg_cell_size * 0.4)
     
     print(f"Kích thước ảnh: {width}x{height}")
     print(f"Kích thước ô trung bình: {avg_cell_size:.1f} pixel")
-    print(f"Tìm kiếm quân cờ với bán kính từ {min_radius} đến {max_radius} pixel")
+    print(f"Bán kính quân cờ ước tính: {piece_radius} pixel")
     
     # Tạo ảnh bàn cờ với lưới
     board_image = output_image.copy()
@@ -196,145 +198,71 @@ def detect_chess_pieces(image_path, output_dir=None, reference_points=None):
     cv2.imwrite(grid_path, board_image)
     print(f"Đã lưu ảnh lưới bàn cờ tại: {grid_path}")
     
-    # Phát hiện hình tròn
-    circles = cv2.HoughCircles(
-        blurred, 
-        cv2.HOUGH_GRADIENT, 
-        dp=1,
-        minDist=int(avg_cell_size * 0.8),
-        param1=50,
-        param2=30,
-        minRadius=min_radius, 
-        maxRadius=max_radius
-    )
+    # Nhận dạng quân cờ trực tiếp tại 90 giao điểm thay vì chạy HoughCircles trên cả ảnh
+    positions = [chr(97 + col) + str(row) for row in range(10) for col in range(9)]
+    detector = GridDetector([grid_points[pos] for pos in positions], cell_size=avg_cell_size)
+    with metrics.span("grid_detection", "Thời gian nhận dạng quân cờ tại 90 giao điểm"):
+        state, scores = detector.detect(gray)
     
-    # Nếu không tìm thấy đủ quân cờ, thử lại với tham số khác
-    if circles is None or len(circles[0]) < 10:
-        print("Thử lại với tham số khác...")
-        circles = cv2.HoughCircles(
-            blurred, 
-            cv2.HOUGH_GRADIENT, 
-            dp=1, 
-            minDist=int(avg_cell_size * 0.7),
-            param1=50, 
-            param2=25,
-            minRadius=min_radius - 5, 
-            maxRadius=max_radius + 5
-        )
+    chess_pieces = [(*grid_points[pos], piece_radius, score, pos)
+                    for pos, occupied, score in zip(positions, state.reshape(-1), scores.reshape(-1)) if occupied]
+    print(f"Tìm thấy {len(chess_pieces)} quân cờ")
     
-    # Lọc các hình tròn phát hiện được
-    if circles is not None:
-        circles = np.uint16(np.around(circles))
-        print(f"Tìm thấy {len(circles[0])} hình tròn tiềm năng")
-        
-        # Lọc các hình tròn dựa trên độ tương phản
-        filtered_circles = []
+    # Sắp xếp theo điểm nhận dạng giảm dần và giới hạn số lượng quân cờ
+    chess_pieces.sort(key=lambda x: x[3], reverse=True)
+    chess_pieces = chess_pieces[:32]
+    
+    # Tạo file để lưu tọa độ
+    coords_file = os.path.join(os.path.dirname(image_path), "chess_pieces_coordinates.txt")
+    with open(coords_file, 'w', encoding='utf-8') as f:
+        f.write("Tọa độ các quân cờ đã phát hiện:\n")
+        f.write("STT, x, y, radius, color, position\n")
         
-        for circle in circles[0]:
-            x, y, r = circle
+        # Vẽ các quân cờ và lưu tọa độ
+        for i, (x, y, r, _, chess_position) in enumerate(chess_pieces):
+            # Cắt vùng quân cờ
+            piece_region = image[max(y-r, 0):y+r, max(x-r, 0):x+r]
             
-            # Đảm bảo hình tròn nằm trong ảnh
-            if x - r < 0 or y - r < 0 or x + r >= width or y + r >= height:
+            if piece_region.size == 0:
                 continue
             
-            # Cắt vùng hình tròn
-            mask = np.zeros_like(gray)
-            cv2.circle(mask, (x, y), r, 255, -1)
+            # Xác định màu quân cờ
+            hsv = cv2.cvtColor(piece_region, cv2.COLOR_BGR2HSV)
             
-            # Tính độ tương phản giữa bên trong và bên ngoài hình tròn
-            inner_mean = cv2.mean(gray, mask=mask)[0]
+            # Tính độ sáng trung bình
+            brightness = np.mean(hsv[:,:,2])
             
-            # Tạo vùng đệm xung quanh
-            outer_mask = np.zeros_like(gray)
-            cv2.circle(outer_mask, (x, y), r + 5, 255, 5)
-            outer_mean = cv2.mean(gray, mask=outer_mask)[0]
+            # Phân loại quân cờ đen/trắng dựa trên độ sáng
+            if brightness < 100:
+                color = "black"
+                circle_color = (0, 0, 255)  # Đỏ cho quân đen
+            else:
+                color = "white"
+                circle_color = (255, 0, 0)  # Xanh dương cho quân trắng
             
-            # Tính độ tương phản
-            contrast = abs(inner_mean - outer_mean)
+            # Vẽ viền hình tròn
+            cv2.circle(output_image, (x, y), r, circle_color, 2)
             
-            # Chỉ giữ lại các hình tròn có độ tương phản cao
-            if contrast > 20:
-                filtered_circles.append((x, y, r, contrast))
-        
-        print(f"Sau khi lọc: {len(filtered_circles)} quân cờ")
-        
-        # Sắp xếp theo độ tương phản giảm dần
-        filtered_circles.sort(key=lambda x: x[3], reverse=True)
-        
-        # Giới hạn số lượng quân cờ
-        max_pieces = min(32, len(filtered_circles))
-        chess_pieces = filtered_circles[:max_pieces]
-        
-        # Tạo file để lưu tọa độ
-        coords_file = os.path.join(os.path.dirname(image_path), "chess_pieces_coordinates.txt")
-        with open(coords_file, 'w', encoding='utf-8') as f:
-            f.write("Tọa độ các quân cờ đã phát hiện:\n")
-            f.write("STT, x, y, radius, color, position\n")
+            # Vẽ tâm hình tròn
+            cv2.circle(output_image, (x, y), 2, (0, 255, 0), 3)
             
-            # Vẽ các quân cờ và lưu tọa độ
-            for i, (x, y, r, _) in enumerate(chess_pieces):
-                # Cắt vùng quân cờ
-                piece_region = image[y-r:y+r, x-r:x+r]
-                
-                if piece_region.size == 0:
-                    continue
-                
-                # Xác định màu quân cờ
-                hsv = cv2.cvtColor(piece_region, cv2.COLOR_BGR2HSV)
-                
-                # Tính độ sáng trung bình
-                brightness = np.mean(hsv[:,:,2])
-                
-                # Phân loại quân cờ đen/trắng dựa trên độ sáng
-                if brightness < 100:
-                    color = "black"
-                    circle_color = (0, 0, 255)  # Đỏ cho quân đen
-                else:
-                    color = "white"
-                    circle_color = (255, 0, 0)  # Xanh dương cho quân trắng
-                
-                # Vẽ viền hình tròn
-                cv2.circle(output_image, (x, y), r, circle_color, 2)
-                
-                # Vẽ tâm hình tròn
-                cv2.circle(output_image, (x, y), 2, (0, 255, 0), 3)
-                
-                # Xác định vị trí trên bàn cờ bằng cách tìm ô gần nhất
-                min_distance = float('inf')
-                closest_position = None
-                
-                # Tìm ô gần nhất với quân cờ
-                for pos, (grid_x, grid_y) in grid_points.items():
-                    # Tính khoảng cách từ quân cờ đến điểm lưới
-                    distance = np.sqrt((x - grid_x)**2 + (y - grid_y)**2)
-                    
-                    # Cập nhật nếu tìm thấy ô gần hơn
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_position = pos
-                
-                # Xác định vị trí dựa trên ô gần nhất
-                chess_position = closest_position
-                
-                # Hiển thị số thứ tự
-                cv2.putText(output_image, str(i+1), (x - 10, y - r - 10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-                
-                # Hiển thị tọa độ (x,y)
-                coord_text = f"({x},{y})"
-                cv2.putText(output_image, coord_text, (x - r, y + r + 15), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 0), 1)
-                
-                # Hiển thị vị trí trên bàn cờ
-                cv2.putText(output_image, chess_position, (x + 5, y), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
-                
-                # Ghi tọa độ vào file
-                f.write(f"{i+1}, {x}, {y}, {r}, {color}, {chess_position}\n")
-        
-        print(f"Đã lưu tọa độ quân cờ vào: {coords_file}")
-    else:
-        print("Không tìm thấy quân cờ nào trong ảnh")
+            # Hiển thị số thứ tự
+            cv2.putText(output_image, str(i+1), (x - 10, y - r - 10), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+            
+            # Hiển thị tọa độ (x,y)
+            coord_text = f"({x},{y})"
+            cv2.putText(output_image, coord_text, (x - r, y + r + 15), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 0), 1)
+            
+            # Hiển thị vị trí trên bàn cờ
+            cv2.putText(output_image, chess_position, (x + 5, y), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+            
+            # Ghi tọa độ vào file
+            f.write(f"{i+1}, {x}, {y}, {r}, {color}, {chess_position}\n")
+    
+    print(f"Đã lưu tọa độ quân cờ vào: {coords_file}")
     
     # Xác định thư mục đầu ra
     if output_dir is None:
@@ -376,7 +304,9 @@ if __name__ == "__main__":
     ]
     
     # Phát hiện quân cờ
-    output_path, coords_file = detect_chess_pieces(image_path, reference_points=reference_points)
+    metrics.setup()
+    with metrics.span("piece_detection", "Thời gian nhận dạng quân cờ trên một ảnh"):
+        output_path, coords_file = detect_chess_pieces(image_path, reference_points=reference_points)
     
     print("\nHoàn thành phát hiện quân cờ!")
     print(f"Ảnh kết quả: {output_path}")
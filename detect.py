@@ -7,6 +7,12 @@ import threading
 import queue
 from PIL import Image, ImageTk
 
+import metrics
+from screen_capture import ScreenGrabber
+
+FRAME_CAPTURE = "frame_capture"  # Tên span đo thời gian chụp một khung hình
+FRAME_DIFF = "frame_diff"  # Tên span đo thời gian so sánh hai khung hình liên tiếp
+
 class ScreenCaptureApp:
     def __init__(self):
         # Khởi tạo biến cho vùng chọn
@@ -211,20 +217,21 @@ class ScreenCaptureApp:
         self.preview_window.protocol("WM_DELETE_WINDOW", self.stop_capture)
         
         # Chụp ảnh đầu tiên để hiển thị ngay
-        screenshot = pyautogui.screenshot(region=(
-            self.start_x, self.start_y, 
-            self.end_x - self.start_x, 
-            self.end_y - self.start_y))
-        frame = np.array(screenshot)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        with ScreenGrabber(self.capture_region()) as grabber:
+            frame = grabber.grab()
         
         # Hiển thị ảnh đầu tiên
-        img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        img = cv2.cvtColor(frame, cv2.COLOR_BGRA2RGB)
         img = Image.fromarray(img)
         img_tk = ImageTk.PhotoImage(image=img)
         self.preview_label.config(image=img_tk)
         self.preview_label.image = img_tk
     
+    def capture_region(self):
+        # Vùng đã chọn theo định dạng của ScreenGrabber
+        return {"top": self.start_y, "left": self.start_x,
+                "width": self.end_x - self.start_x, "height": self.end_y - self.start_y}
+    
     def update_capture_speed(self, value):
         # Cập nhật tốc độ chụp
         self.capture_delay = float(value)
@@ -249,7 +256,7 @@ class ScreenCaptureApp:
                 frame = self.frame_queue.get(block=False)
                 
                 # Hiển thị ảnh trong cửa sổ xem trước
-                img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                img = cv2.cvtColor(frame, cv2.COLOR_BGRA2RGB)
                 img = Image.fromarray(img)
                 img_tk = ImageTk.PhotoImage(image=img)
                 
@@ -265,50 +272,56 @@ class ScreenCaptureApp:
     
     def capture_loop(self):
         # Vòng lặp chụp ảnh liên tục
-        last_frame = None
+        last_gray = None
+        # Handle chụp màn hình phải được tạo trong chính luồng chụp
+        grabber = ScreenGrabber(self.capture_region())
         
         while self.capture_running:
             try:
-                # Chụp vùng đã chọn
-                screenshot = pyautogui.screenshot(region=(
-                    self.start_x, self.start_y, 
-                    self.end_x - self.start_x, 
-                    self.end_y - self.start_y))
-                
-                # Chuyển đổi sang định dạng OpenCV
-                frame = np.array(screenshot)
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+                # Chụp vùng đã chọn: khung hình BGRA không sao chép, ảnh xám và BGR ghi vào bộ đệm dùng lại
+                with metrics.span(FRAME_CAPTURE, "Thời gian chụp và chuyển đổi một khung hình"):
+                    frame = grabber.grab()
+                    gray = grabber.gray(frame)
+                    bgr = grabber.bgr(frame)
                 
                 # Lưu frame hiện tại
-                cv2.imwrite("current_board.png", frame)
+                cv2.imwrite("current_board.png", bgr)
                 
-                # Đưa frame vào queue để hiển thị
+                # Đưa frame vào queue để hiển thị, không cần sao chép: mss cấp bộ đệm mới cho mỗi lần chụp
+                # (xem ScreenGrabber.grab) và luồng giao diện chỉ đọc frame
                 if not self.frame_queue.full():
                     self.frame_queue.put(frame, block=False)
                 
-                # So sánh với frame trước đó (nếu cần)
-                if last_frame is not None:
+                # So sánh với frame trước đó (nếu cần), trực tiếp trên ảnh xám
+                if last_gray is not None:
                     # Tính toán sự khác biệt
-                    diff = cv2.absdiff(frame, last_frame)
-                    gray_diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-                    _, thresh = cv2.threshold(gray_diff, 30, 255, cv2.THRESH_BINARY)
+                    with metrics.span(FRAME_DIFF, "Thời gian so sánh hai khung hình liên tiếp"):
+                        gray_diff = cv2.absdiff(gray, last_gray)
+                        _, thresh = cv2.threshold(gray_diff, 30, 255, cv2.THRESH_BINARY)
+                        changed = np.sum(thresh) > 100000  # Ngưỡng thay đổi
                     
                     # Nếu có sự thay đổi đáng kể
-                    if np.sum(thresh) > 100000:  # Ngưỡng thay đổi
+                    if changed:
+                        metrics.counter("frame_changes_total", "Số khung hình khác đáng kể so với khung trước").inc()
                         # Lưu ảnh với timestamp
                         timestamp = int(time.time())
-                        cv2.imwrite(f"C:/Users/duong.ns/Desktop/chess/board_{timestamp}.png", frame)
+                        cv2.imwrite(f"C:/Users/duong.ns/Desktop/chess/board_{timestamp}.png", bgr)
                         print(f"Phat hien thay doi - Da luu anh: board_{timestamp}.png")
                 
-                # Cập nhật frame trước đó
-                last_frame = frame
+                # Cập nhật frame trước đó (ảnh xám nằm trong bộ đệm dùng lại của grabber nên phải chép ra)
+                if last_gray is None:
+                    last_gray = gray.copy()
+                else:
+                    np.copyto(last_gray, gray)
                 
                 # Chờ đến lần chụp tiếp theo
                 time.sleep(self.capture_delay)
-                
+            
             except Exception as e:
                 print(f"Loi khi chup anh: {e}")
                 time.sleep(1)  # Chờ một chút nếu có lỗi
+        
+        grabber.close()
     
     def save_coordinates(self):
         # Lưu tọa độ và kích thước vùng chọn
@@ -329,5 +342,6 @@ class ScreenCaptureApp:
         print("Đã lưu vào file 'board_coordinates.py'")
 
 if __name__ == "__main__":
+    metrics.setup()
     app = ScreenCaptureApp()
     app.root.mainloop()
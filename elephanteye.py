@@ -0,0 +1,518 @@
+import os
+import re
+import queue
+import socket
+import subprocess
+import threading
+import time
+
+from xiangqi import START_FEN
+
+# Cách kết nối tới ElephantEye: "ssh" (Raspberry Pi), "local" (tiến trình con), "tcp"
+# hoặc "builtin" (bộ tìm kiếm Python trong search.py, không cần ElephantEye)
+ENGINE_TRANSPORT = os.environ.get("ELEPHANTEYE_TRANSPORT", "ssh")
+
+# Thông tin kết nối Raspberry Pi
+PI_HOST = os.environ.get("ELEPHANTEYE_PI_HOST", "192.168.100.88")
+PI_PORT = int(os.environ.get("ELEPHANTEYE_PI_PORT", "22"))
+PI_USERNAME = os.environ.get("ELEPHANTEYE_PI_USERNAME", "nsd")
+PI_PASSWORD = os.environ.get("ELEPHANTEYE_PI_PASSWORD", "1")
+ELEPHANTEYE_DIR = "/home/nsd/eleeye/eleeye"
+ELEPHANTEYE_EXEC = "eleeye"
+
+# ElephantEye chạy trên máy này
+LOCAL_ENGINE_PATH = os.environ.get("ELEPHANTEYE_LOCAL_PATH", "./eleeye")
+
+# ElephantEye mở qua cổng TCP (ví dụ: socat TCP-LISTEN:12345,fork EXEC:./eleeye)
+TCP_HOST = os.environ.get("ELEPHANTEYE_TCP_HOST", "127.0.0.1")
+TCP_PORT = int(os.environ.get("ELEPHANTEYE_TCP_PORT", "12345"))
+
+CONNECT_TIMEOUT = 5  # Thời gian chờ kết nối (giây)
+
+# Tham số tìm kiếm
+SEARCH_DEPTH = 8  # Độ sâu tìm kiếm
+SEARCH_TIMEOUT = 30  # Thời gian tối đa cho một lần tìm kiếm (giây)
+ENGINE_HANDSHAKE_TIMEOUT = 5  # Thời gian chờ ucciok / bestmove sau lệnh stop (giây)
+POSITION_MOVES_LIMIT = 40  # Ván dài hơn thì gửi FEN của thế cờ hiện tại thay cho toàn bộ danh sách nước đi
+
+# Tham số gửi cho ElephantEye sau khi bắt tay (cũng là một phần khóa của bộ nhớ đệm kết quả)
+ENGINE_OPTIONS = (
+    ("Hash", "256"),
+    ("Pruning", "true"),
+    ("Knowledge", "3"),
+    ("Ponder", "true"),
+)
+
+
+class SSHTransport:
+    # Chạy ElephantEye trên Raspberry Pi qua một kênh SSH tương tác
+    def __init__(self, host=PI_HOST, port=PI_PORT, username=PI_USERNAME, password=PI_PASSWORD,
+                 engine_dir=ELEPHANTEYE_DIR, engine_exec=ELEPHANTEYE_EXEC):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.engine_dir = engine_dir
+        self.engine_exec = engine_exec
+        self.ssh = None
+        self.channel = None
+        self.engine_in = None
+        self.engine_out = None
+    
+    def open(self):
+        # Chỉ cần paramiko khi thực sự dùng SSH
+        import paramiko
+        
+        self.ssh = paramiko.SSHClient()
+        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.ssh.connect(self.host, self.port, self.username, self.password, timeout=CONNECT_TIMEOUT)
+        
+        self.channel = self.ssh.get_transport().open_session()
+        self.channel.exec_command(f"cd {self.engine_dir} && ./{self.engine_exec}")
+        self.engine_in = self.channel.makefile('wb')
+        self.engine_out = self.channel.makefile('rb')
+    
+    def write_line(self, line):
+        self.engine_in.write((line + "\n").encode('utf-8'))
+        self.engine_in.flush()
+    
+    def read_lines(self):
+        for raw_line in self.engine_out:
+            yield raw_line.decode('utf-8', errors='ignore')
+    
+    def close(self):
+        if self.channel:
+            self.channel.close()
+        
+        if self.ssh:
+            self.ssh.close()
+        
+        self.channel = None
+        self.ssh = None
+
+
+class SubprocessTransport:
+    # Chạy ElephantEye như một tiến trình con trên cùng máy, giao tiếp qua pipe
+    def __init__(self, command=None, cwd=None):
+        self.command = command or [LOCAL_ENGINE_PATH]
+        self.cwd = cwd
+        self.process = None
+    
+    def open(self):
+        self.process = subprocess.Popen(
+            self.command,
+            cwd=self.cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+    
+    def write_line(self, line):
+        self.process.stdin.write((line + "\n").encode('utf-8'))
+        self.process.stdin.flush()
+    
+    def read_lines(self):
+        for raw_line in iter(self.process.stdout.readline, b''):
+            yield raw_line.decode('utf-8', errors='ignore')
+    
+    def close(self):
+        if self.process:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=CONNECT_TIMEOUT)
+            except Exception:
+                self.process.kill()
+        
+        self.process = None
+
+
+class TCPTransport:
+    # Kết nối tới ElephantEye được mở sẵn trên một cổng TCP
+    def __init__(self, host=TCP_HOST, port=TCP_PORT):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.engine_out = None
+    
+    def open(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.engine_out = self.sock.makefile('rb')
+    
+    def write_line(self, line):
+        self.sock.sendall((line + "\n").encode('utf-8'))
+    
+    def read_lines(self):
+        for raw_line in self.engine_out:
+            yield raw_line.decode('utf-8', errors='ignore')
+    
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        
+        self.sock = None
+
+
+class BuiltinTransport:
+    # Bộ tìm kiếm alpha-beta viết bằng Python (search.py) chạy ngay trong tiến trình, dùng khi không có ElephantEye
+    def __init__(self):
+        self.engine = None
+        self.output = None
+    
+    def open(self):
+        from search import UCCIEngine
+        self.output = queue.Queue()
+        self.engine = UCCIEngine(self.output.put)
+    
+    def write_line(self, line):
+        if self.engine is None:
+            raise ConnectionError("Bộ tìm kiếm tích hợp đã đóng")
+        if not self.engine.handle(line):
+            self.close()
+    
+    def read_lines(self):
+        output = self.output
+        while True:
+            line = output.get()
+            if line is None:
+                return
+            yield line
+    
+    def close(self):
+        if self.engine:
+            self.engine.stop()
+            self.output.put(None)
+        
+        self.engine = None
+
+
+TRANSPORTS = {
+    "ssh": SSHTransport,
+    "local": SubprocessTransport,
+    "tcp": TCPTransport,
+    "builtin": BuiltinTransport,
+}
+
+
+def create_transport(kind=None):
+    kind = kind or ENGINE_TRANSPORT
+    if kind not in TRANSPORTS:
+        raise ValueError(f"Không hỗ trợ kiểu kết nối ElephantEye: {kind}")
+    return TRANSPORTS[kind]()
+
+
+def position_from_moves(moves, fen=START_FEN):
+    # Tham số của lệnh UCCI "position": thế cờ xuất phát dạng FEN kèm các nước đã đi
+    moves_str = ' '.join(moves) if moves else ""
+    return f"fen {fen}{' moves ' + moves_str if moves_str else ''}"
+
+
+class SearchResult:
+    # Kết quả một lần tìm kiếm của ElephantEye
+    def __init__(self, bestmove=None, score=None, depth=0, nodes=None, time=None, pv=None, stopped=False):
+        self.bestmove = bestmove
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.time = time
+        self.pv = pv or []  # Biến chính (principal variation)
+        self.stopped = stopped  # True nếu tìm kiếm bị dừng sớm vì hết thời hạn
+    
+    @classmethod
+    def from_analysis(cls, analysis, stopped=False):
+        return cls(analysis['bestmove'], analysis['score'], analysis['depth'],
+                   analysis['nodes'], analysis['time'], analysis['pv'], stopped)
+    
+    def __repr__(self):
+        return (f"SearchResult(bestmove={self.bestmove!r}, score={self.score}, depth={self.depth}, "
+                f"nodes={self.nodes}, time={self.time}, pv={self.pv}, stopped={self.stopped})")
+
+
+# Các trường số trong dòng "info" của UCCI
+INFO_NUMBER_FIELDS = ("depth", "seldepth", "score", "time", "nodes", "nps", "hashfull", "currmovenumber")
+
+
+def parse_info_line(line):
+    # Phân tích một dòng "info ..." thành dict, trả về None nếu không phải dòng info
+    tokens = line.split()
+    if not tokens or tokens[0] != "info":
+        return None
+    
+    info = {}
+    i = 1
+    while i < len(tokens):
+        key = tokens[i]
+        if key == "pv":
+            info['pv'] = tokens[i + 1:]
+            break
+        if key == "currmove" and i + 1 < len(tokens):
+            info['currmove'] = tokens[i + 1]
+            i += 2
+            continue
+        if key in INFO_NUMBER_FIELDS and i + 1 < len(tokens):
+            try:
+                info[key] = int(tokens[i + 1])
+            except ValueError:
+                pass
+            i += 2
+            continue
+        i += 1
+    
+    # Thời gian trong UCCI tính bằng mili giây
+    if 'time' in info:
+        info['time'] = info['time'] / 1000
+    
+    return info
+
+
+class AnalysisState:
+    # Thông tin tìm kiếm mới nhất: luồng engine ghi vào, vòng lặp pygame đọc mỗi khung hình
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self, active=False):
+        with self.lock:
+            self.active = active  # True khi ElephantEye đang tìm kiếm
+            self.depth = 0
+            self.score = None
+            self.nodes = 0
+            self.time = 0.0
+            self.nps = 0
+            self.pv = []
+    
+    def update(self, info):
+        with self.lock:
+            if 'depth' in info and 'score' in info:
+                # Dòng kết quả của một độ sâu: điểm số và biến chính đi cùng nhau
+                self.depth = info['depth']
+                self.score = info['score']
+                self.pv = info.get('pv', self.pv)
+            if 'nodes' in info:
+                self.nodes = info['nodes']
+            if 'time' in info:
+                self.time = info['time']
+            if 'nps' in info:
+                self.nps = info['nps']
+            elif self.time > 0:
+                self.nps = int(self.nodes / self.time)
+    
+    def finish(self):
+        with self.lock:
+            self.active = False
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                'active': self.active,
+                'depth': self.depth,
+                'score': self.score,
+                'nodes': self.nodes,
+                'time': self.time,
+                'nps': self.nps,
+                'pv': list(self.pv),
+            }
+
+
+def interpret_score(score, player_is_red):
+    if score is None:
+        return "Không có đánh giá"
+    
+    abs_score = abs(score)
+    
+    # Xác định bên nào đang có lợi thế
+    if player_is_red:
+        # Người chơi là quân đỏ
+        if score < 0:
+            side = "Bạn"
+        else:
+            side = "Đối thủ"
+    else:
+        # Người chơi là quân đen
+        if score > 0:
+            side = "Bạn"
+        else:
+            side = "Đối thủ"
+    
+    if abs_score == 0:
+        return "Cân bằng (0)"
+    elif abs_score < 30:
+        return f"{side} có lợi thế rất nhỏ ({abs_score})"
+    elif abs_score < 100:
+        return f"{side} có lợi thế nhỏ ({abs_score})"
+    elif abs_score < 200:
+        return f"{side} có lợi thế quân tốt ({abs_score})"
+    elif abs_score < 500:
+        return f"{side} có lợi thế đáng kể ({abs_score})"
+    elif abs_score < 900:
+        return f"{side} có lợi thế lớn ({abs_score})"
+    elif abs_score < 10000:
+        return f"{side} có lợi thế thắng cuộc ({abs_score})"
+    else:
+        return f"{side} chiếu bí ({abs_score})"
+
+
+class ElephantEyeEngine:
+    def __init__(self, transport=None):
+        self.transport = transport or create_transport()
+        self.reader_thread = None
+        self.lines = queue.Queue()  # Các dòng ElephantEye in ra, đọc liên tục bởi reader_thread
+        self.line_sink = None  # Nếu được đặt, các dòng đọc được sẽ chuyển cho hàm này thay vì self.lines
+        self.sink_lock = threading.Lock()
+        self.connected = False
+        # Phiên dùng chung giữa các bàn cờ qua EnginePool nên không giữ trạng thái của ván nào:
+        # màu quân người chơi, điểm số và đánh giá nằm ở Board / AnalysisState trong chess.py
+    
+    def start(self):
+        try:
+            # Mở kết nối tới tiến trình ElephantEye chạy suốt ván cờ
+            self.transport.open()
+            
+            # Luồng đọc đưa từng dòng vào hàng đợi ngay khi ElephantEye in ra
+            self.lines = queue.Queue()
+            self.reader_thread = threading.Thread(target=self.read_loop)
+            self.reader_thread.daemon = True
+            self.reader_thread.start()
+            
+            # Bắt tay UCCI một lần cho cả phiên
+            self.send_command("ucci")
+            ucci_lines = []
+            if self.wait_for(("ucciok",), ENGINE_HANDSHAKE_TIMEOUT, ucci_lines) is None:
+                print("Timeout khi đọc phản hồi từ lệnh ucci")
+                self.stop()
+                return False
+            
+            for line in ucci_lines:
+                if line.startswith("id version"):
+                    print(f"ElephantEye {line.split()[2]}")
+                    break
+            
+            # Thiết lập tham số một lần, bảng băm được giữ nguyên giữa các nước đi
+            for name, value in ENGINE_OPTIONS:
+                self.send_command(f"setoption name {name} value {value}")
+            
+            self.connected = True
+            return True
+        
+        except Exception as e:
+            print(f"Lỗi khi kết nối với ElephantEye: {e}")
+            self.stop()
+            return False
+    
+    def read_loop(self):
+        # Đọc liên tục đầu ra của ElephantEye cho đến khi kênh bị đóng
+        try:
+            for raw_line in self.transport.read_lines():
+                line = raw_line.strip()
+                if line:
+                    self.dispatch_line(line)
+        except Exception as e:
+            print(f"Lỗi khi đọc phản hồi từ ElephantEye: {e}")
+        
+        # Báo cho bên đang chờ biết phiên đã kết thúc
+        self.connected = False
+        self.dispatch_line(None)
+    
+    def dispatch_line(self, line):
+        with self.sink_lock:
+            if self.line_sink is not None:
+                self.line_sink(line)
+            else:
+                self.lines.put(line)
+    
+    def set_line_sink(self, sink):
+        # Chuyển các dòng đọc được cho sink (ví dụ hàng đợi asyncio), None để quay lại self.lines
+        with self.sink_lock:
+            self.line_sink = sink
+            if sink is not None:
+                while not self.lines.empty():
+                    sink(self.lines.get_nowait())
+    
+    def send_command(self, command):
+        self.transport.write_line(command)
+    
+    def wait_for(self, prefixes, timeout, collected=None):
+        # Chờ dòng bắt đầu bằng một trong các tiền tố, trả về None nếu hết giờ hoặc mất kết nối
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            
+            try:
+                line = self.lines.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            
+            if line is None:
+                return None
+            
+            if collected is not None:
+                collected.append(line)
+            
+            if line.startswith(prefixes):
+                return line
+    
+    def analyze_response(self, response):
+        max_depth = 0
+        final_score = None
+        final_nodes = None
+        final_time = None
+        final_pv = []
+        best_move = None
+        
+        # Tìm thông tin về độ sâu, điểm số và số nút
+        depth_pattern = re.compile(r'info depth (\d+) score (-?\d+)(?: pv (.*))?')
+        nodes_time_pattern = re.compile(r'info time (\d+) nodes (\d+)')
+        bestmove_pattern = re.compile(r'bestmove ([a-i]\d[a-i]\d)')
+        
+        for line in response.split('\n'):
+            depth_match = depth_pattern.match(line)
+            if depth_match:
+                depth = int(depth_match.group(1))
+                score = int(depth_match.group(2))
+                if depth > max_depth:
+                    max_depth = depth
+                    final_score = score
+                    final_pv = depth_match.group(3).split() if depth_match.group(3) else []
+            
+            nodes_time_match = nodes_time_pattern.match(line)
+            if nodes_time_match:
+                time_ms = int(nodes_time_match.group(1))
+                nodes = int(nodes_time_match.group(2))
+                final_time = time_ms / 1000  # Chuyển đổi sang giây
+                final_nodes = nodes
+            
+            bestmove_match = bestmove_pattern.match(line)
+            if bestmove_match:
+                best_move = bestmove_match.group(1)
+        
+        return {
+            'depth': max_depth,
+            'score': final_score,
+            'nodes': final_nodes,
+            'time': final_time,
+            'pv': final_pv,
+            'bestmove': best_move
+        }
+    
+    def stop(self):
+        # Thoát ElephantEye trước khi đóng kết nối
+        if self.connected:
+            try:
+                self.send_command("quit")
+            except Exception:
+                pass
+        
+        try:
+            self.transport.close()
+        except Exception as e:
+            print(f"Lỗi khi đóng kết nối với ElephantEye: {e}")
+        
+        self.connected = False
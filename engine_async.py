@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import time
+
+import metrics
+from elephanteye import ENGINE_HANDSHAKE_TIMEOUT, BuiltinTransport, SearchResult, parse_info_line
+from engine_cache import search_params
+
+ENGINE_REQUESTS = metrics.counter("engine_requests_total", "Số yêu cầu tìm kiếm qua search_with_pool")
+ENGINE_CACHE_HITS = metrics.counter("engine_cache_hits_total", "Số yêu cầu được trả lời từ bộ nhớ đệm")
+ENGINE_UNAVAILABLE = metrics.counter("engine_unavailable_total", "Số yêu cầu không mượn được phiên engine")
+ENGINE_STOPPED = metrics.counter("engine_stopped_total", "Số lần tìm kiếm bị dừng vì hết thời hạn")
+ENGINE_REQUEST_SECONDS = metrics.histogram("engine_request_seconds", "Thời gian một yêu cầu, gồm cả chờ phiên rảnh")
+ENGINE_FIRST_LINE_SECONDS = metrics.histogram("engine_first_line_seconds", "Thời gian từ khi gửi go đến dòng đầu tiên")
+ENGINE_SEARCH_DEPTH = metrics.histogram("engine_search_depth", "Độ sâu đạt được của mỗi lần tìm kiếm",
+                                        (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 12, 14, 16, 20, 30))
+ENGINE_SEARCH_NPS = metrics.histogram("engine_search_nps", "Tốc độ tìm kiếm (nút/giây) của mỗi lần tìm kiếm",
+                                      (1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7))
+ENGINE_LAST_DEPTH = metrics.gauge("engine_search_depth_last", "Độ sâu đạt được của lần tìm kiếm gần nhất")
+ENGINE_LAST_NPS = metrics.gauge("engine_search_nps_last", "Tốc độ tìm kiếm (nút/giây) của lần tìm kiếm gần nhất")
+
+
+class AsyncElephantEye:
+    # Giao diện asyncio cho một phiên ElephantEyeEngine đã khởi động, mượn từ EnginePool
+    # Không tự khóa: phiên đang được mượn thì không ai khác dùng, nên mỗi phiên chỉ chạy một lệnh go tại một thời điểm
+    def __init__(self, engine):
+        self.engine = engine
+    
+    async def search(self, position, depth=None, movetime=None, timeout=None, on_info=None):
+        # position là tham số của lệnh UCCI "position", ví dụ "fen ... moves h2e2"
+        # timeout là hạn chót (giây): hết hạn sẽ gửi "stop" và trả về nước đi tốt nhất hiện có
+        # Không có depth lẫn movetime thì phân tích vô hạn ("go infinite") cho đến khi bị hủy
+        # on_info nhận từng dòng info đã phân tích ngay khi ElephantEye in ra
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+        self.engine.set_line_sink(lambda line: loop.call_soon_threadsafe(lines.put_nowait, line))
+        try:
+            # Bỏ các dòng còn sót lại từ lần tìm kiếm trước
+            await asyncio.sleep(0)
+            while not lines.empty():
+                if lines.get_nowait() is None:
+                    raise ConnectionError("Phiên ElephantEye đã đóng")
+            
+            with metrics.span("engine_send", "Thời gian gửi lệnh position và go"):
+                self.engine.send_command(f"position {position}")
+                self.engine.send_command(self.go_command(depth, movetime))
+            sent = time.perf_counter()
+            
+            output = []
+            stopped = False
+            with metrics.span("engine_search", "Thời gian từ khi gửi go đến khi nhận bestmove"):
+                try:
+                    await asyncio.wait_for(self.read_until_bestmove(lines, output, on_info, sent), timeout)
+                except asyncio.TimeoutError:
+                    # Hết hạn: dừng tìm kiếm và lấy nước đi tốt nhất hiện có
+                    stopped = True
+                    await self.stop_search(lines, output, on_info)
+                except asyncio.CancelledError:
+                    # Bị hủy: dừng ElephantEye để phiên sẵn sàng cho yêu cầu tiếp theo
+                    # Các dòng info còn lại không chuyển cho on_info, người gọi có thể đã bắt đầu lần tìm kiếm mới
+                    await self.stop_search(lines, output)
+                    raise
+            
+            with metrics.span("engine_parse", "Thời gian phân tích kết quả tìm kiếm"):
+                return SearchResult.from_analysis(self.engine.analyze_response('\n'.join(output)), stopped)
+        finally:
+            self.engine.set_line_sink(None)
+    
+    def go_command(self, depth, movetime):
+        if movetime is not None:
+            # UCCI không có movetime: dồn toàn bộ thời gian cho một nước
+            return f"go time {int(movetime * 1000)} movestogo 1"
+        if depth is not None:
+            return f"go depth {depth}"
+        return "go infinite"
+    
+    async def read_until_bestmove(self, lines, output, on_info=None, sent=None):
+        # sent: thời điểm gửi lệnh go, để đo thời gian chờ dòng đầu tiên
+        while True:
+            line = await lines.get()
+            if line is None:
+                raise ConnectionError("Phiên ElephantEye đã đóng")
+            
+            if sent is not None and not output:
+                ENGINE_FIRST_LINE_SECONDS.observe(time.perf_counter() - sent)
+            output.append(line)
+            if line.startswith(("bestmove", "nobestmove")):
+                return
+            
+            if on_info is not None:
+                info = parse_info_line(line)
+                if info:
+                    on_info(info)
+    
+    async def stop_search(self, lines, output, on_info=None):
+        self.engine.send_command("stop")
+        try:
+            await asyncio.wait_for(self.read_until_bestmove(lines, output, on_info), ENGINE_HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            print(f"ElephantEye không phản hồi lệnh stop: {e}")
+
+
+async def search_with_pool(pool, position, depth=None, movetime=None, timeout=None, on_info=None,
+                           cache=None, key=None):
+    # Mượn một phiên từ pool, tìm kiếm rồi trả phiên lại kể cả khi bị hủy
+    # timeout tính cho cả thời gian xếp hàng lẫn thời gian tìm kiếm
+    # cache (EngineCache) và key (khóa Zobrist của thế cờ): tra kết quả cũ trước khi hỏi ElephantEye
+    ENGINE_REQUESTS.inc()
+    started = time.perf_counter()
+    params = None
+    if cache is not None and key is not None and (depth is not None or movetime is not None):
+        params = search_params(depth, movetime)
+        with metrics.span("engine_cache_lookup", "Thời gian tra bộ nhớ đệm kết quả tìm kiếm"):
+            result = cache.get(key, params)
+        if result is not None:
+            ENGINE_CACHE_HITS.inc()
+            ENGINE_REQUEST_SECONDS.observe(time.perf_counter() - started)
+            return result
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    engine = await pool.acquire_async(timeout)
+    if engine is None:
+        ENGINE_UNAVAILABLE.inc()
+        return None
+    
+    if deadline is not None:
+        timeout = max(0.0, deadline - loop.time())
+    
+    try:
+        result = await AsyncElephantEye(engine).search(position, depth, movetime, timeout, on_info)
+    finally:
+        await pool.release_async(engine)
+    
+    ENGINE_REQUEST_SECONDS.observe(time.perf_counter() - started)
+    record_search(result)
+    
+    # Kết quả của bộ tìm kiếm tích hợp yếu hơn ElephantEye, không lưu vào bộ nhớ đệm
+    if params is not None and not isinstance(engine.transport, BuiltinTransport):
+        cache.put(key, params, result)
+    return result
+
+
+def record_search(result):
+    if result.stopped:
+        ENGINE_STOPPED.inc()
+    if result.depth:
+        ENGINE_SEARCH_DEPTH.observe(result.depth)
+        ENGINE_LAST_DEPTH.set(result.depth)
+    if result.nodes and result.time:
+        ENGINE_SEARCH_NPS.observe(result.nodes / result.time)
+        ENGINE_LAST_NPS.set(round(result.nodes / result.time))
+
+
+class EngineLoop:
+    # Một event loop chạy nền dùng chung cho mọi bàn cờ, thay cho một luồng mỗi nước đi
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def submit(self, coroutine):
+        # Trả về concurrent.futures.Future; gọi cancel() sẽ hủy coroutine trong event loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+    
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1.0)
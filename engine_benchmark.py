@@ -0,0 +1,218 @@
+import argparse
+import contextlib
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import metrics
+from elephanteye import SEARCH_DEPTH, SEARCH_TIMEOUT, SubprocessTransport, create_transport, position_from_moves
+from engine_async import EngineLoop, search_with_pool
+from engine_cache import EngineCache
+from engine_pool import EnginePool
+from xiangqi import Position, move_to_ucci, start_position, ucci_to_move
+
+# Đo độ trễ đầu-cuối của một nước đi qua đúng đường đi của chess.py: search_with_pool với EnginePool, EngineLoop và
+# bộ nhớ đệm, theo từng giai đoạn. Mặc định dùng một engine UCCI giả chạy như tiến trình con (chính tệp này với
+# --fake-engine) để tách phần truyền tải / giao thức khỏi thời gian tìm kiếm thật
+# Ví dụ: python engine_benchmark.py --positions 500 --think-ms 20 --json latency.json
+#        python engine_benchmark.py --transport tcp  (đo với ElephantEye thật)
+BENCHMARK_POSITIONS = 200
+FAKE_THINK_MS = 20  # Thời gian "suy nghĩ" của engine giả cho mỗi lệnh go
+FAKE_INFO_LINES = 4  # Số dòng info engine giả in ra trước bestmove
+PERCENTILES = (50, 95, 99)
+BENCHMARK_CACHE = ":memory:"  # Bộ nhớ đệm SQLite trong bộ nhớ, không đụng tới tệp đệm của chess.py
+
+# Các giai đoạn của một nước đi, lấy từng giá trị ghi vào histogram tương ứng qua metrics.add_hook:
+# cache: tra bộ nhớ đệm; acquire: chờ mượn phiên từ pool; send: gửi "position" và "go"; first_line: chờ dòng đầu tiên;
+# search: chờ tới bestmove; parse: analyze_response; request: toàn bộ search_with_pool
+PHASE_HISTOGRAMS = {
+    'cache': "engine_cache_lookup_seconds",
+    'acquire': "engine_pool_wait_seconds",
+    'send': "engine_send_seconds",
+    'first_line': "engine_first_line_seconds",
+    'search': "engine_search_seconds",
+    'parse': "engine_parse_seconds",
+    'request': "engine_request_seconds",
+}
+# dispatch: chuyển yêu cầu sang event loop và nhận kết quả về (total - request); total: đo từ luồng gọi
+PHASES = tuple(PHASE_HISTOGRAMS) + ("dispatch", "total")
+
+
+def run_fake_engine(think_ms, jitter_ms, info_lines):
+    # Engine UCCI giả: trả lời bắt tay, "suy nghĩ" think_ms rồi đi nước hợp lệ đầu tiên của thế cờ
+    position = start_position()
+    rng = random.Random(0)
+    
+    def write(*lines):
+        sys.stdout.write("".join(line + "\n" for line in lines))
+        sys.stdout.flush()
+    
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == "ucci":
+            write("id name Fake UCCI", "id version 0.0", "ucciok")
+        elif command == "isready":
+            write("readyok")
+        elif command == "position":
+            moves_index = tokens.index("moves") if "moves" in tokens else len(tokens)
+            position = Position.from_fen(" ".join(tokens[2:moves_index])) if tokens[1] == "fen" else start_position()
+            for text in tokens[moves_index + 1:]:
+                position.make_move(ucci_to_move(text))
+        elif command == "go":
+            think = max(0.0, think_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+            moves = position.legal_moves()
+            if not moves:
+                write("nobestmove")
+                continue
+            best = move_to_ucci(moves[0])
+            for depth in range(1, info_lines + 1):
+                time.sleep(think / info_lines)
+                write(f"info depth {depth} score {depth * 3} pv {best}")
+            write(f"info time {int(think * 1000)} nodes {info_lines * 1000}", f"bestmove {best}")
+        elif command == "quit":
+            break
+
+
+def sample_positions(count, seed, max_plies=60):
+    # (tham số lệnh "position", khóa Zobrist) của các thế cờ lấy từ những ván đi ngẫu nhiên
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = start_position()
+        moves = []
+        for _ in range(rng.randrange(1, max_plies)):
+            legal = position.legal_moves()
+            if not legal:
+                break
+            move = rng.choice(legal)
+            position.make_move(move)
+            moves.append(move_to_ucci(move))
+        positions.append((position_from_moves(moves), position.key))
+    return positions
+
+
+def percentile(values, percent):
+    # Phân vị theo hạng gần nhất
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        **{f"p{percent}_ms": round(percentile(values, percent) * 1000, 3) for percent in PERCENTILES},
+        'max_ms': round(max(values) * 1000, 3),
+    }
+
+
+def run(transport_kind=None, count=BENCHMARK_POSITIONS, depth=SEARCH_DEPTH, think_ms=FAKE_THINK_MS, jitter_ms=0,
+        seed=1, cache_path=BENCHMARK_CACHE):
+    if transport_kind:
+        transport_factory = lambda: create_transport(transport_kind)
+    else:
+        command = [sys.executable, __file__, "--fake-engine", "--think-ms", str(think_ms), "--jitter-ms", str(jitter_ms)]
+        transport_factory = lambda: SubprocessTransport(command)
+    
+    # Một phiên và không dùng phiên dự phòng, để chỉ đo engine đã chọn
+    pool = EnginePool(1, transport_factory, fallback="")
+    start = time.perf_counter()
+    if not pool.start():
+        raise ConnectionError("Không khởi động được engine")
+    connect = time.perf_counter() - start
+    
+    loop = EngineLoop()
+    cache = EngineCache(cache_path) if cache_path else None
+    phases = {phase: [] for phase in PHASES}
+    phase_of = {name: phase for phase, name in PHASE_HISTOGRAMS.items()}
+    
+    def record(name, value):
+        # Gọi từ luồng event loop, trước khi search_with_pool trả kết quả về luồng này
+        phase = phase_of.get(name)
+        if phase is not None:
+            phases[phase].append(value)
+    
+    missing = 0
+    metrics.add_hook(record)
+    try:
+        for position, key in sample_positions(count, seed):
+            start = time.perf_counter()
+            result = loop.submit(search_with_pool(pool, position, depth=depth, timeout=SEARCH_TIMEOUT,
+                                                  cache=cache, key=key)).result()
+            total = time.perf_counter() - start
+            if result is None:
+                raise ConnectionError("Không mượn được phiên engine")
+            phases['total'].append(total)
+            phases['dispatch'].append(total - phases['request'][-1])
+            if result.bestmove is None:
+                missing += 1
+    finally:
+        metrics.remove_hook(record)
+        loop.close()
+        pool.close()
+        if cache is not None:
+            cache.close()
+    
+    return {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'transport': transport_kind or "fake",
+        'think_ms': None if transport_kind else think_ms,
+        'depth': depth,
+        'cache': cache_path or None,
+        'connect_ms': round(connect * 1000, 3),
+        'positions': count,
+        'cache_hits': cache.hits if cache is not None else 0,
+        'missing_bestmove': missing,
+        'phases': {phase: summarize(values) for phase, values in phases.items() if values},
+    }
+
+
+def print_report(results):
+    print(f"Kết nối + bắt tay UCCI: {results['connect_ms']:.1f} ms ({results['transport']})")
+    if results['cache']:
+        print(f"Bộ nhớ đệm {results['cache']}: {results['cache_hits']}/{results['positions']} lần trúng")
+    print(f"{'giai đoạn':<12}{'trung bình':>12}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES) + f"{'max':>10}")
+    for phase, stats in results['phases'].items():
+        print(f"{phase:<12}{stats['mean_ms']:>12.3f}" + "".join(f"{stats[f'p{p}_ms']:>10.3f}" for p in PERCENTILES)
+              + f"{stats['max_ms']:>10.3f}")
+    if results['missing_bestmove']:
+        print(f"{results['missing_bestmove']} thế cờ không có bestmove")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo độ trễ từng giai đoạn của một nước đi qua search_with_pool")
+    parser.add_argument("--transport", choices=("ssh", "local", "tcp", "builtin"),
+                        help="Đo với engine thật qua kiểu kết nối này thay vì engine giả")
+    parser.add_argument("--positions", type=int, default=BENCHMARK_POSITIONS, help="Số thế cờ cần đo")
+    parser.add_argument("--depth", type=int, default=SEARCH_DEPTH, help="Độ sâu gửi trong lệnh go")
+    parser.add_argument("--think-ms", type=float, default=FAKE_THINK_MS, help="Thời gian suy nghĩ của engine giả")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Dao động ngẫu nhiên của thời gian suy nghĩ")
+    parser.add_argument("--seed", type=int, default=1, help="Hạt giống cho các ván ngẫu nhiên")
+    parser.add_argument("--cache", default=BENCHMARK_CACHE,
+                        help="Tệp bộ nhớ đệm cho search_with_pool (\"\" để tắt, mặc định trong bộ nhớ)")
+    parser.add_argument("--json", help="Ghi kết quả ra tệp JSON (\"-\" để in ra màn hình)")
+    parser.add_argument("--fake-engine", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.fake_engine:
+        run_fake_engine(args.think_ms, args.jitter_ms, FAKE_INFO_LINES)
+        sys.exit(0)
+    
+    # Khi in JSON ra stdout, mọi dòng khác (kể cả từ EnginePool) chuyển sang stderr
+    output = contextlib.redirect_stdout(sys.stderr) if args.json == "-" else contextlib.nullcontext()
+    with output:
+        results = run(args.transport, args.positions, args.depth, args.think_ms, args.jitter_ms, args.seed, args.cache)
+        print_report(results)
+    if args.json == "-":
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi kết quả vào {args.json}")
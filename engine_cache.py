@@ -0,0 +1,107 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from elephanteye import ENGINE_OPTIONS, SearchResult
+
+# Bộ nhớ đệm kết quả tìm kiếm trên đĩa, khóa là khóa Zobrist của thế cờ và tham số tìm kiếm
+CACHE_PATH = os.environ.get("ELEPHANTEYE_CACHE_PATH", "engine_cache.sqlite3")
+CACHE_MAX_ENTRIES = int(os.environ.get("ELEPHANTEYE_CACHE_SIZE", "100000"))
+CACHE_EVICT_BATCH = 0.1  # Khi đầy, xóa 10% số mục lâu nhất không dùng đến
+
+
+def search_params(depth=None, movetime=None):
+    # Chuỗi mô tả tham số tìm kiếm; thay đổi tham số ElephantEye cũng làm khóa thay đổi
+    options = ",".join(f"{name}={value}" for name, value in ENGINE_OPTIONS)
+    return f"depth={depth} movetime={movetime} {options}"
+
+
+class EngineCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()  # Dùng chung từ luồng pygame và event loop của ElephantEye
+        self.hits = 0
+        self.misses = 0
+        
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key INTEGER NOT NULL, params TEXT NOT NULL,"
+            " bestmove TEXT, score INTEGER, depth INTEGER, nodes INTEGER, time REAL, pv TEXT,"
+            " last_used REAL NOT NULL, PRIMARY KEY (key, params))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.db.commit()
+        self.entries = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    
+    @staticmethod
+    def db_key(key):
+        # SQLite chỉ lưu số nguyên có dấu 64 bit
+        return key - (1 << 64) if key >= (1 << 63) else key
+    
+    def get(self, key, params):
+        # Trả về SearchResult đã lưu hoặc None, đồng thời đánh dấu mục vừa được dùng
+        with self.lock:
+            row = self.db.execute(
+                "SELECT bestmove, score, depth, nodes, time, pv FROM results WHERE key = ? AND params = ?",
+                (self.db_key(key), params),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self.db.execute("UPDATE results SET last_used = ? WHERE key = ? AND params = ?",
+                            (time.time(), self.db_key(key), params))
+            self.db.commit()
+        
+        bestmove, score, depth, nodes, elapsed, pv = row
+        return SearchResult(bestmove, score, depth, nodes, elapsed, json.loads(pv))
+    
+    def put(self, key, params, result):
+        # Chỉ lưu kết quả tìm kiếm hoàn chỉnh, không lưu kết quả bị dừng sớm
+        if result is None or result.stopped or not result.bestmove:
+            return
+        
+        with self.lock:
+            exists = self.db.execute("SELECT 1 FROM results WHERE key = ? AND params = ?",
+                                     (self.db_key(key), params)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (key, params, bestmove, score, depth, nodes, time, pv, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.db_key(key), params, result.bestmove, result.score, result.depth, result.nodes,
+                 result.time, json.dumps(result.pv), time.time()),
+            )
+            if not exists:
+                self.entries += 1
+            
+            if self.entries > self.max_entries:
+                self.evict()
+            self.db.commit()
+    
+    def evict(self):
+        # Gọi khi đang giữ self.lock: xóa các mục lâu nhất không được dùng (LRU)
+        count = self.entries - self.max_entries + int(self.max_entries * CACHE_EVICT_BATCH)
+        self.db.execute(
+            "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY last_used LIMIT ?)",
+            (count,),
+        )
+        self.entries = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': self.entries,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
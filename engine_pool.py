@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import os
+import threading
+import time
+
+import metrics
+from elephanteye import ElephantEyeEngine, create_transport
+
+# Số phiên ElephantEye giữ sẵn, dùng chung cho tất cả các bàn cờ
+POOL_SIZE = int(os.environ.get("ELEPHANTEYE_POOL_SIZE", "1"))
+
+# Kiểu kết nối dự phòng khi không phiên ElephantEye nào khởi động được ("" để tắt)
+FALLBACK_TRANSPORT = os.environ.get("ELEPHANTEYE_FALLBACK", "builtin")
+
+POOL_WAIT_SECONDS = metrics.histogram("engine_pool_wait_seconds", "Thời gian chờ mượn một phiên ElephantEye")
+POOL_RECONNECTS = metrics.counter("engine_pool_reconnects_total", "Số lần khởi động lại phiên bị mất kết nối")
+
+
+class _AsyncWaiter:
+    # Một yêu cầu đang xếp hàng chờ phiên ElephantEye rảnh, đánh thức qua event loop của coroutine đang chờ
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.engine = None
+        self.enqueued_at = time.time()
+    
+    def deliver(self, engine):
+        self.engine = engine
+        self.wake()
+    
+    def wake(self):
+        self.loop.call_soon_threadsafe(self.set_done)
+    
+    def set_done(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class EnginePool:
+    def __init__(self, size=POOL_SIZE, transport_factory=create_transport, fallback=FALLBACK_TRANSPORT):
+        self.size = size
+        self.transport_factory = transport_factory
+        self.fallback = fallback
+        self.fallback_active = False  # True nếu pool đang dùng phiên dự phòng thay cho ElephantEye
+        self.engines = []
+        self.idle = collections.deque()
+        self.waiters = collections.deque()  # Hàng đợi FIFO, ai đến trước được phục vụ trước
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.started = False
+        self.connected = False
+        self.closed = False
+        
+        # Thống kê thời gian chờ
+        self.total_leases = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+    
+    def start(self):
+        # Nhiều bàn cờ dùng chung pool nhưng chỉ khởi động một lần
+        with self.start_lock:
+            if not self.started:
+                self.started = True
+                self.start_engines()
+        return self.connected
+    
+    def start_engines(self):
+        # Khởi động song song các phiên, mỗi phiên chỉ bắt tay ucci/setoption một lần
+        engines = [ElephantEyeEngine(self.new_transport()) for _ in range(self.size)]
+        threads = [threading.Thread(target=engine.start) for engine in engines]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        engines = [engine for engine in engines if engine.connected]
+        print(f"Đã khởi động {len(engines)}/{self.size} phiên ElephantEye")
+        
+        if not engines and self.fallback:
+            # Không kết nối được ElephantEye: dùng một phiên dự phòng để vẫn chơi được
+            engine = ElephantEyeEngine(self.new_transport(True))
+            if engine.start():
+                print(f"Dùng phiên dự phòng \"{self.fallback}\" thay cho ElephantEye")
+                engines = [engine]
+                self.fallback_active = True
+        
+        with self.lock:
+            self.engines = engines
+            for engine in self.engines:
+                self.hand_over(engine)
+            self.connected = len(self.engines) > 0
+    
+    def new_transport(self, fallback=False):
+        if fallback:
+            return create_transport(self.fallback)
+        return self.transport_factory()
+    
+    def hand_over(self, engine):
+        # Gọi khi đang giữ self.lock: giao phiên cho yêu cầu chờ lâu nhất hoặc đưa về hàng rảnh
+        if self.waiters:
+            self.waiters.popleft().deliver(engine)
+        else:
+            self.idle.append(engine)
+    
+    def record_wait(self, waited):
+        self.total_leases += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.last_wait = waited
+        POOL_WAIT_SECONDS.observe(waited)
+    
+    async def acquire_async(self, timeout=None):
+        # Mượn một phiên ElephantEye, trả về None nếu hết thời gian chờ; chờ trong event loop nên có thể bị hủy
+        with self.lock:
+            if self.closed or not self.connected:
+                return None
+            
+            if self.idle and not self.waiters:
+                self.record_wait(0.0)
+                return self.idle.popleft()
+            
+            waiter = _AsyncWaiter(asyncio.get_running_loop())
+            self.waiters.append(waiter)
+        
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self.abandon(waiter)
+            return None
+        except asyncio.CancelledError:
+            self.abandon(waiter)
+            raise
+        
+        with self.lock:
+            if waiter.engine is not None:
+                self.record_wait(time.time() - waiter.enqueued_at)
+            return waiter.engine
+    
+    def abandon(self, waiter):
+        # Yêu cầu bị hủy hoặc hết hạn: rời hàng đợi, trả lại phiên nếu vừa được giao
+        with self.lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif waiter.engine is not None:
+                self.hand_over(waiter.engine)
+                waiter.engine = None
+    
+    async def release_async(self, engine):
+        # Kết nối lại một phiên hỏng có thể mất vài giây, không chạy trong event loop
+        if engine.connected:
+            self.release(engine)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.release, engine)
+    
+    def release(self, engine):
+        # Trả phiên về pool; phiên bị mất kết nối sẽ được khởi động lại
+        if not engine.connected and not self.closed:
+            print("Phiên ElephantEye bị mất kết nối, đang kết nối lại...")
+            POOL_RECONNECTS.inc()
+            engine.stop()
+            engine = ElephantEyeEngine(self.new_transport(self.fallback_active))
+            if not engine.start():
+                with self.lock:
+                    self.engines = [e for e in self.engines if e.connected]
+                    self.connected = len(self.engines) > 0
+                    
+                    # Không còn phiên nào: báo cho các yêu cầu đang chờ
+                    if not self.connected:
+                        while self.waiters:
+                            self.waiters.popleft().wake()
+                return
+        
+        with self.lock:
+            if self.closed:
+                engine.stop()
+                return
+            
+            if engine not in self.engines:
+                self.engines = [e for e in self.engines if e.connected] + [engine]
+            self.hand_over(engine)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.engines),
+                'fallback': self.fallback_active,
+                'idle': len(self.idle),
+                'busy': len(self.engines) - len(self.idle),
+                'queue_depth': len(self.waiters),
+                'leases': self.total_leases,
+                'avg_wait': self.total_wait / self.total_leases if self.total_leases else 0.0,
+                'max_wait': self.max_wait,
+                'last_wait': self.last_wait,
+            }
+    
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.connected = False
+            engines = self.engines
+            self.engines = []
+            self.idle.clear()
+            
+            # Đánh thức các yêu cầu đang chờ để chúng nhận None
+            while self.waiters:
+                self.waiters.popleft().wake()
+        
+        for engine in engines:
+            engine.stop()
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from xiangqi import FILES, RANKS
+
+# Nhận dạng quân cờ trực tiếp tại 90 giao điểm đã biết thay vì chạy HoughCircles trên cả ảnh
+# Mỗi giao điểm ứng với một ô vuông nhỏ (patch) cắt từ cùng một khung hình bằng sliding_window_view (không sao chép),
+# rồi chấm điểm cả 90 ô một lượt: viền quân cờ là một đường tròn quanh giao điểm nên gradient trên vành khuyên
+# hướng theo bán kính, còn các đường kẻ bàn cờ, sông và khung viền cắt ngang vành khuyên cho gradient theo phương tiếp tuyến
+# Chỉ lấy mẫu RING_ANGLES x RING_RADII điểm trên vành khuyên, đủ ổn định mà rẻ hơn nhiều so với đọc cả vành
+RING_INNER = 0.30  # Bán kính trong của vành khuyên, tính theo kích thước ô
+RING_OUTER = 0.48  # Bán kính ngoài của vành khuyên
+RING_ANGLES = 48
+RING_RADII = 4
+# Điểm tối thiểu để coi là có quân. Ảnh mẫu board_1753175979.png: ô có quân >= 10, ô trống <= -3,
+# lưới lệch tới khoảng 10% kích thước ô vẫn tách được hai nhóm
+EDGE_THRESHOLD = 3.0
+# ChangeGate: giao điểm được nhận dạng lại khi trung bình |chênh lệch| mức xám trong patch so với lần nhận dạng trước
+# vượt ngưỡng này. Quân cờ đến hoặc rời đi làm thay đổi hàng chục mức xám, nhiễu chụp màn hình dưới 1
+CHANGE_THRESHOLD = 2.0
+
+
+def estimate_cell_size(grid_points):
+    # Trung vị khoảng cách giữa các giao điểm kề nhau theo hàng và theo cột
+    points = np.asarray(grid_points, dtype=np.float32).reshape(RANKS, FILES, 2)
+    across = np.hypot(*np.diff(points, axis=1).reshape(-1, 2).T)
+    down = np.hypot(*np.diff(points, axis=0).reshape(-1, 2).T)
+    return float(np.median(np.concatenate((across, down))))
+
+
+class GridDetector:
+    def __init__(self, grid_points, cell_size=None, threshold=EDGE_THRESHOLD):
+        # grid_points: 90 tọa độ (x, y) theo thứ tự hàng rồi cột, ví dụ kết quả get_grid_points()
+        points = np.rint(np.asarray(grid_points, dtype=np.float32).reshape(-1, 2)).astype(np.intp)
+        if len(points) != RANKS * FILES:
+            raise ValueError(f"Cần {RANKS * FILES} giao điểm, nhận được {len(points)}")
+        self.points = points
+        self.cell_size = cell_size or estimate_cell_size(grid_points)
+        self.threshold = threshold
+        # Patch vuông cạnh size, đủ chứa vành khuyên và thêm một pixel mỗi phía để tính gradient
+        self.half = int(np.ceil(RING_OUTER * self.cell_size)) + 1
+        self.size = 2 * self.half + 1
+        
+        # Các điểm mẫu trên vành khuyên (tọa độ nguyên so với tâm) cùng vectơ đơn vị theo bán kính tại đó
+        angles = np.linspace(0, 2 * np.pi, RING_ANGLES, endpoint=False)
+        radii = np.linspace(RING_INNER, RING_OUTER, RING_RADII) * self.cell_size
+        self.unit_x = np.tile(np.cos(angles), RING_RADII).astype(np.float32)
+        self.unit_y = np.tile(np.sin(angles), RING_RADII).astype(np.float32)
+        self.ring_x = np.rint(np.repeat(radii, RING_ANGLES) * self.unit_x).astype(np.intp)
+        self.ring_y = np.rint(np.repeat(radii, RING_ANGLES) * self.unit_y).astype(np.intp)
+        self.shape = None
+    
+    def prepare(self, shape):
+        # Chỉ số của từng pixel cần đọc trong patch của mỗi giao điểm, tính lại khi kích thước khung hình đổi
+        # Giao điểm sát mép ảnh: patch được dịch vào trong ảnh, pixel nằm ngoài ảnh lấy theo pixel mép gần nhất
+        height, width = shape
+        if height < self.size or width < self.size:
+            raise ValueError(f"Ảnh {width}x{height} nhỏ hơn patch {self.size}x{self.size}")
+        x, y = self.points[:, 0], self.points[:, 1]
+        self.top = np.clip(y - self.half, 0, height - self.size)
+        self.left = np.clip(x - self.half, 0, width - self.size)
+        
+        def index(offset_y, offset_x):
+            rows = np.clip((y - self.top)[:, None] + self.ring_y + offset_y, 0, self.size - 1)
+            cols = np.clip((x - self.left)[:, None] + self.ring_x + offset_x, 0, self.size - 1)
+            return rows, cols
+        
+        self.neighbours = [index(0, 1), index(0, -1), index(1, 0), index(-1, 0)]
+        self.shape = shape
+    
+    def scores(self, gray, index=None):
+        # Điểm mỗi giao điểm: trung bình trên các điểm mẫu của |gradient theo bán kính| - |gradient theo tiếp tuyến|
+        # index: chỉ chấm điểm các giao điểm này (mảng chỉ số 0-89), mặc định cả 90
+        gray = np.asarray(gray)
+        if gray.shape != self.shape:
+            self.prepare(gray.shape)
+        if index is None:
+            index = slice(None)
+        windows = sliding_window_view(gray, (self.size, self.size))
+        top, left = self.top[index, None], self.left[index, None]
+        right, leftside, below, above = (windows[top, left, rows[index], cols[index]].astype(np.float32)
+                                         for rows, cols in self.neighbours)
+        gx = right - leftside
+        gy = below - above
+        radial = np.abs(gx * self.unit_x + gy * self.unit_y)
+        tangential = np.abs(gx * self.unit_y - gy * self.unit_x)
+        return (radial - tangential).mean(axis=1)
+    
+    def detect(self, gray):
+        # Trả về (state, scores) dạng (10, 9): state là 1 tại giao điểm có quân, 0 nếu trống
+        scores = self.scores(gray).reshape(RANKS, FILES)
+        return (scores > self.threshold).astype(int), scores
+
+
+class ChangeGate:
+    # Chỉ nhận dạng lại những giao điểm có patch thay đổi so với lần nhận dạng trước của chính giao điểm đó
+    # Tổng |chênh lệch| trong mỗi patch lấy từ ảnh tích phân (integral image) của cv2.absdiff: 4 phép tra mỗi giao điểm
+    def __init__(self, detector, threshold=CHANGE_THRESHOLD):
+        self.detector = detector
+        self.threshold = threshold
+        self.reference = None  # Ảnh xám tại lần nhận dạng gần nhất của từng patch
+        self.scores = np.zeros(RANKS * FILES, dtype=np.float32)
+        self.state = np.zeros((RANKS, FILES), dtype=int)
+    
+    def changed(self, gray):
+        # Mảng bool (90,): patch nào thay đổi đáng kể. Khung hình đầu tiên hoặc đổi kích thước: tất cả
+        # Ảnh tham chiếu chỉ được cập nhật tại các patch thay đổi, nên thay đổi chậm qua nhiều khung hình vẫn cộng dồn
+        detector = self.detector
+        if self.reference is None or self.reference.shape != gray.shape:
+            detector.prepare(gray.shape)
+            self.reference = gray.copy()
+            return np.ones(RANKS * FILES, dtype=bool)
+        integral = cv2.integral(cv2.absdiff(gray, self.reference))
+        top, left = detector.top, detector.left
+        bottom, right = top + detector.size, left + detector.size
+        sums = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+        changed = sums > self.threshold * detector.size * detector.size
+        for i in np.flatnonzero(changed):
+            self.reference[top[i]:bottom[i], left[i]:right[i]] = gray[top[i]:bottom[i], left[i]:right[i]]
+        return changed
+    
+    def detect(self, gray):
+        # Trả về (state, changed): state (10, 9) như GridDetector.detect, chỉ chấm điểm lại các giao điểm thay đổi
+        # Không giao điểm nào thay đổi thì không tốn thêm phép tính nào và state giữ nguyên
+        changed = self.changed(gray)
+        if changed.any():
+            index = np.flatnonzero(changed)
+            self.scores[index] = self.detector.scores(gray, index)
+            self.state = (self.scores > self.detector.threshold).astype(int).reshape(RANKS, FILES)
+        return self.state, changed
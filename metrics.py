@@ -0,0 +1,247 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Đo đếm đơn giản cho engine, nhận dạng ảnh và giao diện: bộ đếm, giá trị hiện tại (gauge), histogram và span đo thời gian
+# Xuất ra dạng văn bản Prometheus qua HTTP (METRICS_PORT) và/hoặc ghi định kỳ vào tệp JSONL (METRICS_JSONL)
+# Không đặt biến môi trường nào thì chỉ ghi nhận trong bộ nhớ, chi phí mỗi lần ghi rất nhỏ
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))  # 0: không mở cổng HTTP
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_JSONL = os.environ.get("METRICS_JSONL", "")  # Đường dẫn tệp JSONL, rỗng: không ghi
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "10"))  # Chu kỳ ghi JSONL (giây)
+
+# Ngưỡng histogram mặc định cho thời gian (giây)
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JSONL_PERCENTILES = (50, 95, 99)
+
+# Các hàm hook(name, value) được gọi sau mỗi lần ghi vào histogram, kể cả từ span
+# Ví dụ engine_benchmark.py dùng để lấy từng giá trị đo thay vì chỉ số đếm theo bucket
+_hooks = ()
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+    
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+    
+    def prometheus(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+    
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    # Giá trị gần nhất, ví dụ độ sâu của lần tìm kiếm vừa xong
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+    
+    def set(self, value):
+        self.value = value
+    
+    def prometheus(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+    
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Phần tử cuối: lớn hơn ngưỡng cao nhất (+Inf)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+    
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+        for hook in _hooks:
+            hook(self.name, value)
+    
+    def percentile(self, percent):
+        # Ước lượng theo ngưỡng trên của bucket chứa phân vị (giá trị lớn nhất nếu rơi vào +Inf)
+        if not self.count:
+            return 0.0
+        target = percent / 100 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+    
+    def prometheus(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        with self.lock:
+            for bucket, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{le="{bucket}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+            lines.append(f"{self.name}_sum {self.sum}")
+            lines.append(f"{self.name}_count {self.count}")
+        return lines
+    
+    def snapshot(self):
+        # Giữ khóa để count, sum và các bucket dùng cho phân vị thuộc cùng một thời điểm
+        with self.lock:
+            snapshot = {'count': self.count, 'sum': round(self.sum, 6), 'max': round(self.max, 6)}
+            if self.count:
+                snapshot['mean'] = round(self.sum / self.count, 6)
+                for percent in JSONL_PERCENTILES:
+                    snapshot[f"p{percent}"] = self.percentile(percent)
+        return snapshot
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+    
+    def get(self, kind, name, help_text, *args):
+        # Cùng tên thì dùng lại đối tượng cũ, để các module có thể khai báo ngay khi import
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = kind(name, help_text, *args)
+            elif not isinstance(metric, kind):
+                raise ValueError(f"Metric {name} đã được khai báo với kiểu khác")
+            return metric
+    
+    def prometheus(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text=""):
+    return REGISTRY.get(Counter, name, help_text)
+
+
+def gauge(name, help_text=""):
+    return REGISTRY.get(Gauge, name, help_text)
+
+
+def histogram(name, help_text="", buckets=TIME_BUCKETS):
+    return REGISTRY.get(Histogram, name, help_text, buckets)
+
+
+def add_hook(hook):
+    global _hooks
+    _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook):
+    global _hooks
+    _hooks = tuple(h for h in _hooks if h is not hook)
+
+
+@contextmanager
+def span(name, help_text=""):
+    # Đo thời gian một khối lệnh vào histogram <name>_seconds, kể cả khi khối lệnh ném ngoại lệ
+    observer = histogram(f"{name}_seconds", help_text)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observer.observe(time.perf_counter() - start)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    # Phục vụ http://host:port/metrics trong một luồng nền
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print(f"Metrics Prometheus tại http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def write_jsonl(path):
+    # Ghi một dòng ảnh chụp toàn bộ metrics vào cuối tệp
+    line = json.dumps({'ts': round(time.time(), 3), 'metrics': REGISTRY.snapshot()}, ensure_ascii=False)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def start_jsonl_writer(path=METRICS_JSONL, interval=METRICS_INTERVAL):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_jsonl(path)
+            except OSError as e:
+                print(f"Không ghi được metrics vào {path}: {e}")
+    
+    thread = threading.Thread(target=loop)
+    thread.daemon = True
+    thread.start()
+    print(f"Ghi metrics vào {path} mỗi {interval:g} giây")
+    return thread
+
+
+_started = False
+
+
+def setup():
+    # Gọi một lần khi chương trình khởi động: mở các đầu ra đã cấu hình bằng biến môi trường
+    global _started
+    if _started:
+        return
+    _started = True
+    if METRICS_PORT:
+        start_http_server()
+    if METRICS_JSONL:
+        start_jsonl_writer()
+        # Chương trình chạy ngắn hơn một chu kỳ vẫn có một dòng kết quả
+        atexit.register(write_jsonl, METRICS_JSONL)
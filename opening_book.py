@@ -0,0 +1,214 @@
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+
+from xiangqi import (ADVISOR, BISHOP, CANNON, KING, KNIGHT, PAWN, ROOK, START_FEN, Position, move_dst, move_src,
+                     move_to_ucci, piece_type, square_x, square_y, ucci_to_move)
+
+# Sách khai cuộc: tệp nhị phân gồm các bản ghi (khóa Zobrist u64, nước đi u16, trọng số u16)
+# sắp xếp theo khóa rồi theo nước đi, đọc bằng mmap và tìm kiếm nhị phân
+BOOK_PATH = os.environ.get("ELEPHANTEYE_BOOK_PATH", "book.bin")
+BOOK_MAX_PLY = 30  # Chỉ lấy các nước đầu ván khi dựng sách
+BOOK_RECORD = struct.Struct("<QHH")
+BOOK_GAME_EXTENSIONS = (".pgn", ".iccs", ".ucci", ".txt")
+
+UCCI_MOVE = re.compile(r"^[a-i][0-9][a-i][0-9]$")
+ICCS_MOVE = re.compile(r"^[A-Ia-i][0-9]-[A-Ia-i][0-9]$")
+MOVE_NUMBER = re.compile(r"^\d+\.+")
+GAME_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SKIPPED_TOKENS = ("position", "startpos", "moves")
+
+# Ký hiệu quân trong WXF (khi đọc, H/E được coi là N/B)
+WXF_LETTERS = {KING: "K", ADVISOR: "A", BISHOP: "B", KNIGHT: "N", ROOK: "R", CANNON: "C", PAWN: "P"}
+
+
+class OpeningBook:
+    def __init__(self, path=BOOK_PATH):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = size // BOOK_RECORD.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b""
+    
+    def key_at(self, index):
+        return BOOK_RECORD.unpack_from(self.data, index * BOOK_RECORD.size)[0]
+    
+    def lookup(self, key):
+        # Tìm kiếm nhị phân bản ghi đầu tiên có khóa key, trả về danh sách (nước đi UCCI, trọng số)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        
+        entries = []
+        for index in range(low, self.count):
+            record_key, move, weight = BOOK_RECORD.unpack_from(self.data, index * BOOK_RECORD.size)
+            if record_key != key:
+                break
+            entries.append((move_to_ucci(move), weight))
+        return entries
+    
+    def choose(self, position, rng=random):
+        # Chọn ngẫu nhiên theo trọng số một nước hợp lệ trong sách, None nếu thế cờ không có trong sách
+        entries = [(move, weight) for move, weight in self.lookup(position.key)
+                   if weight > 0 and position.is_legal(ucci_to_move(move))]
+        if not entries:
+            return None
+        return rng.choices([move for move, _ in entries], [weight for _, weight in entries])[0]
+    
+    def close(self):
+        if self.count:
+            self.data.close()
+        self.file.close()
+
+
+def load_book(path=BOOK_PATH):
+    # Sách khai cuộc là tùy chọn: không có tệp thì mọi nước đi đều hỏi ElephantEye
+    if not os.path.exists(path):
+        return None
+    book = OpeningBook(path)
+    print(f"Đã tải sách khai cuộc {path}: {book.count} bản ghi")
+    return book
+
+
+# --- Dựng sách từ các ván cờ ---
+
+def wxf_file(x, red):
+    # Số cột WXF tính từ phải sang trái theo hướng nhìn của bên đi
+    return 9 - x if red else x + 1
+
+
+def wxf_notations(position, move):
+    # Các cách viết WXF của một nước đi, gồm cả dạng quân trước / quân sau (+R.5, R+.5) khi hai quân cùng cột
+    src, dst = move_src(move), move_dst(move)
+    piece = position.board[src]
+    kind = piece_type(piece)
+    red = position.red_to_move
+    x, y, nx, ny = square_x(src), square_y(src), square_x(dst), square_y(dst)
+    
+    if ny == y:
+        action = "."
+    else:
+        action = "+" if (ny > y) == red else "-"
+    if kind in (KNIGHT, BISHOP, ADVISOR) or action == ".":
+        target = wxf_file(nx, red)
+    else:
+        target = abs(ny - y)
+    
+    letter = WXF_LETTERS[kind]
+    notations = [f"{letter}{wxf_file(x, red)}{action}{target}"]
+    
+    same_file = [square_y(sq) for sq in range(x, len(position.board), 9) if position.board[sq] == piece]
+    if len(same_file) == 2:
+        front = y == (max(same_file) if red else min(same_file))
+        tandem = "+" if front else "-"
+        notations += [f"{tandem}{letter}{action}{target}", f"{letter}{tandem}{action}{target}"]
+    return notations
+
+
+def parse_move(position, token):
+    # Nhận nước đi dạng UCCI (h2e2), ICCS (H2-E2) hoặc WXF (C2.5), trả về nước đi hợp lệ hoặc None
+    if UCCI_MOVE.match(token):
+        move = ucci_to_move(token)
+    elif ICCS_MOVE.match(token):
+        move = ucci_to_move(token.replace("-", "").lower())
+    else:
+        text = token.upper().replace("=", ".").replace("E", "B").replace("H", "N")
+        matches = [move for move in position.legal_moves() if text in wxf_notations(position, move)]
+        return matches[0] if len(matches) == 1 else None
+    return move if position.is_legal(move) else None
+
+
+def movetext_tokens(text):
+    # Bỏ chú thích, nhánh phụ, số thứ tự nước và kết quả ván cờ trong phần nước đi
+    text = re.sub(r"\{[^}]*\}|;[^\n]*", " ", text)
+    while re.search(r"\([^()]*\)", text):
+        text = re.sub(r"\([^()]*\)", " ", text)
+    
+    tokens = []
+    for token in text.split():
+        token = MOVE_NUMBER.sub("", token)
+        if token and token not in GAME_RESULTS and token not in SKIPPED_TOKENS:
+            tokens.append(token)
+    return tokens
+
+
+def read_games(path):
+    # Mỗi ván là (FEN xuất phát, danh sách token nước đi); tệp PGN có thể chứa nhiều ván, tệp khác mỗi dòng một ván
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        content = f.read()
+    
+    if not path.lower().endswith(".pgn"):
+        return [(START_FEN, movetext_tokens(line)) for line in content.splitlines() if line.strip()]
+    
+    games = []
+    movetext = []
+    fen = START_FEN
+    for line in content.splitlines() + ["[End"]:
+        if line.startswith("["):
+            # Thẻ mới sau phần nước đi: kết thúc ván trước
+            if movetext:
+                games.append((fen, movetext_tokens(" ".join(movetext))))
+                movetext = []
+                fen = START_FEN
+            tag = re.match(r'\[FEN\s+"([^"]*)"', line)
+            if tag:
+                fen = tag.group(1)
+        else:
+            movetext.append(line)
+    return games
+
+
+def build_book(directory, output=BOOK_PATH, max_ply=BOOK_MAX_PLY):
+    counts = {}
+    games = 0
+    skipped = 0
+    
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.lower().endswith(BOOK_GAME_EXTENSIONS):
+                continue
+            
+            for fen, tokens in read_games(os.path.join(root, name)):
+                try:
+                    position = Position.from_fen(fen)
+                except ValueError:
+                    skipped += 1
+                    continue
+                for token in tokens[:max_ply]:
+                    move = parse_move(position, token)
+                    if move is None:
+                        skipped += 1
+                        break
+                    entry = (position.key, move)
+                    counts[entry] = counts.get(entry, 0) + 1
+                    position.make_move(move)
+                games += 1
+    
+    # Sắp xếp theo (khóa, nước đi) để tìm kiếm nhị phân; trọng số là số ván đã chơi nước đó
+    with open(output, "wb") as f:
+        for (key, move), count in sorted(counts.items()):
+            f.write(BOOK_RECORD.pack(key, move, min(count, 0xFFFF)))
+    
+    print(f"Đã dựng sách {output}: {len(counts)} bản ghi từ {games} ván ({skipped} ván dừng sớm do FEN hoặc nước đi không đọc được)")
+    return len(counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dựng sách khai cuộc từ thư mục các ván cờ PGN/ICCS/UCCI")
+    parser.add_argument("directory", help="Thư mục chứa các tệp ván cờ")
+    parser.add_argument("-o", "--output", default=BOOK_PATH, help="Tệp sách khai cuộc đầu ra")
+    parser.add_argument("--max-ply", type=int, default=BOOK_MAX_PLY, help="Số nước đầu ván được đưa vào sách")
+    args = parser.parse_args()
+    
+    if not os.path.isdir(args.directory):
+        print(f"Không tìm thấy thư mục {args.directory}")
+        sys.exit(1)
+    build_book(args.directory, args.output, args.max_ply)
@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+
+import metrics
+
+# Các công đoạn chạy song song nối với nhau bằng hàng đợi có giới hạn, dùng cho realtime_chinese_chess_tracker.py
+# Hàng đợi đầy thì bỏ phần tử cũ nhất: công đoạn chậm không làm công đoạn trước bị chặn và luôn xử lý khung hình mới nhất
+# Thời gian mỗi công đoạn ghi vào histogram pipeline_<tên>_seconds, số phần tử bị bỏ vào pipeline_<tên>_dropped_total
+QUEUE_SIZE = 1
+GET_TIMEOUT = 0.1  # Giây, để các luồng kiểm tra cờ dừng định kỳ khi không có dữ liệu
+JOIN_TIMEOUT = 2.0
+
+
+class DropOldestQueue(queue.Queue):
+    def __init__(self, name, maxsize=QUEUE_SIZE):
+        super().__init__(maxsize)
+        self.name = name
+        self.dropped = metrics.counter(f"pipeline_{name}_dropped_total", f"Số phần tử bị bỏ khỏi hàng đợi {name} khi đầy")
+    
+    def put(self, item, block=False, timeout=None):
+        # Không bao giờ chặn: hàng đợi đầy thì bỏ phần tử cũ nhất rồi thêm phần tử mới
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                self._get()
+                self.unfinished_tasks -= 1
+                self.dropped.inc()
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class Stage(threading.Thread):
+    # Một công đoạn: lấy phần tử từ inbox, gọi work(item), kết quả khác None được đưa sang outbox
+    # Công đoạn nguồn (không có inbox) gọi work(None) mỗi interval giây
+    # work có phương thức close() thì được gọi khi luồng kết thúc, trong chính luồng đó
+    def __init__(self, name, work, inbox=None, outbox=None, stop_event=None, interval=0.0):
+        super().__init__(name=name)
+        self.daemon = True
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event or threading.Event()
+        self.interval = interval
+        self.timer = metrics.histogram(f"pipeline_{name}_seconds", f"Thời gian xử lý một phần tử ở công đoạn {name}")
+        self.errors = metrics.counter(f"pipeline_{name}_errors_total", f"Số lỗi ở công đoạn {name}")
+    
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                item = None
+                if self.inbox is not None:
+                    try:
+                        item = self.inbox.get(timeout=GET_TIMEOUT)
+                    except queue.Empty:
+                        continue
+                start = time.perf_counter()
+                try:
+                    result = self.work(item)
+                except Exception as e:
+                    self.errors.inc()
+                    print(f"Lỗi ở công đoạn {self.name}: {e}")
+                    result = None
+                elapsed = time.perf_counter() - start
+                self.timer.observe(elapsed)
+                if result is not None and self.outbox is not None:
+                    self.outbox.put(result)
+                if self.inbox is None:
+                    self.stop_event.wait(max(0.0, self.interval - elapsed))
+        finally:
+            close = getattr(self.work, "close", None)
+            if close is not None:
+                close()
+
+
+def stop_stages(stages, stop_event):
+    stop_event.set()
+    for stage in stages:
+        stage.join(JOIN_TIMEOUT)
+
+
+def print_stats(stage_names, queues):
+    # Tóm tắt thời gian từng công đoạn (phân vị ước lượng theo bucket của histogram) và số phần tử bị bỏ
+    for name in stage_names:
+        timer = metrics.histogram(f"pipeline_{name}_seconds")
+        if not timer.count:
+            print(f"{name:<10} chưa xử lý phần tử nào")
+            continue
+        print(f"{name:<10} {timer.count:>7} lần, trung bình {timer.sum / timer.count * 1000:.2f} ms, "
+              f"p50 <= {timer.percentile(50) * 1000:g} ms, p95 <= {timer.percentile(95) * 1000:g} ms")
+    for pipe in queues:
+        print(f"Hàng đợi {pipe.name}: bỏ {pipe.dropped.value} phần tử cũ")
@@ -1,8 +1,18 @@
+import argparse
 import cv2
 import numpy as np
-import mss
+import os
+import queue
+import sys
+import threading
 import time
 
+import metrics
+from grid_detector import ChangeGate, GridDetector
+from pipeline import DropOldestQueue, Stage, print_stats, stop_stages
+from screen_capture import ScreenGrabber
+from xiangqi import start_position, ucci_to_move
+
 # --- Tham số cấu hình ---
 BOARD_ROWS = 10  # Cờ tướng: 10 hàng
 BOARD_COLS = 9   # Cờ tướng: 9 cột
@@ -14,6 +24,17 @@ CIRCLE_DETECT_PARAM = dict(
     minRadius=20,     # Bán kính nhỏ nhất của hình tròn cần phát hiện (pixel)
     maxRadius=25      # Bán kính lớn nhất của hình tròn cần phát hiện (pixel)
 )
+# "grid": kiểm tra trực tiếp 90 giao điểm bằng GridDetector; "hough": HoughCircles trên cả ảnh rồi gán vào giao điểm
+DETECTOR = os.environ.get("TRACKER_DETECTOR", "grid")
+# Chu kỳ chụp (ms) của công đoạn chụp màn hình, khoảng 30 fps. Khung hình không thay đổi chỉ tốn một lần so sánh
+# với ảnh tham chiếu nên có thể chụp dày
+FRAME_INTERVAL_MS = 33
+DISPLAY_POLL_MS = 10  # Thời gian tối đa luồng hiển thị chờ khung hình mới trước khi đọc phím bấm
+# Hướng bàn cờ trên màn hình. Mặc định quân đỏ ở dưới như ảnh mẫu: hàng ảnh trên cùng là hàng 9 của UCCI
+# TRACKER_RED_AT_BOTTOM=0: bàn cờ xoay ngược, quân đỏ ở trên, cột a nằm bên phải
+RED_AT_BOTTOM = os.environ.get("TRACKER_RED_AT_BOTTOM", "1") != "0"
+# Khai cuộc dùng cho --check (không có nước ăn quân, find_move chỉ nhận ra nước đi vào ô trống)
+CHECK_OPENING = "h2e2 h9g7 h0g2 i9h9 i0h0 b9c7 b0c2 c6c5 g3g4 b7b3".split()
 
 
 def select_roi(image):
@@ -24,15 +45,7 @@ def select_roi(image):
     return x, y, w, h
 
 
-def grab_screen(monitor):
-    with mss.mss() as sct:
-        img = np.array(sct.grab(monitor))
-        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        return img
-
-
-def detect_circles(board_img):
-    gray = cv2.cvtColor(board_img, cv2.COLOR_BGR2GRAY)
+def detect_circles(gray):
     gray = cv2.medianBlur(gray, 5)
     circles = cv2.HoughCircles(
         gray,
@@ -69,21 +82,36 @@ def get_grid_points(w, h, rows=BOARD_ROWS, cols=BOARD_COLS):
 
 
 def board_state_from_circles(circles, grid_points, threshold=30):
-    state = np.zeros((BOARD_ROWS, BOARD_COLS), dtype=int)
+    # Gán mỗi giao điểm cho hình tròn gần nhất bằng một ma trận khoảng cách 90 x N, không lặp từng cặp
+    # Trả về (state, assigned, distances): ô có quân khi hình tròn gần nhất cách giao điểm dưới threshold pixel,
+    # assigned là chỉ số hình tròn được gán (-1 nếu ô trống), distances là khoảng cách tới hình tròn đó (inf nếu trống)
+    shape = (BOARD_ROWS, BOARD_COLS)
     if circles is None or len(circles) == 0:
-        return state
-    for i in range(BOARD_ROWS):
-        for j in range(BOARD_COLS):
-            gx, gy = grid_points[i][j]
-            for c in circles:
-                cx, cy, r = c
-                if np.hypot(gx - cx, gy - cy) < threshold:
-                    state[i, j] = 1
-                    break
-    return state
+        return np.zeros(shape, dtype=int), np.full(shape, -1, dtype=int), np.full(shape, np.inf)
+
+    points = np.asarray(grid_points, dtype=np.float32).reshape(-1, 2)
+    centers = np.asarray(circles, dtype=np.float32).reshape(-1, 3)[:, :2]  # Tránh tràn số khi trừ uint16
+    matrix = np.hypot(points[:, 0, None] - centers[None, :, 0], points[:, 1, None] - centers[None, :, 1])
+
+    nearest = matrix.argmin(axis=1)
+    nearest_distance = matrix[np.arange(len(points)), nearest]
+    occupied = nearest_distance < threshold
 
+    state = occupied.astype(int).reshape(shape)
+    assigned = np.where(occupied, nearest, -1).reshape(shape)
+    distances = np.where(occupied, nearest_distance, np.inf).reshape(shape)
+    return state, assigned, distances
 
-def find_move(prev, curr):
+
+def square_name(i, j, red_at_bottom=RED_AT_BOTTOM):
+    # Ô ở hàng ảnh i (0 là hàng trên cùng), cột ảnh j theo ký hiệu UCCI: cột a-i, hàng 0 là hàng cuối của quân đỏ
+    col_map = 'abcdefghi'
+    if red_at_bottom:
+        return f"{col_map[j]}{BOARD_ROWS - 1 - i}"
+    return f"{col_map[BOARD_COLS - 1 - j]}{i}"
+
+
+def find_move(prev, curr, red_at_bottom=RED_AT_BOTTOM):
     # Tìm nước đi: vị trí từ 1->0 (rời đi), 0->1 (đến)
     move_from = None
     move_to = None
@@ -94,62 +122,168 @@ def find_move(prev, curr):
             if prev[i, j] == 0 and curr[i, j] == 1:
                 move_to = (i, j)
     if move_from and move_to:
-        # Chuyển sang ký hiệu cột (a-i) và hàng (0-9)
-        col_map = 'abcdefghi'
-        move_str = f"{col_map[move_from[1]]}{move_from[0]}{col_map[move_to[1]]}{move_to[0]}"
-        return move_str
+        return square_name(*move_from, red_at_bottom) + square_name(*move_to, red_at_bottom)
     return None
 
 
+def state_from_position(position, red_at_bottom=RED_AT_BOTTOM):
+    # Mảng chiếm chỗ (10, 9) theo hướng ảnh của một thế cờ, cùng dạng với kết quả nhận dạng
+    occupied = (np.frombuffer(bytes(position.board), dtype=np.int8) != 0).astype(int).reshape(BOARD_ROWS, BOARD_COLS)
+    return occupied[::-1] if red_at_bottom else occupied[:, ::-1]
+
+
+def check_opening(moves=CHECK_OPENING):
+    # Đi lại một khai cuộc qua find_move -> ucci_to_move -> is_legal với cả hai hướng bàn cờ
+    ok = True
+    for red_at_bottom in (True, False):
+        position = start_position()
+        prev = state_from_position(position, red_at_bottom)
+        for text in moves:
+            after = position.copy()
+            after.make_move(ucci_to_move(text))
+            curr = state_from_position(after, red_at_bottom)
+            move = find_move(prev, curr, red_at_bottom)
+            if move != text or not position.is_legal(ucci_to_move(move)):
+                print(f"Sai khác ({'đỏ ở dưới' if red_at_bottom else 'đỏ ở trên'}): cần {text}, nhận được {move}")
+                ok = False
+                break
+            position = after
+            prev = curr
+    print(f"Kiểm tra khai cuộc {len(moves)} nước: {'khớp' if ok else 'SAI'}")
+    return ok
+
+
+class FrameSource:
+    # Công đoạn chụp màn hình. Handle mss chỉ dùng được trong luồng đã tạo ra nó nên được mở ở lần gọi đầu tiên
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.grabber = None
+
+    def __call__(self, _):
+        if self.grabber is None:
+            self.grabber = ScreenGrabber(self.monitor)
+        # Thời gian chụp được Stage ghi vào pipeline_capture_seconds
+        frame = self.grabber.grab()
+        # Bộ đệm ảnh xám của grabber bị ghi đè ở lần chụp sau trong khi công đoạn nhận dạng có thể vẫn đang đọc
+        gray = self.grabber.gray(frame).copy()
+        return frame, gray
+
+    def close(self):
+        if self.grabber is not None:
+            self.grabber.close()
+
+
+def draw_state(frame, curr_state, circles, grid_points):
+    # Ảnh hiển thị: bản sao BGR của khung hình, vòng tròn xanh lá tại giao điểm có quân, đỏ là hình tròn Hough
+    vis = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    # Vẽ lưới
+    for i in range(BOARD_ROWS):
+        for j in range(BOARD_COLS):
+            color = (0, 255, 0) if curr_state[i, j] == 1 else (200, 200, 200)
+            cv2.circle(vis, grid_points[i][j], 8, color, 2)
+    # Vẽ quân cờ phát hiện được
+    if circles is not None and len(circles) > 0:
+        for c in circles:
+            cx, cy, r = c
+            cv2.circle(vis, (cx, cy), r, (0, 0, 255), 2)
+    return vis
+
+
 def main():
     print("Chương trình theo dõi bàn cờ tướng real-time. Nhấn 'q' để thoát.")
+    metrics.setup()
     # 1. Chụp màn hình ban đầu để chọn ROI
-    with mss.mss() as sct:
-        monitor = sct.monitors[1]  # Toàn màn hình chính
-        screen_img = np.array(sct.grab(monitor))
-        screen_img = cv2.cvtColor(screen_img, cv2.COLOR_BGRA2BGR)
+    with ScreenGrabber() as grabber:  # Toàn màn hình chính
+        screen_img = cv2.cvtColor(grabber.grab(), cv2.COLOR_BGRA2BGR)
     x, y, w, h = select_roi(screen_img)
     monitor_roi = {"top": y, "left": x, "width": w, "height": h}
 
     # 2. Tính toán các điểm nút giao trên bàn cờ
     grid_points = get_grid_points(w, h)
+    detector = GridDetector(grid_points)
+    gate = ChangeGate(detector)
+
+    prev_state = None
+
+    # Theo dõi thế cờ để in FEN, có thể nạp lại bằng: python chess.py "<FEN>"
+    position = start_position()
 
-    prev_state = np.zeros((BOARD_ROWS, BOARD_COLS), dtype=int)
-    first = True
-
-    while True:
-        board_img = grab_screen(monitor_roi)
-        circles = detect_circles(board_img)
-        curr_state = board_state_from_circles(circles, grid_points)
-
-        # Hiển thị trạng thái bàn cờ
-        vis = board_img.copy()
-        # Vẽ lưới
-        for i in range(BOARD_ROWS):
-            for j in range(BOARD_COLS):
-                color = (0, 255, 0) if curr_state[i, j] == 1 else (200, 200, 200)
-                cv2.circle(vis, grid_points[i][j], 8, color, 2)
-        # Vẽ quân cờ phát hiện được
-        if circles is not None and len(circles) > 0:
-            for c in circles:
-                cx, cy, r = c
-                cv2.circle(vis, (cx, cy), r, (0, 0, 255), 2)
-        cv2.imshow("Chess Board Tracking", vis)
-
-        # So sánh và in nước đi
-        if not first:
-            move = find_move(prev_state, curr_state)
+    def detect(item):
+        # Công đoạn nhận dạng: bỏ qua khung hình không có giao điểm nào thay đổi
+        frame, gray = item
+        circles = None
+        if DETECTOR == "hough":
+            with metrics.span("change_gate", "Thời gian so sánh khung hình với ảnh tham chiếu của từng giao điểm"):
+                changed = gate.changed(gray)
+            if changed.any():
+                with metrics.span("hough_detection", "Thời gian phát hiện hình tròn (HoughCircles)"):
+                    circles = detect_circles(gray)
+                with metrics.span("board_state", "Thời gian gán hình tròn vào các giao điểm"):
+                    curr_state, _, _ = board_state_from_circles(circles, grid_points)
+        else:
+            # Chỉ nhận dạng lại các giao điểm có patch thay đổi
+            with metrics.span("grid_detection", "Thời gian nhận dạng quân cờ tại 90 giao điểm"):
+                curr_state, changed = gate.detect(gray)
+        if not changed.any():
+            # Bàn cờ đứng yên: không chuyển gì sang các công đoạn sau
+            metrics.counter("frames_unchanged_total", "Số khung hình không có giao điểm nào thay đổi").inc()
+            return None
+        return frame, curr_state, circles
+
+    def infer(item):
+        # Công đoạn suy ra nước đi: so sánh với trạng thái trước và cập nhật thế cờ đang theo dõi
+        nonlocal prev_state
+        frame, curr_state, circles = item
+        if prev_state is not None:
+            with metrics.span("state_diff", "Thời gian so sánh trạng thái bàn cờ để tìm nước đi"):
+                move = find_move(prev_state, curr_state)
             if move:
                 print("Nước đi:", move)
-        else:
-            first = False
+                if position.is_legal(ucci_to_move(move)):
+                    position.make_move(ucci_to_move(move))
+                    print("FEN:", position.fen())
+                else:
+                    print("Nước đi không hợp lệ với thế cờ đang theo dõi, bỏ qua")
         prev_state = curr_state.copy()
+        return frame, curr_state, circles
 
-        key = cv2.waitKey(200)  # 200ms ~ 5fps
-        if key == ord('q'):
-            break
+    # 3. Chụp, nhận dạng và suy ra nước đi chạy ở các luồng riêng, nối bằng hàng đợi bỏ phần tử cũ nhất
+    # Cửa sổ OpenCV phải được cập nhật từ luồng chính nên công đoạn hiển thị chạy ngay trong vòng lặp dưới đây
+    stop_event = threading.Event()
+    frames = DropOldestQueue("frames")
+    detections = DropOldestQueue("detections")
+    views = DropOldestQueue("views")
+    stages = [
+        Stage("capture", FrameSource(monitor_roi), outbox=frames, stop_event=stop_event,
+              interval=FRAME_INTERVAL_MS / 1000),
+        Stage("detect", detect, frames, detections, stop_event),
+        Stage("state", infer, detections, views, stop_event),
+    ]
+    for stage in stages:
+        stage.start()
 
-    cv2.destroyAllWindows()
+    window_open = False
+    try:
+        while True:
+            # cv2.waitKey trả về ngay khi chưa có cửa sổ nào, nên chỉ đọc phím sau lần imshow đầu tiên
+            if window_open and cv2.waitKey(1) == ord('q'):
+                break
+            try:
+                frame, curr_state, circles = views.get(timeout=DISPLAY_POLL_MS / 1000)
+            except queue.Empty:
+                continue
+            with metrics.span("pipeline_display", "Thời gian xử lý một phần tử ở công đoạn display"):
+                cv2.imshow("Chess Board Tracking", draw_state(frame, curr_state, circles, grid_points))
+            window_open = True
+    finally:
+        stop_stages(stages, stop_event)
+        print_stats([stage.name for stage in stages] + ["display"], [frames, detections, views])
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Theo dõi bàn cờ tướng trên màn hình")
+    parser.add_argument("--check", action="store_true", help="Kiểm tra find_move với một khai cuộc đã biết rồi thoát")
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check_opening() else 1)
     main() 
\ No newline at end of file
@@ -0,0 +1,82 @@
+import argparse
+import time
+
+import cv2
+import mss
+import numpy as np
+
+# Chụp màn hình dùng chung cho realtime_chinese_chess_tracker.py và detect.py
+# Giữ một handle mss suốt phiên thay vì mở mss.mss() mỗi khung hình, bọc bộ đệm BGRA của mss thành mảng NumPy
+# không sao chép, và chỉ chuyển đổi sang ảnh xám / BGR khi cần, ghi vào các bộ đệm cấp phát sẵn
+# Lưu ý: handle mss chỉ dùng được trong luồng đã tạo ra nó, mỗi luồng chụp cần một ScreenGrabber riêng
+BENCHMARK_FRAMES = 100
+
+
+class ScreenGrabber:
+    def __init__(self, monitor=None):
+        # monitor: {"top", "left", "width", "height"}, mặc định toàn bộ màn hình chính
+        self.sct = mss.mss()
+        self.monitor = monitor or self.sct.monitors[1]
+        self.buffers = {}
+    
+    def buffer(self, name, shape):
+        # Bộ đệm đầu ra dùng lại giữa các khung hình, cấp phát lại khi kích thước vùng chụp thay đổi
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self.buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buffer
+    
+    def grab(self):
+        # Khung hình BGRA (height, width, 4): view trực tiếp vào bộ đệm của mss, không sao chép
+        # mss tạo bộ đệm mới cho mỗi lần chụp nên có thể chuyển khung hình này sang luồng khác
+        shot = self.sct.grab(self.monitor)
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+    
+    def gray(self, frame):
+        # Ảnh xám của khung hình BGRA, ghi đè lên cùng một bộ đệm mỗi lần gọi
+        return cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY, dst=self.buffer("gray", frame.shape[:2]))
+    
+    def bgr(self, frame):
+        # Ảnh BGR cho các bước cần 3 kênh (lưu PNG), ghi đè lên cùng một bộ đệm mỗi lần gọi
+        return cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR, dst=self.buffer("bgr", frame.shape[:2] + (3,)))
+    
+    def close(self):
+        self.sct.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def benchmark(monitor=None, frames=BENCHMARK_FRAMES):
+    # So sánh cách cũ (mở mss mỗi khung hình, np.array rồi cvtColor) với ScreenGrabber giữ handle
+    start = time.perf_counter()
+    for _ in range(frames):
+        with mss.mss() as sct:
+            image = cv2.cvtColor(np.array(sct.grab(monitor or sct.monitors[1])), cv2.COLOR_BGRA2BGR)
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    old = time.perf_counter() - start
+    
+    with ScreenGrabber(monitor) as grabber:
+        start = time.perf_counter()
+        for _ in range(frames):
+            grabber.gray(grabber.grab())
+        new = time.perf_counter() - start
+    print(f"mss.mss() mỗi khung hình: {frames / old:.1f} fps")
+    print(f"ScreenGrabber (BGRA -> xám): {frames / new:.1f} fps")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo tốc độ chụp màn hình")
+    parser.add_argument("--frames", type=int, default=BENCHMARK_FRAMES, help="Số khung hình cần chụp")
+    parser.add_argument("--region", type=int, nargs=4, metavar=("LEFT", "TOP", "WIDTH", "HEIGHT"),
+                        help="Chỉ chụp vùng này thay vì cả màn hình")
+    args = parser.parse_args()
+    
+    region = None
+    if args.region:
+        left, top, width, height = args.region
+        region = {"top": top, "left": left, "width": width, "height": height}
+    benchmark(region, args.frames)
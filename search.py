@@ -0,0 +1,652 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+from elephanteye import SearchResult
+from xiangqi import (ADVISOR, BISHOP, BLACK, CANNON, EMPTY, KING, KNIGHT, PAWN, ROOK, SQUARES, Position,
+                     move_to_ucci, square_x, square_y, start_position, ucci_to_move)
+
+# Bộ tìm kiếm alpha-beta viết bằng Python, chạy ngay trong tiến trình khi không kết nối được ElephantEye
+# Cũng có thể chạy như một engine UCCI độc lập: python search.py
+
+MATE_SCORE = 10000  # Cùng thang điểm với ElephantEye: >= 10000 là chiếu bí
+WIN_SCORE = MATE_SCORE - 100  # Điểm lớn hơn ngưỡng này là tìm thấy đường chiếu bí
+INFINITY = 20000
+MAX_DEPTH = 64
+MAX_PLY = 64
+
+TT_EXACT = 0
+TT_LOWER = 1  # Điểm thật >= điểm lưu (cắt beta)
+TT_UPPER = 2  # Điểm thật <= điểm lưu (không nước nào vượt alpha)
+TT_ENTRY_BYTES = 256  # Ước lượng bộ nhớ cho một mục bảng chuyển vị (dict + tuple)
+TT_MAX_ENTRIES = 1 << 20
+TT_DEFAULT_ENTRIES = 1 << 17
+SHARED_TT_ENTRY_BYTES = 16  # Mục của bảng dùng chung: hai số u64
+SHARED_TT_MAX_ENTRIES = 1 << 22
+DEFAULT_HASH_MB = 32
+
+# Thời gian tối đa cho một nước của bộ tìm kiếm tích hợp (giây), kể cả khi được yêu cầu "go depth"
+BUILTIN_TIME_LIMIT = float(os.environ.get("BUILTIN_ENGINE_TIME", "3.0"))
+TIME_CHECK_NODES = 1023  # Kiểm tra thời gian sau mỗi 1024 nút
+
+# Số tiến trình tìm kiếm song song (lazy SMP), có thể đổi bằng "setoption name Threads value N"
+SEARCH_THREADS = int(os.environ.get("BUILTIN_ENGINE_THREADS", "1"))
+MAX_THREADS = 64
+# Tạo tiến trình con bằng spawn: fork từ một tiến trình nhiều luồng (pygame, event loop) không an toàn
+SEARCH_PROCESS_CONTEXT = "spawn"
+HELPER_STOP_TIMEOUT = 5  # Thời gian chờ tiến trình phụ dừng sau khi tiến trình chính xong (giây)
+
+# Giá trị quân dùng để sắp xếp nước ăn quân (MVV-LVA): ăn quân giá trị cao bằng quân giá trị thấp trước
+MVV_LVA_VALUE = {EMPTY: 0, KING: 5, ADVISOR: 1, BISHOP: 1, KNIGHT: 3, ROOK: 4, CANNON: 3, PAWN: 1}
+
+# --- Bảng điểm quân theo ô (đã gồm giá trị quân), nhìn từ phía quân đỏ, hàng đầu tiên là hàng 9 ---
+
+PAWN_TABLE = (
+    (9, 9, 9, 11, 13, 11, 9, 9, 9),
+    (19, 24, 34, 42, 44, 42, 34, 24, 19),
+    (19, 24, 32, 37, 37, 37, 32, 24, 19),
+    (19, 23, 27, 29, 30, 29, 27, 23, 19),
+    (14, 18, 20, 27, 29, 27, 20, 18, 14),
+    (7, 0, 13, 0, 16, 0, 13, 0, 7),
+    (7, 0, 7, 0, 15, 0, 7, 0, 7),
+    (0, 0, 0, 0, 0, 0, 0, 0, 0),
+    (0, 0, 0, 0, 0, 0, 0, 0, 0),
+    (0, 0, 0, 0, 0, 0, 0, 0, 0),
+)
+
+KNIGHT_TABLE = (
+    (90, 90, 90, 96, 90, 96, 90, 90, 90),
+    (90, 96, 103, 97, 94, 97, 103, 96, 90),
+    (92, 98, 99, 103, 99, 103, 99, 98, 92),
+    (93, 108, 100, 107, 100, 107, 100, 108, 93),
+    (90, 100, 99, 103, 104, 103, 99, 100, 90),
+    (90, 98, 101, 102, 103, 102, 101, 98, 90),
+    (92, 94, 98, 95, 98, 95, 98, 94, 92),
+    (93, 92, 94, 95, 92, 95, 94, 92, 93),
+    (85, 90, 92, 93, 78, 93, 92, 90, 85),
+    (88, 85, 90, 88, 90, 88, 90, 85, 88),
+)
+
+ROOK_TABLE = (
+    (206, 208, 207, 213, 214, 213, 207, 208, 206),
+    (206, 212, 209, 216, 233, 216, 209, 212, 206),
+    (206, 208, 207, 214, 216, 214, 207, 208, 206),
+    (206, 213, 213, 216, 216, 216, 213, 213, 206),
+    (208, 211, 211, 214, 215, 214, 211, 211, 208),
+    (208, 212, 212, 214, 215, 214, 212, 212, 208),
+    (204, 209, 204, 212, 214, 212, 204, 209, 204),
+    (198, 208, 204, 212, 212, 212, 204, 208, 198),
+    (200, 208, 206, 212, 200, 212, 206, 208, 200),
+    (194, 206, 204, 212, 200, 212, 204, 206, 194),
+)
+
+CANNON_TABLE = (
+    (100, 100, 96, 91, 90, 91, 96, 100, 100),
+    (98, 98, 96, 92, 89, 92, 96, 98, 98),
+    (97, 97, 96, 91, 92, 91, 96, 97, 97),
+    (96, 99, 99, 98, 100, 98, 99, 99, 96),
+    (96, 96, 96, 96, 100, 96, 96, 96, 96),
+    (95, 96, 99, 96, 100, 96, 99, 96, 95),
+    (96, 96, 96, 96, 96, 96, 96, 96, 96),
+    (97, 96, 100, 99, 101, 99, 100, 96, 97),
+    (96, 97, 98, 98, 98, 98, 98, 97, 96),
+    (96, 96, 97, 99, 99, 99, 97, 96, 96),
+)
+
+# Tướng, sĩ, tượng chỉ đứng ở một số ô: (x, y) -> điểm
+KING_SQUARES = {(3, 0): 11, (4, 0): 15, (5, 0): 11, (3, 1): 2, (4, 1): 2, (5, 1): 2, (3, 2): 1, (4, 2): 1, (5, 2): 1}
+ADVISOR_SQUARES = {(3, 0): 20, (5, 0): 20, (4, 1): 23, (3, 2): 20, (5, 2): 20}
+BISHOP_SQUARES = {(2, 0): 20, (6, 0): 20, (0, 2): 18, (4, 2): 23, (8, 2): 18, (2, 4): 20, (6, 4): 20}
+
+
+def table_value(table, x, y):
+    return table[9 - y][x]
+
+
+def build_piece_square():
+    # PIECE_SQUARE[mã quân][ô]: điểm theo góc nhìn quân đỏ (quân đen mang dấu âm, đối xứng qua sông)
+    values = {
+        PAWN: lambda x, y: table_value(PAWN_TABLE, x, y),
+        KNIGHT: lambda x, y: table_value(KNIGHT_TABLE, x, y),
+        ROOK: lambda x, y: table_value(ROOK_TABLE, x, y),
+        CANNON: lambda x, y: table_value(CANNON_TABLE, x, y),
+        KING: lambda x, y: KING_SQUARES.get((x, y), 0),
+        ADVISOR: lambda x, y: ADVISOR_SQUARES.get((x, y), 0),
+        BISHOP: lambda x, y: BISHOP_SQUARES.get((x, y), 0),
+    }
+    table = [[0] * SQUARES for _ in range(16)]
+    for kind, value in values.items():
+        for sq in range(SQUARES):
+            x, y = square_x(sq), square_y(sq)
+            table[kind][sq] = value(x, y)
+            table[kind | BLACK][sq] = -value(x, 9 - y)
+    return table
+
+
+PIECE_SQUARE = build_piece_square()
+
+
+def evaluate(position):
+    # Điểm thế cờ theo góc nhìn quân đỏ; trong lúc tìm kiếm điểm được cập nhật dần theo từng nước
+    return sum(PIECE_SQUARE[piece][sq] for sq, piece in enumerate(position.board) if piece)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionTable:
+    # Bảng chuyển vị trong tiến trình: khóa Zobrist -> (độ sâu, loại, điểm, nước đi tốt nhất)
+    def __init__(self, entries=TT_DEFAULT_ENTRIES):
+        self.entries = entries
+        self.table = {}
+    
+    def get(self, key):
+        return self.table.get(key)
+    
+    def put(self, key, depth, flag, score, move):
+        # Bảng đầy thì xóa toàn bộ, đơn giản và đủ tốt cho thời gian suy nghĩ vài giây
+        if len(self.table) >= self.entries and key not in self.table:
+            self.table.clear()
+        self.table[key] = (depth, flag, score, move)
+
+
+class SharedTranspositionTable:
+    # Bảng chuyển vị trong bộ nhớ dùng chung giữa các tiến trình, mỗi mục là hai số u64:
+    # (khóa XOR dữ liệu, dữ liệu). Không cần khóa: mục bị ghi dở có khóa không khớp và bị bỏ qua
+    def __init__(self, array):
+        self.array = array  # multiprocessing.RawArray("Q", 2 * số mục)
+        self.words = memoryview(array).cast("B").cast("Q")
+        self.entries = len(self.words) // 2
+    
+    def get(self, key):
+        index = key % self.entries * 2
+        data = self.words[index + 1]
+        if not data or self.words[index] ^ data != key:
+            return None
+        return data >> 34, (data >> 32) & 3, ((data >> 16) & 0xFFFF) - 32768, data & 0xFFFF
+    
+    def put(self, key, depth, flag, score, move):
+        # Dữ liệu: nước đi (16 bit) | điểm + 32768 (16 bit) | loại (2 bit) | độ sâu
+        data = move | (score + 32768) << 16 | flag << 32 | depth << 34
+        index = key % self.entries * 2
+        self.words[index] = key ^ data
+        self.words[index + 1] = data
+
+
+class Searcher:
+    def __init__(self, table=None):
+        self.tt = table if table is not None else TranspositionTable()
+        self.history = [0] * 65536  # Điểm lịch sử theo nước đi 16 bit
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.nodes = 0
+        self.deadline = None
+        self.stop_event = None
+        self.root_best = 0
+        self.root_score = -INFINITY
+        self.node_counts = None  # Mảng dùng chung để tiến trình chính đọc số nút của tiến trình phụ
+        self.node_index = 0
+    
+    def search(self, position, depth=MAX_DEPTH, movetime=None, on_info=None, stop_event=None, start_depth=1):
+        # Tìm kiếm sâu dần cho đến depth hoặc hết movetime (giây), trả về SearchResult
+        # start_depth > 1 dùng cho tiến trình phụ của lazy SMP, để các tiến trình không cùng xét một độ sâu
+        start = time.time()
+        self.deadline = start + movetime if movetime is not None else None
+        self.stop_event = stop_event
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [value // 4 for value in self.history]
+        
+        position = position.copy()
+        material = evaluate(position)
+        if not position.legal_moves():
+            return SearchResult(None, -MATE_SCORE, 0, 0, 0.0, [])
+        
+        best_move = 0
+        best_score = 0
+        completed = 0
+        for current_depth in range(min(start_depth, depth), min(depth, MAX_DEPTH) + 1):
+            self.root_best = 0
+            self.root_score = -INFINITY
+            try:
+                score = self.alpha_beta(position, current_depth, -INFINITY, INFINITY, 0, material)
+            except SearchTimeout:
+                # Dùng kết quả dở dang nếu đã xét xong ít nhất một nước ở gốc
+                if self.root_best:
+                    best_move, best_score = self.root_best, self.root_score
+                break
+            
+            best_move, best_score = self.root_best, score
+            completed = current_depth
+            if on_info is not None:
+                elapsed = time.time() - start
+                on_info({
+                    'depth': current_depth,
+                    'score': score,
+                    'nodes': self.nodes,
+                    'time': elapsed,
+                    'nps': int(self.nodes / elapsed) if elapsed > 0 else 0,
+                    'pv': self.principal_variation(position, best_move, current_depth),
+                })
+            
+            # Đã tìm thấy đường chiếu bí thì không cần đi sâu hơn
+            if abs(score) > WIN_SCORE:
+                break
+        
+        if not best_move:
+            best_move = position.legal_moves()[0]
+        return SearchResult(move_to_ucci(best_move), best_score, completed, self.nodes, time.time() - start,
+                            self.principal_variation(position, best_move, max(completed, 1)))
+    
+    def check_time(self):
+        if self.node_counts is not None:
+            self.node_counts[self.node_index] = self.nodes
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchTimeout()
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise SearchTimeout()
+    
+    def alpha_beta(self, position, depth, alpha, beta, ply, material):
+        if depth <= 0:
+            return self.quiescence(position, alpha, beta, ply, material)
+        
+        self.nodes += 1
+        if self.nodes & TIME_CHECK_NODES == 0:
+            self.check_time()
+        
+        red = position.red_to_move
+        if ply:
+            # Lặp lại thế cờ trong cây tìm kiếm được tính là hòa (gần đúng luật lặp)
+            if position.repetition_count():
+                return 0
+            if ply >= MAX_PLY:
+                return material if red else -material
+        
+        in_check = position.in_check()
+        if in_check:
+            depth += 1  # Mở rộng khi bị chiếu
+        
+        # Tra bảng chuyển vị
+        hash_move = 0
+        entry = self.tt.get(position.key)
+        if entry is not None:
+            entry_depth, flag, entry_score, hash_move = entry
+            if ply and entry_depth >= depth:
+                entry_score = score_from_tt(entry_score, ply)
+                if flag == TT_EXACT:
+                    return entry_score
+                if flag == TT_LOWER and entry_score >= beta:
+                    return entry_score
+                if flag == TT_UPPER and entry_score <= alpha:
+                    return entry_score
+        
+        board = position.board
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        legal = 0
+        
+        for move in self.order_moves(position, position.generate_moves(), hash_move, ply):
+            src, dst = move & 0xFF, move >> 8
+            piece, captured = board[src], board[dst]
+            child_material = material + PIECE_SQUARE[piece][dst] - PIECE_SQUARE[piece][src] - PIECE_SQUARE[captured][dst]
+            
+            position.make_move(move)
+            if position.in_check(red):
+                position.unmake_move()
+                continue
+            legal += 1
+            score = -self.alpha_beta(position, depth - 1, -beta, -alpha, ply + 1, child_material)
+            position.unmake_move()
+            
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if ply == 0:
+                    self.root_best, self.root_score = move, score
+                if score > alpha:
+                    alpha = score
+                    if score >= beta:
+                        # Nước yên lặng gây cắt beta: ghi nhận vào killer và lịch sử
+                        if captured == EMPTY:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[move] += depth * depth
+                        break
+        
+        if not legal:
+            # Cờ tướng: hết nước đi (bị chiếu bí hoặc bí nước) là thua
+            return -MATE_SCORE + ply
+        
+        if best_score >= beta:
+            flag = TT_LOWER
+        elif best_score > original_alpha:
+            flag = TT_EXACT
+        else:
+            flag = TT_UPPER
+        self.tt.put(position.key, depth, flag, score_to_tt(best_score, ply), best_move)
+        return best_score
+    
+    def quiescence(self, position, alpha, beta, ply, material):
+        # Chỉ xét nước ăn quân (hoặc mọi nước nếu đang bị chiếu) để tránh đánh giá giữa chừng một loạt đổi quân
+        self.nodes += 1
+        if self.nodes & TIME_CHECK_NODES == 0:
+            self.check_time()
+        
+        red = position.red_to_move
+        stand_pat = material if red else -material
+        if ply >= MAX_PLY:
+            return stand_pat
+        
+        in_check = position.in_check()
+        if in_check:
+            best_score = -MATE_SCORE + ply
+            moves = position.generate_moves()
+        else:
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            best_score = stand_pat
+            moves = position.generate_moves(captures_only=True)
+        
+        board = position.board
+        for move in self.order_moves(position, moves, 0, ply):
+            src, dst = move & 0xFF, move >> 8
+            piece, captured = board[src], board[dst]
+            child_material = material + PIECE_SQUARE[piece][dst] - PIECE_SQUARE[piece][src] - PIECE_SQUARE[captured][dst]
+            
+            position.make_move(move)
+            if position.in_check(red):
+                position.unmake_move()
+                continue
+            score = -self.quiescence(position, -beta, -alpha, ply + 1, child_material)
+            position.unmake_move()
+            
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if score >= beta:
+                        break
+        return best_score
+    
+    def order_moves(self, position, moves, hash_move, ply):
+        # Thứ tự: nước trong bảng chuyển vị, ăn quân theo MVV-LVA, nước killer, rồi theo điểm lịch sử
+        board = position.board
+        killer_first, killer_second = self.killers[ply] if ply <= MAX_PLY else (0, 0)
+        history = self.history
+        
+        def move_order(move):
+            if move == hash_move:
+                return 1 << 30
+            victim = board[move >> 8]
+            if victim:
+                return (1 << 24) + MVV_LVA_VALUE[victim & 7] * 8 - MVV_LVA_VALUE[board[move & 0xFF] & 7]
+            if move == killer_first:
+                return (1 << 23) + 1
+            if move == killer_second:
+                return 1 << 23
+            return history[move]
+        
+        moves.sort(key=move_order, reverse=True)
+        return moves
+    
+    def principal_variation(self, position, best_move, length):
+        # Lần theo các nước tốt nhất trong bảng chuyển vị để dựng biến chính
+        position = position.copy()
+        pv = []
+        move = best_move
+        seen = set()
+        while move and len(pv) < length and position.key not in seen:
+            if move not in position.legal_moves():
+                break
+            seen.add(position.key)
+            pv.append(move_to_ucci(move))
+            position.make_move(move)
+            entry = self.tt.get(position.key)
+            move = entry[3] if entry else 0
+        return pv
+
+
+def score_to_tt(score, ply):
+    # Điểm chiếu bí lưu theo khoảng cách từ nút hiện tại, không phải từ gốc
+    if score > WIN_SCORE:
+        return score + ply
+    if score < -WIN_SCORE:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score > WIN_SCORE:
+        return score - ply
+    if score < -WIN_SCORE:
+        return score + ply
+    return score
+
+
+def helper_process(index, table_array, node_counts, tasks, results, stop_event):
+    # Tiến trình phụ của lazy SMP: tìm kiếm cùng thế cờ, chia sẻ kết quả qua bảng chuyển vị dùng chung
+    searcher = Searcher(SharedTranspositionTable(table_array))
+    searcher.node_counts = node_counts
+    searcher.node_index = index
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        search_id, position, depth, movetime, start_depth = task
+        result = searcher.search(position, depth, movetime, None, stop_event, start_depth)
+        node_counts[index] = result.nodes
+        results.put((search_id, index))
+
+
+class ParallelSearcher:
+    # Lazy SMP: tiến trình hiện tại và threads - 1 tiến trình phụ cùng tìm kiếm một thế cờ,
+    # dùng chung bảng chuyển vị; nước đi và thông tin tìm kiếm lấy từ tiến trình hiện tại
+    def __init__(self, threads, hash_mb=DEFAULT_HASH_MB):
+        self.threads = threads
+        self.context = multiprocessing.get_context(SEARCH_PROCESS_CONTEXT)
+        entries = max(1024, min((hash_mb << 20) // SHARED_TT_ENTRY_BYTES, SHARED_TT_MAX_ENTRIES))
+        self.table_array = self.context.RawArray("Q", 2 * entries)
+        self.node_counts = self.context.RawArray("Q", threads)
+        self.stop_event = self.context.Event()
+        self.results = self.context.Queue()
+        self.search_id = 0  # Gắn vào mỗi kết quả của tiến trình phụ để nhận ra kết quả trễ của lần tìm kiếm trước
+        self.tasks = []
+        self.processes = []
+        self.main = Searcher(SharedTranspositionTable(self.table_array))
+    
+    def start(self):
+        # Khởi động tiến trình phụ ở lần tìm kiếm đầu tiên, giữ lại cho các nước sau
+        for index in range(1, self.threads):
+            tasks = self.context.Queue()
+            process = self.context.Process(target=helper_process, args=(
+                index, self.table_array, self.node_counts, tasks, self.results, self.stop_event))
+            process.daemon = True
+            process.start()
+            self.tasks.append(tasks)
+            self.processes.append(process)
+    
+    def helper_nodes(self):
+        return sum(self.node_counts[1:])
+    
+    def search(self, position, depth=MAX_DEPTH, movetime=None, on_info=None, stop_event=None):
+        if not self.processes:
+            self.start()
+        
+        self.stop_event.clear()
+        self.search_id += 1
+        for index, tasks in enumerate(self.tasks, 1):
+            # Tiến trình phụ bắt đầu lệch độ sâu để các tiến trình không đi cùng một cây tìm kiếm
+            self.node_counts[index] = 0
+            tasks.put((self.search_id, position, depth, movetime, 1 + index % 2))
+        
+        def report(info):
+            # Số nút và tốc độ tính cho tất cả các tiến trình
+            info['nodes'] += self.helper_nodes()
+            info['nps'] = int(info['nodes'] / info['time']) if info['time'] > 0 else 0
+            on_info(info)
+        
+        try:
+            result = self.main.search(position, depth, movetime, report if on_info else None, stop_event)
+        finally:
+            self.stop_event.set()
+            pending = len(self.tasks)
+            while pending:
+                try:
+                    search_id, _ = self.results.get(timeout=HELPER_STOP_TIMEOUT)
+                except queue.Empty:
+                    print("Tiến trình tìm kiếm phụ không phản hồi", file=sys.stderr)
+                    break
+                # Kết quả của lần tìm kiếm trước, đến trễ sau khi đã hết thời gian chờ: bỏ qua
+                if search_id == self.search_id:
+                    pending -= 1
+        
+        result.nodes += self.helper_nodes()
+        return result
+    
+    def close(self):
+        self.stop_event.set()
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+        self.tasks = []
+        self.processes = []
+
+
+class UCCIEngine:
+    # Xử lý lệnh UCCI cho Searcher, để bộ tìm kiếm tích hợp dùng chung giao diện với ElephantEyeEngine
+    def __init__(self, write_line):
+        self.write_line = write_line
+        self.threads = SEARCH_THREADS
+        self.hash_mb = DEFAULT_HASH_MB
+        self.searcher = None  # Tạo ở lần "go" đầu tiên, sau khi đã nhận các lệnh setoption
+        self.position = start_position()
+        self.thread = None
+        self.stop_event = threading.Event()
+    
+    def handle(self, line):
+        # Trả về False khi nhận lệnh quit
+        tokens = line.split()
+        if not tokens:
+            return True
+        
+        command = tokens[0]
+        if command == "ucci":
+            self.write_line("id name Python alpha-beta")
+            self.write_line("id version 1.0")
+            self.write_line(f"option Hash type spin min 1 max {TT_MAX_ENTRIES * TT_ENTRY_BYTES >> 20} default {DEFAULT_HASH_MB}")
+            self.write_line(f"option Threads type spin min 1 max {MAX_THREADS} default {SEARCH_THREADS}")
+            self.write_line("ucciok")
+        elif command == "isready":
+            self.write_line("readyok")
+        elif command == "setoption":
+            self.set_option(tokens)
+        elif command == "position":
+            self.stop()
+            self.set_position(tokens)
+        elif command == "go":
+            self.stop()
+            self.go(tokens)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            self.close_searcher()
+            return False
+        return True
+    
+    def set_option(self, tokens):
+        # setoption name {Hash <MB> | Threads <N>} value ...; các tham số khác của ElephantEye được bỏ qua
+        if len(tokens) < 5 or tokens[3] != "value" or not tokens[4].isdigit():
+            return
+        if tokens[2] == "Hash":
+            self.hash_mb = max(1, int(tokens[4]))
+        elif tokens[2] == "Threads":
+            self.threads = max(1, min(int(tokens[4]), MAX_THREADS))
+        else:
+            return
+        self.stop()
+        self.close_searcher()
+    
+    def create_searcher(self):
+        if self.threads > 1:
+            return ParallelSearcher(self.threads, self.hash_mb)
+        entries = (self.hash_mb << 20) // TT_ENTRY_BYTES
+        return Searcher(TranspositionTable(max(1024, min(entries, TT_MAX_ENTRIES))))
+    
+    def close_searcher(self):
+        if isinstance(self.searcher, ParallelSearcher):
+            self.searcher.close()
+        self.searcher = None
+    
+    def set_position(self, tokens):
+        # position {fen <FEN> | startpos} [moves <nước đi> ...]
+        moves_index = tokens.index("moves") if "moves" in tokens else len(tokens)
+        try:
+            if len(tokens) > 1 and tokens[1] == "fen":
+                position = Position.from_fen(" ".join(tokens[2:moves_index]))
+            else:
+                position = start_position()
+            
+            for text in tokens[moves_index + 1:]:
+                position.make_move(ucci_to_move(text))
+        except (ValueError, IndexError) as e:
+            print(f"Lệnh position không hợp lệ: {e}", file=sys.stderr)
+            return
+        self.position = position
+    
+    def go(self, tokens):
+        # go [depth N | time T (ms) [movestogo M] [increment I] | infinite]
+        depth = MAX_DEPTH
+        movetime = BUILTIN_TIME_LIMIT
+        options = dict(zip(tokens[1::2], tokens[2::2]))
+        if "infinite" in tokens or "ponder" in tokens:
+            movetime = None
+        elif "depth" in options:
+            depth = int(options["depth"])
+        elif "time" in options:
+            moves_to_go = int(options.get("movestogo", 30))
+            movetime = min(BUILTIN_TIME_LIMIT, int(options["time"]) / 1000 / max(moves_to_go, 1))
+        
+        if self.searcher is None:
+            self.searcher = self.create_searcher()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run_search, args=(self.position, depth, movetime, self.stop_event))
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def run_search(self, position, depth, movetime, stop_event):
+        result = self.searcher.search(position, depth, movetime, self.write_info, stop_event)
+        if result.bestmove:
+            self.write_line(f"bestmove {result.bestmove}")
+        else:
+            self.write_line("nobestmove")
+    
+    def write_info(self, info):
+        # Cùng định dạng với ElephantEye để analyze_response đọc được: một dòng điểm/biến chính, một dòng thời gian/số nút
+        self.write_line(f"info depth {info['depth']} score {info['score']} pv {' '.join(info['pv'])}")
+        self.write_line(f"info time {int(info['time'] * 1000)} nodes {info['nodes']}")
+    
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+
+if __name__ == "__main__":
+    # Chạy như một engine UCCI qua stdin/stdout
+    engine = UCCIEngine(lambda line: print(line, flush=True))
+    for line in sys.stdin:
+        if not engine.handle(line.strip()):
+            break
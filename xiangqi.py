@@ -0,0 +1,526 @@
+# Lõi thế cờ tướng: bàn cờ 90 ô (mailbox) và sinh nước đi hợp lệ
+# Ô được đánh số sq = y * 9 + x, x là cột a-i (0-8), y là hàng 0-9 với hàng 0 là hàng cuối của quân đỏ
+
+import random
+from array import array
+
+FILES = 9
+RANKS = 10
+SQUARES = FILES * RANKS
+
+# Mã quân cờ: loại quân, cộng thêm BLACK nếu là quân đen
+EMPTY = 0
+KING = 1
+ADVISOR = 2
+BISHOP = 3
+KNIGHT = 4
+ROOK = 5
+CANNON = 6
+PAWN = 7
+BLACK = 8
+
+RED_SIDE = 0
+BLACK_SIDE = 1
+
+# FEN: chữ hoa là quân đỏ, chữ thường là quân đen; khi đọc chấp nhận cả E/H thay cho B/N
+START_FEN = "rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1"
+FEN_LETTERS = {KING: "k", ADVISOR: "a", BISHOP: "b", KNIGHT: "n", ROOK: "r", CANNON: "c", PAWN: "p"}
+FEN_PIECES = {"k": KING, "a": ADVISOR, "b": BISHOP, "e": BISHOP, "n": KNIGHT, "h": KNIGHT,
+              "r": ROOK, "c": CANNON, "p": PAWN}
+
+# Kết quả kiểm tra lặp thế cờ, tính cho bên đang đến lượt
+REPETITION_NONE = 0
+REPETITION_DRAW = 1
+REPETITION_WIN = 2  # Đối phương chiếu mãi / đuổi mãi
+REPETITION_LOSS = 3  # Bên đang đến lượt chiếu mãi / đuổi mãi
+
+
+def square(x, y):
+    return y * FILES + x
+
+
+def square_x(sq):
+    return sq % FILES
+
+
+def square_y(sq):
+    return sq // FILES
+
+
+def piece_type(piece):
+    return piece & 7
+
+
+def piece_is_red(piece):
+    return piece != EMPTY and piece < BLACK
+
+
+def piece_side(piece):
+    return BLACK_SIDE if piece & BLACK else RED_SIDE
+
+
+# Nước đi được mã hóa trong 16 bit: ô xuất phát ở 8 bit thấp, ô đích ở 8 bit cao
+def make_move(src, dst):
+    return src | (dst << 8)
+
+
+def move_src(move):
+    return move & 0xFF
+
+
+def move_dst(move):
+    return move >> 8
+
+
+def move_to_ucci(move):
+    src, dst = move_src(move), move_dst(move)
+    return f"{chr(97 + square_x(src))}{square_y(src)}{chr(97 + square_x(dst))}{square_y(dst)}"
+
+
+def ucci_to_move(text):
+    return make_move(square(ord(text[0]) - 97, int(text[1])), square(ord(text[2]) - 97, int(text[3])))
+
+
+def on_board(x, y):
+    return 0 <= x < FILES and 0 <= y < RANKS
+
+
+def in_palace(x, y):
+    return 3 <= x <= 5 and (0 <= y <= 2 or 7 <= y <= 9)
+
+
+def own_half(sq, y):
+    # Tượng không được qua sông: ô đích phải cùng nửa bàn cờ với ô xuất phát
+    return (square_y(sq) <= 4) == (y <= 4)
+
+
+# --- Bảng nước đi tính sẵn cho từng ô ---
+
+ORTHOGONAL = ((0, 1), (0, -1), (1, 0), (-1, 0))
+DIAGONAL = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+KING_MOVES = [[] for _ in range(SQUARES)]
+ADVISOR_MOVES = [[] for _ in range(SQUARES)]
+BISHOP_MOVES = [[] for _ in range(SQUARES)]  # (ô đích, mắt tượng)
+KNIGHT_MOVES = [[] for _ in range(SQUARES)]  # (ô đích, chân mã)
+KNIGHT_ATTACKERS = [[] for _ in range(SQUARES)]  # (ô của mã, chân mã) có thể tấn công ô này
+RAYS = [[] for _ in range(SQUARES)]  # Bốn tia ngang/dọc theo thứ tự từ gần đến xa, dùng cho xe và pháo
+PAWN_MOVES = [[[] for _ in range(SQUARES)] for _ in range(2)]
+PAWN_ATTACKERS = [[[] for _ in range(SQUARES)] for _ in range(2)]
+
+for sq in range(SQUARES):
+    x, y = square_x(sq), square_y(sq)
+    
+    for dx, dy in ORTHOGONAL:
+        ray = []
+        nx, ny = x + dx, y + dy
+        while on_board(nx, ny):
+            ray.append(square(nx, ny))
+            nx, ny = nx + dx, ny + dy
+        RAYS[sq].append(ray)
+        
+        if in_palace(x, y) and in_palace(x + dx, y + dy):
+            KING_MOVES[sq].append(square(x + dx, y + dy))
+    
+    for dx, dy in DIAGONAL:
+        if in_palace(x, y) and in_palace(x + dx, y + dy):
+            ADVISOR_MOVES[sq].append(square(x + dx, y + dy))
+        
+        nx, ny = x + 2 * dx, y + 2 * dy
+        if on_board(nx, ny) and own_half(sq, ny):
+            BISHOP_MOVES[sq].append((square(nx, ny), square(x + dx, y + dy)))
+    
+    for dx, dy in ORTHOGONAL:
+        # Mã đi một bước thẳng (chân mã) rồi một bước chéo
+        leg_x, leg_y = x + dx, y + dy
+        if not on_board(leg_x, leg_y):
+            continue
+        for side in (-1, 1):
+            nx = leg_x + (dx if dx else side)
+            ny = leg_y + (dy if dy else side)
+            if on_board(nx, ny):
+                dst = square(nx, ny)
+                KNIGHT_MOVES[sq].append((dst, square(leg_x, leg_y)))
+                KNIGHT_ATTACKERS[dst].append((sq, square(leg_x, leg_y)))
+    
+    for side, forward in ((RED_SIDE, 1), (BLACK_SIDE, -1)):
+        crossed = y >= 5 if side == RED_SIDE else y <= 4
+        steps = [(0, forward)]
+        if crossed:
+            steps += [(1, 0), (-1, 0)]
+        for dx, dy in steps:
+            if on_board(x + dx, y + dy):
+                dst = square(x + dx, y + dy)
+                PAWN_MOVES[side][sq].append(dst)
+                PAWN_ATTACKERS[side][dst].append(sq)
+
+
+# --- Khóa Zobrist: mỗi (mã quân, ô) một số ngẫu nhiên 64 bit, cộng thêm một số cho lượt đen ---
+# Dùng seed cố định để khóa giống nhau giữa các lần chạy (bộ nhớ đệm, sách khai cuộc lưu theo khóa)
+
+ZOBRIST_SEED = 20240601
+_zobrist_random = random.Random(ZOBRIST_SEED)
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) if code & 7 else 0 for _ in range(SQUARES)] for code in range(16)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+
+class Position:
+    # Mô hình thế cờ gọn, không phụ thuộc pygame: mỗi ô một byte, lịch sử là các mảng số nguyên
+    __slots__ = ("board", "red_to_move", "kings", "key", "moves", "captures", "keys")
+    
+    def __init__(self):
+        self.board = bytearray(SQUARES)
+        self.red_to_move = True
+        self.kings = [None, None]  # Ô của tướng đỏ và tướng đen
+        self.key = 0  # Khóa Zobrist, cập nhật dần sau mỗi nước đi
+        
+        # Lịch sử để hoàn tác và kiểm tra lặp: nước đi (16 bit), quân bị ăn, khóa trước nước đi
+        self.moves = array("H")
+        self.captures = bytearray()
+        self.keys = array("Q")
+    
+    @classmethod
+    def from_pieces(cls, pieces, red_to_move=True):
+        # pieces: danh sách (mã quân, x, y)
+        position = cls()
+        for piece, x, y in pieces:
+            position.put(square(x, y), piece)
+        position.red_to_move = red_to_move
+        position.key = position.compute_key()
+        return position
+    
+    @classmethod
+    def from_fen(cls, fen):
+        # Hàng đầu tiên trong FEN là hàng 9 (phía quân đen); FEN sai định dạng gây ValueError
+        fields = fen.split()
+        rows = fields[0].split("/") if fields else []
+        if len(rows) != RANKS:
+            raise ValueError(f"FEN phải có {RANKS} hàng: {fen!r}")
+        
+        pieces = []
+        for index, row in enumerate(rows):
+            y = RANKS - 1 - index
+            x = 0
+            for char in row:
+                if char.isdigit():
+                    x += int(char)
+                elif char.lower() in FEN_PIECES:
+                    pieces.append((FEN_PIECES[char.lower()] | (0 if char.isupper() else BLACK), x, y))
+                    x += 1
+                else:
+                    raise ValueError(f"Ký tự không hợp lệ trong FEN: {char!r}")
+                if x > FILES:
+                    break
+            if x != FILES:
+                raise ValueError(f"Hàng {y} trong FEN phải có đúng {FILES} cột: {row!r}")
+        
+        side = fields[1] if len(fields) > 1 else "w"
+        if side not in ("w", "r", "b"):
+            raise ValueError(f"Lượt đi không hợp lệ trong FEN: {side!r}")
+        
+        position = cls.from_pieces(pieces, side != "b")
+        if None in position.kings:
+            raise ValueError("FEN phải có đủ tướng của hai bên")
+        return position
+    
+    def fen(self):
+        rows = []
+        for y in range(RANKS - 1, -1, -1):
+            row = ""
+            empty = 0
+            for x in range(FILES):
+                piece = self.board[square(x, y)]
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                letter = FEN_LETTERS[piece_type(piece)]
+                row += letter.upper() if piece_is_red(piece) else letter
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        return f"{'/'.join(rows)} {'w' if self.red_to_move else 'b'} - - 0 1"
+    
+    def copy(self):
+        position = Position()
+        position.board = bytearray(self.board)
+        position.red_to_move = self.red_to_move
+        position.kings = list(self.kings)
+        position.key = self.key
+        position.moves = array("H", self.moves)
+        position.captures = bytearray(self.captures)
+        position.keys = array("Q", self.keys)
+        return position
+    
+    def put(self, sq, piece):
+        self.key ^= ZOBRIST_PIECES[self.board[sq]][sq] ^ ZOBRIST_PIECES[piece][sq]
+        self.board[sq] = piece
+        if piece_type(piece) == KING:
+            self.kings[piece_side(piece)] = sq
+    
+    def compute_key(self):
+        # Tính lại khóa từ đầu, dùng khi dựng thế cờ mới hoặc để kiểm tra khóa cập nhật dần
+        key = 0 if self.red_to_move else ZOBRIST_BLACK_TO_MOVE
+        for sq, piece in enumerate(self.board):
+            key ^= ZOBRIST_PIECES[piece][sq]
+        return key
+    
+    def side_to_move(self):
+        return RED_SIDE if self.red_to_move else BLACK_SIDE
+    
+    def make_move(self, move):
+        src, dst = move_src(move), move_dst(move)
+        piece = self.board[src]
+        captured = self.board[dst]
+        self.moves.append(move)
+        self.captures.append(captured)
+        self.keys.append(self.key)
+        self.key ^= (ZOBRIST_PIECES[piece][src] ^ ZOBRIST_PIECES[piece][dst]
+                     ^ ZOBRIST_PIECES[captured][dst] ^ ZOBRIST_BLACK_TO_MOVE)
+        self.board[dst] = piece
+        self.board[src] = EMPTY
+        if piece_type(piece) == KING:
+            self.kings[piece_side(piece)] = dst
+        self.red_to_move = not self.red_to_move
+        return captured
+    
+    def unmake_move(self):
+        move = self.moves.pop()
+        captured = self.captures.pop()
+        self.key = self.keys.pop()
+        src, dst = move_src(move), move_dst(move)
+        piece = self.board[dst]
+        self.board[src] = piece
+        self.board[dst] = captured
+        if piece_type(piece) == KING:
+            self.kings[piece_side(piece)] = src
+        self.red_to_move = not self.red_to_move
+    
+    def generate_moves(self, captures_only=False):
+        # Sinh nước đi giả hợp lệ (chưa kiểm tra tướng bị chiếu)
+        board = self.board
+        side = self.side_to_move()
+        own = BLACK if side == BLACK_SIDE else 0
+        moves = []
+        
+        def add(src, dst):
+            target = board[dst]
+            if target == EMPTY:
+                if not captures_only:
+                    moves.append(src | (dst << 8))
+            elif (target & BLACK) != own:
+                moves.append(src | (dst << 8))
+        
+        for src in range(SQUARES):
+            piece = board[src]
+            if piece == EMPTY or (piece & BLACK) != own:
+                continue
+            kind = piece & 7
+            
+            if kind == ROOK:
+                for ray in RAYS[src]:
+                    for dst in ray:
+                        if board[dst] == EMPTY:
+                            if not captures_only:
+                                moves.append(src | (dst << 8))
+                        else:
+                            if (board[dst] & BLACK) != own:
+                                moves.append(src | (dst << 8))
+                            break
+            elif kind == CANNON:
+                for ray in RAYS[src]:
+                    screen = False
+                    for dst in ray:
+                        if not screen:
+                            if board[dst] == EMPTY:
+                                if not captures_only:
+                                    moves.append(src | (dst << 8))
+                            else:
+                                screen = True
+                        elif board[dst] != EMPTY:
+                            if (board[dst] & BLACK) != own:
+                                moves.append(src | (dst << 8))
+                            break
+            elif kind == KNIGHT:
+                for dst, leg in KNIGHT_MOVES[src]:
+                    if board[leg] == EMPTY:
+                        add(src, dst)
+            elif kind == PAWN:
+                for dst in PAWN_MOVES[side][src]:
+                    add(src, dst)
+            elif kind == BISHOP:
+                for dst, eye in BISHOP_MOVES[src]:
+                    if board[eye] == EMPTY:
+                        add(src, dst)
+            elif kind == ADVISOR:
+                for dst in ADVISOR_MOVES[src]:
+                    add(src, dst)
+            elif kind == KING:
+                for dst in KING_MOVES[src]:
+                    add(src, dst)
+        
+        return moves
+    
+    def is_attacked(self, sq, by_red):
+        # Ô sq có bị quân của bên by_red tấn công không (gồm cả luật hai tướng đối mặt)
+        board = self.board
+        enemy = 0 if by_red else BLACK
+        side = RED_SIDE if by_red else BLACK_SIDE
+        target_is_king = piece_type(board[sq]) == KING
+        
+        for direction, ray in enumerate(RAYS[sq]):
+            screen = False
+            for other in ray:
+                piece = board[other]
+                if piece == EMPTY:
+                    continue
+                if not screen:
+                    if piece == enemy | ROOK:
+                        return True
+                    # Hai tướng đối mặt trên cùng một cột (tia 0 và 1 là tia dọc)
+                    if target_is_king and direction < 2 and piece == enemy | KING:
+                        return True
+                    screen = True
+                else:
+                    if piece == enemy | CANNON:
+                        return True
+                    break
+        
+        for src, leg in KNIGHT_ATTACKERS[sq]:
+            if board[src] == enemy | KNIGHT and board[leg] == EMPTY:
+                return True
+        
+        for src in PAWN_ATTACKERS[side][sq]:
+            if board[src] == enemy | PAWN:
+                return True
+        
+        for src in KING_MOVES[sq]:
+            if board[src] == enemy | KING:
+                return True
+        
+        for src in ADVISOR_MOVES[sq]:
+            if board[src] == enemy | ADVISOR:
+                return True
+        
+        for src, eye in BISHOP_MOVES[sq]:
+            if board[src] == enemy | BISHOP and board[eye] == EMPTY:
+                return True
+        
+        return False
+    
+    def in_check(self, red=None):
+        # Tướng của bên red (mặc định là bên đang đi) có đang bị chiếu không
+        if red is None:
+            red = self.red_to_move
+        king = self.kings[RED_SIDE if red else BLACK_SIDE]
+        return king is not None and self.is_attacked(king, not red)
+    
+    def legal_moves(self):
+        moves = []
+        mover_is_red = self.red_to_move
+        for move in self.generate_moves():
+            self.make_move(move)
+            if not self.in_check(mover_is_red):
+                moves.append(move)
+            self.unmake_move()
+        return moves
+    
+    def is_legal(self, move):
+        if move not in self.generate_moves():
+            return False
+        mover_is_red = self.red_to_move
+        self.make_move(move)
+        legal = not self.in_check(mover_is_red)
+        self.unmake_move()
+        return legal
+    
+    def is_checkmate(self):
+        # Cờ tướng không có hòa do hết nước: bên hết nước đi là bên thua
+        return not self.legal_moves()
+    
+    def repetition_count(self):
+        # Số lần thế cờ hiện tại (cùng lượt đi) đã xuất hiện trước đó, dừng ở nước ăn quân gần nhất
+        count = 0
+        plies = len(self.moves)
+        for ply in range(plies - 1, -1, -1):
+            if (plies - ply) % 2 == 0 and self.keys[ply] == self.key:
+                count += 1
+            if self.captures[ply] != EMPTY:
+                break
+        return count
+    
+    def repetition(self, times=1):
+        # Xử lý lặp thế cờ khi thế hiện tại đã xuất hiện ít nhất times lần trước đó:
+        # bên chiếu mãi thua; nếu không ai chiếu mãi thì bên đuổi mãi thua; còn lại là hòa
+        if self.repetition_count() < times:
+            return REPETITION_NONE
+        
+        # Lấy chu kỳ lặp từ lần xuất hiện gần nhất
+        plies = 0
+        for ply in range(len(self.moves) - 2, -1, -2):
+            if self.keys[ply] == self.key:
+                plies = len(self.moves) - ply
+                break
+        
+        # Lùi về đầu chu kỳ rồi đi lại từng nước, ghi nhận nước nào chiếu / đuổi
+        cycle = list(self.moves[-plies:])
+        for _ in range(plies):
+            self.unmake_move()
+        
+        checks = [True, True]  # Theo bên đi nước: mọi nước trong chu kỳ đều chiếu
+        chases = [True, True]  # Mọi nước trong chu kỳ đều đuổi một quân không được bảo vệ
+        for move in cycle:
+            side = self.side_to_move()
+            self.make_move(move)
+            if not self.in_check():
+                checks[side] = False
+            if not self.is_chase(move_dst(move)):
+                chases[side] = False
+        
+        us = self.side_to_move()
+        them = 1 - us
+        if checks[us] != checks[them]:
+            return REPETITION_LOSS if checks[us] else REPETITION_WIN
+        if not checks[us] and chases[us] != chases[them]:
+            return REPETITION_LOSS if chases[us] else REPETITION_WIN
+        return REPETITION_DRAW
+    
+    def is_chase(self, sq):
+        # Gần đúng luật đuổi: quân vừa đi tới sq đe dọa ăn một quân (trừ tướng và tốt) không được bảo vệ
+        # Chưa xét các trường hợp đặc biệt như quân bị ghim hay đổi quân ngang giá
+        piece = self.board[sq]
+        self.red_to_move = not self.red_to_move
+        targets = [move_dst(move) for move in self.generate_moves(captures_only=True) if move_src(move) == sq]
+        self.red_to_move = not self.red_to_move
+        
+        for target in targets:
+            if piece_type(self.board[target]) in (KING, PAWN):
+                continue
+            # Quân bị đuổi được bảo vệ nếu bên nó có thể ăn lại sau khi bị ăn
+            self.make_move(make_move(sq, target))
+            protected = self.is_attacked(target, not piece_is_red(piece))
+            self.unmake_move()
+            if not protected:
+                return True
+        return False
+
+
+def start_position():
+    return Position.from_fen(START_FEN)
+
+
+def perft(position, depth):
+    # Đếm số thế cờ ở độ sâu depth, dùng để kiểm tra bộ sinh nước đi
+    if depth == 0:
+        return 1
+    
+    nodes = 0
+    mover_is_red = position.red_to_move
+    for move in position.generate_moves():
+        position.make_move(move)
+        if not position.in_check(mover_is_red):
+            nodes += 1 if depth == 1 else perft(position, depth - 1)
+        position.unmake_move()
+    return nodes